@@ -2,12 +2,21 @@ try:
     from ._version import version as __version__
 except ImportError:
     __version__ = "unknown"
-from ._sample_data import make_sample_data
-from ._widget import (
-    SegmentTrunkWidget,
-)
 
 __all__ = (
     "make_sample_data",
     "SegmentTrunkWidget",
 )
+
+
+def __getattr__(name):
+    """Import the sample data and the widget only when they are used, so that napari can load the manifest of the
+    plugin without importing the image processing and machine learning libraries."""
+
+    if name == "make_sample_data":
+        from ._sample_data import make_sample_data
+        return make_sample_data
+    if name == "SegmentTrunkWidget":
+        from ._widget import SegmentTrunkWidget
+        return SegmentTrunkWidget
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,225 @@
+"""
+Benchmarks of the stages of the pipeline on synthetic tree discs. Run them with
+
+    pytest -m perf --benchmark-only src/napari_tree_rings/_tests/test_benchmarks.py
+
+The sizes of the discs are read from the environment variable TREE_RINGS_BENCHMARK_SIZES, for example
+TREE_RINGS_BENCHMARK_SIZES=2000,8000,20000 (default 2000), the numbers of workers of the parallel measurements from
+TREE_RINGS_BENCHMARK_WORKERS (default 1,2,4). Save a baseline with --benchmark-autosave and compare
+against it with --benchmark-compare --benchmark-compare-fail=mean:10% to catch regressions. Before a stage is timed,
+it is run once under tracemalloc and the peak of the allocated memory is stored as peak_memory_mb in the extra_info
+of its benchmark. The INBD benchmarks compare a network with its traced version and are skipped if torch is not
+installed.
+"""
+
+import os
+import tracemalloc
+import appdirs
+import cv2
+import numpy as np
+import pytest
+import tifffile
+from napari.layers import Image
+from napari_tree_rings.image.geometry import Polygons
+from napari_tree_rings.image.inbd import INBDBackend
+from napari_tree_rings.image.measure import MeasureShape, MeasurePolygons, TableTool
+from napari_tree_rings.image.preprocessing import PreprocessingCache
+from napari_tree_rings.image.process import BatchSegmentTrunk, RingsSegmenter
+from napari_tree_rings.image.segmentation import SegmentTrunk
+from napari_tree_rings._tests import utils
+
+pytest.importorskip("pytest_benchmark")
+pytestmark = pytest.mark.perf
+
+
+
+SIZES = [int(size) for size in os.environ.get('TREE_RINGS_BENCHMARK_SIZES', '2000').split(',')]
+WORKERS = [int(workers) for workers in os.environ.get('TREE_RINGS_BENCHMARK_WORKERS', '1,2,4').split(',')]
+
+TRUNK_STAGES = {
+    'grayscale': lambda operation, image, shape: PreprocessingCache.convertToGrayscale(image),
+    'downscale': lambda operation, image, shape: operation.scaleDownImage(image),
+    'threshold': lambda operation, image, shape: operation.meanThresholdImage(image),
+    'keep_largest_region': lambda operation, image, shape: operation.keep_largest_region(image),
+    'fill_holes': lambda operation, image, shape: operation.fillHolesImage(image),
+    'opening': lambda operation, image, shape: operation.morphoOpenImage(image),
+    'scale_up': lambda operation, image, shape: operation.scaleUpMask(image, shape),
+    'erosion': lambda operation, image, shape: operation.morphoErodeImage(image),
+    'convex_hull': lambda operation, image, shape: operation.convexHullImage(image),
+    'create_shapes': lambda operation, image, shape: operation.createShapes(image),
+}
+
+CONTOUR_HULL_STAGES = {
+    'convex_hull_polygon': lambda operation, image, shape: operation.convexHullPolygon(image),
+    'create_shapes_from_polygon': lambda operation, image, shape: operation.createShapesFromPolygon(image),
+}
+
+
+def run(benchmark, function, *args, rounds=3):
+    """Record the peak memory of one call of the function, then time it."""
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_memory_mb'] = round(peak / 1024 ** 2, 1)
+    return benchmark.pedantic(function, args=args, rounds=rounds, iterations=1)
+
+
+@pytest.fixture(scope='module')
+def userData(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp("user_data"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: folder)
+        yield folder
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=lambda size: "{}px".format(size))
+def disc(request):
+    return utils.make_tree_disc(request.param, type='rgb')
+
+
+@pytest.fixture(scope='module')
+def trunkStages(disc, userData):
+    """The operation and the input of each stage of the trunk segmentation of the disc. The stages of the contour
+    hull get the eroded mask, like the convex hull of the image."""
+
+    operation = SegmentTrunk(None)
+    inputs = {}
+    image = disc
+    for stage, function in TRUNK_STAGES.items():
+        inputs[stage] = image
+        image = function(operation, image, disc.shape[0:2])
+    inputs['result'] = image
+    image = inputs['convex_hull']
+    for stage, function in CONTOUR_HULL_STAGES.items():
+        inputs[stage] = image
+        image = function(operation, image, disc.shape[0:2])
+    return operation, inputs
+
+
+@pytest.fixture(scope='module')
+def ringsMask(disc):
+    """A mask of the dark latewood bands of the disc."""
+
+    gray = PreprocessingCache.convertToGrayscale(disc)
+    return ((gray > 0) & (gray < 100)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('stage', list(TRUNK_STAGES.keys()) + list(CONTOUR_HULL_STAGES.keys()))
+def test_trunk_stage(benchmark, trunkStages, stage, disc):
+    operation, inputs = trunkStages
+    function = TRUNK_STAGES.get(stage, CONTOUR_HULL_STAGES.get(stage))
+
+    run(benchmark, function, operation, inputs[stage], disc.shape[0:2])
+
+
+def test_measure_shape(benchmark, trunkStages, disc, tmp_path):
+    _, inputs = trunkStages
+    parent = Image(disc, rgb=True, name="disc.tif")
+    shapes = inputs['result']
+    shapes.metadata['parent'] = parent
+    shapes.metadata['parent_path'] = os.path.join(tmp_path, "disc.tif")
+
+    def measure():
+        operation = MeasureShape(shapes)
+        operation.do()
+        return operation.table
+
+    table = run(benchmark, measure, rounds=1)
+
+    assert table['area'][0] > 0
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+@pytest.mark.parametrize('workers', WORKERS)
+def test_measure_rings(benchmark, disc, workers, pool):
+    """Measure 60 concentric rings of the size of the disc, to show how the measurements scale with the number
+    of workers."""
+
+    angles = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+    center = disc.shape[0] / 2
+    rings = [np.round(np.stack([center + radius * np.sin(angles), center + radius * np.cos(angles)], axis=1))
+             for radius in np.linspace(0.01, 0.4, 60) * disc.shape[0]]
+    parent = Image(disc, rgb=True, name="disc.tif")
+    polygons = Polygons(rings, metadata={'parent': parent, 'parent_path': "disc.tif"})
+
+    def measure():
+        operation = MeasurePolygons(polygons, object_type='ring', workers=workers, pool=pool)
+        operation.do()
+        return operation.table
+
+    table = run(benchmark, measure, rounds=1)
+
+    assert list(table['label']) == list(range(1, 61))
+
+
+def test_ring_to_polygons(benchmark, ringsMask):
+    contours, _ = cv2.findContours(ringsMask, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+    rings = run(benchmark, RingsSegmenter.ringToPolygons, list(contours))
+
+    assert len(rings) == len(contours)
+
+
+def test_mask_to_polygons(benchmark, ringsMask):
+    rings = run(benchmark, RingsSegmenter.maskToPolygons, ringsMask, rounds=1)
+
+    assert len(rings) >= 10
+
+
+@pytest.mark.parametrize('numberOfRows', [100, 1000])
+def test_table_tool(benchmark, numberOfRows):
+    rows = [{'label': np.array([index]), 'area': np.array([float(index)]), 'perimeter': np.array([1.0]),
+             'image': np.array(["disc.tif"]), 'object_type': np.array(["ring"])} for index in range(numberOfRows)]
+
+    def addRows():
+        table = {}
+        for row in rows:
+            TableTool.addTableAToB(row, table)
+        return table
+
+    table = run(benchmark, addRows)
+
+    assert TableTool.getNumberOfRows(table) == numberOfRows
+
+
+def test_run_batch(benchmark, disc, userData, tmp_path, monkeypatch):
+    utils.use_fake_models(monkeypatch)
+    segmenter = RingsSegmenter(None)
+    segmenter.options['cachePredictions'] = False
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    tifffile.imwrite(os.path.join(sourceFolder, "disc.tif"), disc)
+
+    def runBatch():
+        for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+            pass
+
+    run(benchmark, runBatch, rounds=1)
+
+    assert os.path.exists(os.path.join(outputFolder, "disc_parameters.csv"))
+
+
+@pytest.mark.parametrize('traced', [False, True])
+def test_inbd_network(benchmark, traced, tmp_path):
+    torch = pytest.importorskip("torch")
+    path = os.path.join(tmp_path, "inbd.pt.zip")
+    open(path, 'w').close()
+    network = utils.make_torch_network()
+    if traced:
+        network = INBDBackend.getTracedModule(network, path, 'segmentationmodel')
+    image = torch.rand(1, 3, 512, 512).contiguous(memory_format=torch.channels_last)
+
+    def predict():
+        with torch.inference_mode():
+            return network(image)
+
+    output = run(benchmark, predict)
+
+    assert output.shape == (1, 1, 512, 512)
@@ -0,0 +1,37 @@
+import appdirs
+from napari_tree_rings.image.calibration import InferenceCalibration
+from napari_tree_rings.image.process import RingsSegmenter
+from napari_tree_rings._tests import utils
+
+
+
+def test_calibration_stores_the_fastest_batch_size_within_the_memory_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    utils.use_fake_models(monkeypatch)
+    monkeypatch.setattr(InferenceCalibration, "batchSizes", (2, 8))
+    segmenter = RingsSegmenter(None)
+    segmenter.options['batchSize'] = 4
+    segmenter.saveOptions()
+    calibration = InferenceCalibration(segmenter, InferenceCalibration.createSyntheticImage(512))
+
+    candidates = list(calibration.run())
+
+    assert len(candidates) == len(calibration.results) == 2
+    assert all(result['patchSize'] == 256 and result['overlap'] == 60 for result in calibration.results)
+    assert calibration.best == InferenceCalibration.getBest(calibration.results, InferenceCalibration.getMemoryBudget())
+    reloaded = RingsSegmenter(None)
+    assert reloaded.getInferenceSettings() == {'patchSize': 256, 'overlap': 60, 'batchSize': 4}
+    reloaded.options['inferenceSettings'] = 'auto'
+    assert reloaded.getInferenceSettings() == {'patchSize': 256, 'overlap': 60, 'batchSize': calibration.best['batchSize']}
+    reloaded.options['patchSize'] = 512
+    reloaded.options['overlap'] = 120
+    assert reloaded.getInferenceSettings() == {'patchSize': 512, 'overlap': 120, 'batchSize': 4}
+
+
+def test_best_setting_is_the_fastest_that_fits_into_memory():
+    results = [{'pixelsPerSecond': 10, 'peakMemory': 100}, {'pixelsPerSecond': 30, 'peakMemory': 900},
+               {'pixelsPerSecond': 20, 'peakMemory': 400}]
+
+    assert InferenceCalibration.getBest(results, 500)['pixelsPerSecond'] == 20
+    assert InferenceCalibration.getBest(results, None)['pixelsPerSecond'] == 30
+    assert InferenceCalibration.getBest(results, 50)['peakMemory'] == 100
@@ -0,0 +1,113 @@
+import os
+import appdirs
+import numpy as np
+import pytest
+import tifffile
+from napari.layers import Image
+from napari_tree_rings.image.checkpoint import CancelToken, CheckpointStore, OperationCancelled
+from napari_tree_rings.image.process import TrunkSegmenter, RingsSegmenter
+from napari_tree_rings.image.segmentation import SegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+@pytest.fixture
+def discLayer(tmp_path):
+    path = os.path.join(tmp_path, "disc.tif")
+    img = utils.make_tree_disc(200)
+    tifffile.imwrite(path, img)
+    layer = Image(img, name="disc.tif")
+    layer.metadata['path'] = path
+    return layer
+
+
+@pytest.fixture
+def trunkOptionsPath(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, "st_options.txt")
+    monkeypatch.setattr(SegmentTrunk, "getOptionsPath", lambda self: path)
+    return path
+
+
+def test_cancelled_segmenter_stops_at_next_stage(discLayer, trunkOptionsPath):
+    segmenter = TrunkSegmenter(discLayer)
+    steps = segmenter.run()
+    next(steps)
+    next(steps)
+    segmenter.cancelToken.cancel()
+
+    with pytest.raises(OperationCancelled):
+        for _ in steps:
+            pass
+    assert segmenter.shapeLayer is None
+
+
+def test_changed_option_only_recomputes_downstream_stages(discLayer, trunkOptionsPath, tmp_path, monkeypatch):
+    operation = SegmentTrunk(None)
+    operation.options['checkpoints'] = True
+    operation.saveOptions()
+    first = TrunkSegmenter(discLayer)
+    first.checkpointFolder = tmp_path
+    first.segment()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.npz')]) == 3
+
+    monkeypatch.setattr(SegmentTrunk, "meanThresholdImage", None)
+    operation.options['opening'] = 4
+    operation.saveOptions()
+    second = TrunkSegmenter(discLayer)
+    second.checkpointFolder = tmp_path
+    second.segment()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.npz')]) == 4
+
+    monkeypatch.setattr(SegmentTrunk, "morphoOpenImage", None)
+    third = TrunkSegmenter(discLayer)
+    third.checkpointFolder = tmp_path
+    third.segment()
+    assert np.allclose(second.shapeLayer.data[0], third.shapeLayer.data[0])
+
+
+def test_least_recently_used_checkpoints_are_evicted(tmp_path):
+    store = CheckpointStore(tmp_path, maxBytes=4500)
+    for index in range(4):
+        store.save(str(index), compress=False, array=np.zeros(100, dtype=np.float64))
+        os.utime(store.getPath(str(index)), (index, index))
+    store.load("0")
+    store.save("4", compress=False, array=np.zeros(100, dtype=np.float64))
+
+    assert store.getSize() <= 4500
+    assert store.contains("0") and store.contains("4")
+    assert not store.contains("1")
+
+
+def test_cancel_token_can_be_reset():
+    token = CancelToken()
+    token.cancel()
+    assert token.isCancelled()
+    token.reset()
+    token.check()
+
+
+def test_pith_is_the_first_polygon_with_and_without_cached_predictions(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    models = utils.use_fake_models(monkeypatch)
+    segmentations = []
+    predict = RingsSegmenter.predict
+    monkeypatch.setattr(RingsSegmenter, "predict",
+                        lambda self, segmentation, image: segmentations.append(segmentation)
+                        or predict(self, segmentation, image))
+    path = os.path.join(tmp_path, "disc.tif")
+    tifffile.imwrite(path, utils.make_tree_disc(400))
+    layer = Image(tifffile.imread(path), name="disc.tif")
+    layer.metadata['path'] = path
+    results = []
+    for _ in range(2):
+        segmenter = RingsSegmenter(layer)
+        for _ in segmenter.run():
+            pass
+        results.append(segmenter)
+
+    assert models['rings'].calls == models['pith'].calls == 1
+    for segmentation, segmenter in zip(segmentations, results):
+        assert segmentation.pithContour is not None
+        pith = np.array(segmentation.pithContour[:, 0, ::-1])
+        assert np.array_equal(segmenter.resultsLayer.data[-1], pith)
+    assert segmentations[0].center == segmentations[1].center
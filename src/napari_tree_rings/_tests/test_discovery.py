@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+import tifffile
+from napari_tree_rings.image.discovery import BatchDiscovery
+
+
+
+def test_discovery_finds_filtered_files_recursively_largest_first(tmp_path):
+    os.makedirs(tmp_path / "site_a" / "plot_1")
+    os.makedirs(tmp_path / ".hidden")
+    tifffile.imwrite(tmp_path / "small.tif", np.zeros((100, 120), dtype=np.uint8))
+    tifffile.imwrite(tmp_path / "site_a" / "large.TIFF", np.zeros((400, 300, 3), dtype=np.uint8))
+    tifffile.imwrite(tmp_path / "site_a" / "plot_1" / "medium.tif", np.zeros((200, 200), dtype=np.uint16))
+    tifffile.imwrite(tmp_path / ".hidden" / "other.tif", np.zeros((10, 10), dtype=np.uint8))
+    (tmp_path / "site_a" / "notes.txt").write_text("notes")
+    (tmp_path / "site_a" / "fake.tif").write_text("not an image")
+
+    discovery = BatchDiscovery(str(tmp_path))
+    assert [image['path'] for image in discovery.run()] == ["small.tif"]
+
+    discovery = BatchDiscovery(str(tmp_path), recursive=True)
+    images = discovery.run()
+
+    assert [image['path'] for image in images] == [os.path.join("site_a", "large.TIFF"),
+                                                   os.path.join("site_a", "plot_1", "medium.tif"), "small.tif"]
+    assert [image['shape'] for image in images] == [(400, 300, 3), (200, 200), (100, 120)]
+    assert [image['pixels'] for image in images] == [120000, 40000, 12000]
+    assert discovery.rejected == [{'path': os.path.join("site_a", "fake.tif"), 'status': 'skipped',
+                                   'error': 'not a tiff image'}]
+    discovery = BatchDiscovery(str(tmp_path), patterns="medium.*", recursive=True)
+    assert [image['path'] for image in discovery.run()] == [os.path.join("site_a", "plot_1", "medium.tif")]
+
+
+def test_cost_model_is_fitted_to_the_manifest_and_scheduled_longest_first(tmp_path):
+    manifestPath = str(tmp_path / "_manifest.csv")
+    pd.DataFrame({'image': ["a", "b", "c"], 'shape': ["1000x1000", "2000x1000x3", "3000x1000"],
+                  'seconds': [3.0, 5.0, 7.0]}).to_csv(manifestPath, index=False)
+    discovery = BatchDiscovery(str(tmp_path))
+    discovery.fitCostModel(manifestPath)
+
+    assert np.isclose(discovery.secondsPerImage, 1.0) and np.isclose(discovery.secondsPerMegapixel, 2.0)
+    discovery.images = [{'path': str(index), 'pixels': pixels, 'seconds': discovery.estimateSeconds(pixels)}
+                        for index, pixels in enumerate((3e6, 3e6, 2e6, 2e6, 2e6))]
+    assert np.isclose(discovery.estimateMakespan(1), 29.0)
+    assert np.isclose(discovery.estimateMakespan(2), 17.0)
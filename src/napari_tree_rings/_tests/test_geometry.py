@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+from napari_tree_rings.image.geometry import Geometry
+from napari_tree_rings.image.process import RingsSegmenter
+
+
+
+def test_contour_to_polygon_swaps_to_row_column():
+    contour = np.array([[[3, 1]], [[7, 1]], [[7, 5]]], dtype=np.int32)
+
+    polygon = Geometry.contourToPolygon(contour)
+
+    assert polygon.dtype == np.float64
+    assert np.array_equal(polygon, [[1, 3], [1, 7], [5, 7]])
+
+
+def test_mask_to_polygons_finds_the_contours_in_the_full_image():
+    mask = np.zeros((120, 100), dtype=np.uint8)
+    cv2.circle(mask, (50, 60), 40, 1, 3)
+    cv2.rectangle(mask, (0, 0), (20, 10), 1, -1)
+
+    polygons = RingsSegmenter.maskToPolygons(mask)
+
+    assert len(polygons) == 2
+    assert polygons[0].min(axis=0).tolist() == [0, 0]
+    assert polygons[0].max(axis=0).tolist() == [10, 20]
+    ring = np.argwhere(mask[15:]) + [15, 0]
+    assert polygons[1].min(axis=0).tolist() == ring.min(axis=0).tolist()
+    assert polygons[1].max(axis=0).tolist() == ring.max(axis=0).tolist()
+
+
+def test_polygon_to_mask_equals_polygon2mask():
+    from skimage.draw import polygon2mask
+    rng = np.random.default_rng(1)
+    for index in range(150):
+        polygon = rng.random((rng.integers(3, 30), 2)) * 60 - 5
+        if index % 3 == 1:
+            polygon = np.round(polygon)
+        if index % 3 == 2:
+            polygon = np.round(polygon * 2) / 2
+
+        assert np.array_equal(Geometry.polygonToMask(polygon, (50, 50)), polygon2mask((50, 50), polygon))
+        assert np.array_equal(Geometry.polygonToMask(polygon, (30, 40), origin=(10, 5)),
+                              polygon2mask((50, 50), polygon)[10:40, 5:45])
@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+
+
+
+# napari.layers already loads the top-level packages of skimage and scipy, so the test checks the modules that
+# the import of the plugin adds, e.g. skimage.filters or scipy.ndimage, and not the packages themselves.
+HEAVY_MODULES = ('tensorflow', 'keras', 'torch', 'torchvision', 'cv2', 'pandas', 'tifffile', 'tree_ring_analyzer',
+                 'shapelysmooth', 'skimage', 'scipy')
+IMPORT_TIME_BUDGET = 1.0
+
+SCRIPT = """
+import json, sys, time
+import napari.layers, napari.qt.threading, qtpy.QtWidgets
+loaded = set(sys.modules)
+start = time.perf_counter()
+import napari_tree_rings
+from napari_tree_rings import _widget
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(set(sys.modules) - loaded)}))
+"""
+
+
+def importPlugin():
+    """Import the package and the widget module in a fresh interpreter, in which napari and qt are already loaded.
+    Answer the time of the import and the modules it has loaded."""
+
+    completed = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_plugin_import_does_not_load_heavy_libraries():
+    result = importPlugin()
+
+    loaded = [module for module in result['modules'] if module.split('.')[0] in HEAVY_MODULES]
+    assert not loaded
+
+
+def test_plugin_import_is_within_time_budget():
+    result = importPlugin()
+
+    assert result['seconds'] < IMPORT_TIME_BUDGET
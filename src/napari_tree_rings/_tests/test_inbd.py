@@ -0,0 +1,142 @@
+import os
+import appdirs
+import cv2
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image as PILImage
+from napari.layers import Image
+from napari_tree_rings.image.inbd import INBDBackend
+from napari_tree_rings.image.process import RingsSegmenter, BatchSegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+@pytest.fixture
+def userData(tmp_path, monkeypatch):
+    folder = os.path.join(tmp_path, "user_data")
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: folder)
+    return folder
+
+
+def useFakeINBDModel(monkeypatch, model):
+    utils.use_fake_models(monkeypatch)
+    monkeypatch.setattr(RingsSegmenter, "getINBDModel", classmethod(lambda cls, path, **kwargs: model))
+    segmenter = RingsSegmenter(None)
+    segmenter.options['method'] = 'INBD'
+    return segmenter
+
+
+def test_inbd_input_is_rgb_between_zero_and_one():
+    gray = INBDBackend.toInput(np.array([[0, 65535]], dtype=np.uint16))
+    rgba = INBDBackend.toInput(np.full((2, 2, 4), 255, dtype=np.uint8))
+
+    assert gray.shape == (1, 2, 3) and gray.dtype == np.float32
+    assert np.array_equal(gray[0, :, 1], [0, 1])
+    assert rgba.shape == (2, 2, 3) and np.all(rgba == 1)
+    scaled = INBDBackend.toInput(np.zeros((101, 60), dtype=np.uint8), scale=4)
+    assert scaled.shape == (25, 15, 3)
+
+
+def loadImageAsINBD(path, scale):
+    """The image loader of INBD: the file is opened with PIL, converted to rgb, resized with the bilinear filter
+    of PIL to its size divided by the scale, rounded down, and answered as floats between 0 and 1."""
+    with PILImage.open(path) as image:
+        image = image.convert('RGB')
+        image = image.resize((int(image.size[0] // scale), int(image.size[1] // scale)), PILImage.BILINEAR)
+        return np.asarray(image, dtype=np.float32) / 255
+
+
+def test_inbd_input_is_the_image_loaded_by_inbd(tmp_path):
+    path = os.path.join(tmp_path, "disc.tif")
+    tifffile.imwrite(path, utils.make_tree_disc(317, type='rgb')[:203])
+    image = tifffile.imread(path)
+
+    for scale in (2, 3, 4):
+        expected = loadImageAsINBD(path, scale)
+        assert np.allclose(INBDBackend.toInput(image, scale), expected, atol=1e-6)
+        assert np.allclose(INBDBackend.toInput(image.astype(np.uint16) * 257, scale), expected, atol=1 / 255)
+        aliased = cv2.resize(image / 255, expected.shape[1::-1], interpolation=cv2.INTER_LINEAR)
+        assert np.abs(aliased - expected).max() > 0.01
+
+
+def test_inbd_runs_on_the_image_in_memory(userData, monkeypatch, tmp_path):
+    model = utils.FakeINBDModel()
+    useFakeINBDModel(monkeypatch, model).saveOptions()
+    path = os.path.join(tmp_path, "disc.tif")
+    tifffile.imwrite(path, utils.make_tree_disc(200, type='rgb'))
+    memoryPath = os.path.join(tmp_path, "memory.tif")
+    tifffile.imwrite(memoryPath, utils.make_tree_disc(200, type='rgb', seed=1))
+    layer = Image(tifffile.imread(memoryPath), rgb=True, name="disc.tif")
+    layer.metadata['path'] = path
+
+    segmenter = RingsSegmenter(layer)
+    for _ in segmenter.run():
+        pass
+
+    assert len(model.images) == 1 and model.images[0].shape == (100, 100, 3)
+    assert np.allclose(model.images[0], loadImageAsINBD(memoryPath, model.scale), atol=1e-6)
+    assert not np.allclose(model.images[0], loadImageAsINBD(path, model.scale), atol=1e-3)
+    assert len(segmenter.resultsLayer.data) == 3
+    outer = segmenter.resultsLayer.data[0]
+    assert np.allclose(np.hypot(outer[:, 0] - 100, outer[:, 1] - 100), 0.4 * 200)
+    assert list(segmenter.measurements['object_type']) == ['pith', 'ring', 'ring']
+
+
+def test_batch_runs_inbd_on_groups_of_images(userData, monkeypatch, tmp_path):
+    model = utils.FakeINBDModel(batched=True)
+    segmenter = useFakeINBDModel(monkeypatch, model)
+    segmenter.options['inbdBatchSize'] = 2
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    for index in range(3):
+        tifffile.imwrite(os.path.join(sourceFolder, "disc_{}.tif".format(index)), utils.make_tree_disc(160 + 20 * index))
+
+    for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+        pass
+
+    assert model.passes == [2, 1]
+    for index in range(3):
+        assert os.path.exists(os.path.join(outputFolder, "disc_{}_parameters.csv".format(index)))
+
+
+def test_traced_network_gives_the_results_of_the_network_and_is_cached(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    path = os.path.join(tmp_path, "inbd.pt.zip")
+    open(path, 'w').close()
+    network = utils.make_torch_network()
+    example = torch.rand(1, 3, 96, 128)
+
+    traced = INBDBackend.getTracedModule(network, path, 'segmentationmodel')
+
+    assert isinstance(traced, torch.jit.ScriptModule)
+    assert os.path.exists(INBDBackend.getArtifactPath(path, 'segmentationmodel'))
+    assert torch.__version__.replace('+', '-') in INBDBackend.getArtifactPath(path, 'segmentationmodel')
+    with torch.inference_mode():
+        assert torch.allclose(traced(example), network(example), atol=1e-4, rtol=1e-4)
+    monkeypatch.setattr(torch.jit, "trace", None)
+    assert isinstance(INBDBackend.getTracedModule(network, path, 'segmentationmodel'), torch.jit.ScriptModule)
+
+
+def test_network_with_a_branch_on_the_input_shape_is_not_traced(tmp_path):
+    torch = pytest.importorskip("torch")
+
+    class Padded(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.network = utils.make_torch_network()
+
+        def forward(self, x):
+            if x.shape[-1] % 32:
+                x = torch.nn.functional.pad(x, (0, 32 - x.shape[-1] % 32))
+            return self.network(x)
+
+    path = os.path.join(tmp_path, "inbd.pt.zip")
+    open(path, 'w').close()
+    network = Padded().eval()
+
+    assert INBDBackend.getTracedModule(network, path, 'segmentationmodel') is network
+    assert not os.path.exists(INBDBackend.getArtifactPath(path, 'segmentationmodel'))
@@ -0,0 +1,88 @@
+import os
+import json
+import appdirs
+import pandas as pd
+import pytest
+import tifffile
+from napari.layers import Image
+from napari_tree_rings.image.instrumentation import Instrumentation, MemorySink, JSONLinesSink
+from napari_tree_rings.image.process import TrunkSegmenter, RingsSegmenter, BatchSegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+@pytest.fixture
+def userData(tmp_path, monkeypatch):
+    folder = os.path.join(tmp_path, "user_data")
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: folder)
+    return folder
+
+
+@pytest.fixture
+def sink():
+    sink = MemorySink()
+    Instrumentation.addSink(sink)
+    yield sink
+    Instrumentation.removeSink(sink)
+
+
+def test_trunk_segmenter_emits_stage_and_run_records(userData, sink, tmp_path):
+    path = os.path.join(tmp_path, "disc.tif")
+    img = utils.make_tree_disc(200)
+    tifffile.imwrite(path, img)
+    layer = Image(img, name="disc.tif")
+    layer.metadata['path'] = path
+    jsonSink = JSONLinesSink(os.path.join(tmp_path, "records", "trunk.jsonl"))
+    Instrumentation.addSink(jsonSink)
+    try:
+        for _ in TrunkSegmenter(layer).run():
+            pass
+    finally:
+        Instrumentation.removeSink(jsonSink)
+
+    stages = [record['stage'] for record in sink.getRecords('stage', 'trunk')]
+    assert stages == ['pixel size and unit', 'read options', 'downscale', 'threshold', 'keep largest region',
+                      'fill holes', 'opening', 'scale up', 'erode', 'convex hull', 'create shapes', 'measure']
+    runs = sink.getRecords('run', 'trunk')
+    assert len(runs) == 1
+    assert runs[0]['image'] == "disc.tif" and runs[0]['shape'] == [200, 200]
+    assert runs[0]['options']['scale'] == 8
+    assert set(runs[0]['stages'].keys()) == set(stages)
+    assert all(record['seconds'] >= 0 for record in sink.records)
+    with open(jsonSink.path) as aFile:
+        lines = [json.loads(line) for line in aFile]
+    assert len(lines) == len(stages) + 1
+
+
+def test_batch_manifest_contains_stage_times(userData, sink, tmp_path, monkeypatch):
+    utils.use_fake_models(monkeypatch)
+    segmenter = RingsSegmenter(None)
+    segmenter.options['cachePredictions'] = False
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    tifffile.imwrite(os.path.join(sourceFolder, "disc.tif"), utils.make_tree_disc(400, type='rgb'))
+
+    for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+        pass
+
+    manifest = pd.read_csv(os.path.join(outputFolder, BatchSegmentTrunk.manifestFilename))
+    assert list(manifest['image']) == ["disc.tif"]
+    stageTimes = json.loads(manifest['stage_times'][0])
+    assert 'batch.rings' in stageTimes and 'trunk.threshold' in stageTimes and 'rings.predict rings' in stageTimes
+    assert [record['operation'] for record in sink.getRecords('run')] == ['rings', 'trunk', 'batch']
+
+
+def test_a_stage_that_raises_is_recorded_as_failed(sink):
+    instrumentation = Instrumentation('batch')
+    with instrumentation.stage('read'):
+        pass
+    with pytest.raises(ValueError):
+        with instrumentation.stage('rings'):
+            raise ValueError("corrupt image")
+
+    records = sink.getRecords('stage', 'batch')
+    assert [(record['stage'], record['failed']) for record in records] == [('read', False), ('rings', True)]
+    assert set(instrumentation.getStageTimes().keys()) == {'read', 'rings'}
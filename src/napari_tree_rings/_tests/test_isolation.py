@@ -0,0 +1,121 @@
+import os
+import json
+import appdirs
+import numpy as np
+import tifffile
+import pandas as pd
+from napari_tree_rings.image.isolation import IsolatedBatchRunner, IsolatedWorker
+from napari_tree_rings.image.process import RingsSegmenter, TrunkSegmenter, BatchSegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+def readReport(folder):
+    report = pd.read_csv(os.path.join(folder, BatchSegmentTrunk.reportFilename), keep_default_na=False)
+    return dict(zip(report['image'], report['status']))
+
+
+def test_failing_images_are_reported_and_the_batch_continues(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    utils.use_fake_models(monkeypatch)
+    segmenter = RingsSegmenter(None)
+    segmenter.options['cachePredictions'] = False
+    segmenter.options['imagesPerBatch'] = 2
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    tifffile.imwrite(os.path.join(sourceFolder, "disc_0.tif"), utils.make_tree_disc(300))
+    tifffile.imwrite(os.path.join(sourceFolder, "disc_1.tif"), utils.make_tree_disc(380))
+    with open(os.path.join(sourceFolder, "broken.tif"), 'wb') as aFile:
+        aFile.write(b'II*\x00' + bytes(100))
+    with open(os.path.join(sourceFolder, "notes.tif"), 'w') as aFile:
+        aFile.write("not an image")
+    with open(os.path.join(sourceFolder, "notes.txt"), 'w') as aFile:
+        aFile.write("not an image")
+    os.makedirs(os.path.join(sourceFolder, "subfolder.tif"))
+    tifffile.imwrite(os.path.join(sourceFolder, "trunkless.tif"), utils.make_tree_disc(300))
+    run = TrunkSegmenter.run
+
+    def failingRun(self):
+        if self.layer.name == "trunkless.tif":
+            raise RuntimeError("no trunk")
+        yield from run(self)
+
+    monkeypatch.setattr(TrunkSegmenter, "run", failingRun)
+
+    for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+        pass
+
+    assert readReport(outputFolder) == {'disc_0.tif': 'done', 'disc_1.tif': 'done', 'broken.tif': 'failed',
+                                        'notes.tif': 'skipped', 'trunkless.tif': 'failed'}
+    report = pd.read_csv(os.path.join(outputFolder, BatchSegmentTrunk.reportFilename), index_col='image')
+    assert set(json.loads(report.loc['trunkless.tif', 'stage_times'])) == {'read', 'rings', 'trunk'}
+    assert set(json.loads(report.loc['disc_0.tif', 'stage_times'])) == {'read', 'rings', 'trunk', 'save'}
+    assert json.loads(report.loc['broken.tif', 'stage_times']) == {}
+    assert os.path.exists(os.path.join(outputFolder, "disc_0_parameters.csv"))
+    assert os.path.exists(os.path.join(outputFolder, "disc_1_parameters.csv"))
+    manifest = pd.read_csv(os.path.join(outputFolder, BatchSegmentTrunk.manifestFilename))
+    assert sorted(manifest['image']) == ['disc_0.tif', 'disc_1.tif']
+
+
+def test_isolated_batch_stops_hanging_and_crashing_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    utils.use_fake_models(monkeypatch)
+    monkeypatch.setattr(IsolatedBatchRunner, "worker", staticmethod(utils.run_fake_batch_worker))
+    segmenter = RingsSegmenter(None)
+    segmenter.options['isolateImages'] = True
+    segmenter.options['imageTimeout'] = 2
+    segmenter.options['batchWorkers'] = 2
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    names = ["a.tif", "b_hang.tif", "c.tif", "d_crash.tif", "e.tif"]
+    for name in names:
+        tifffile.imwrite(os.path.join(sourceFolder, name), np.zeros((10, 10), dtype=np.uint8))
+
+    batch = BatchSegmentTrunk(sourceFolder, outputFolder)
+    progress = list(batch.runBatch())
+
+    assert progress == [1, 2, 3, 4, 5]
+    assert readReport(outputFolder) == {'a.tif': 'done', 'b_hang.tif': 'timeout', 'c.tif': 'done',
+                                        'd_crash.tif': 'failed', 'e.tif': 'done'}
+    manifest = pd.read_csv(os.path.join(outputFolder, BatchSegmentTrunk.manifestFilename))
+    assert sorted(manifest['image']) == ['a.tif', 'c.tif', 'e.tif']
+
+
+def test_isolated_batch_kills_workers_over_the_time_or_memory_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    utils.use_fake_models(monkeypatch)
+    monkeypatch.setattr(IsolatedBatchRunner, "worker", staticmethod(utils.run_fake_batch_worker))
+    stopped = []
+    stop = IsolatedWorker.stop
+
+    def recordingStop(self, kill=False):
+        if self.process is not None and self.process.is_alive():
+            stopped.append((self.image, self.process, kill))
+        stop(self, kill)
+
+    monkeypatch.setattr(IsolatedWorker, "stop", recordingStop)
+    segmenter = RingsSegmenter(None)
+    segmenter.options['isolateImages'] = True
+    segmenter.options['imageTimeout'] = 2
+    segmenter.options['imageMemoryLimit'] = 256
+    segmenter.saveOptions()
+    sourceFolder = os.path.join(tmp_path, "in")
+    outputFolder = os.path.join(tmp_path, "out")
+    os.makedirs(sourceFolder)
+    os.makedirs(outputFolder)
+    for name in ["a_alloc.tif", "b_hang.tif", "c.tif"]:
+        tifffile.imwrite(os.path.join(sourceFolder, name), np.zeros((10, 10), dtype=np.uint8))
+
+    for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+        pass
+
+    assert readReport(outputFolder) == {'a_alloc.tif': 'memory', 'b_hang.tif': 'timeout', 'c.tif': 'done'}
+    killed = [(image, process) for image, process, kill in stopped if kill]
+    assert [image for image, _ in killed] == ['a_alloc.tif', 'b_hang.tif']
+    assert all(not process.is_alive() and process.exitcode != 0 for _, process in killed)
@@ -0,0 +1,42 @@
+import time
+from napari_tree_rings.jobs import SegmentationJob, JobScheduler
+
+
+
+class SleepingJob(SegmentationJob):
+
+
+    maxRunning = 0
+    running = 0
+
+
+    def __init__(self, name):
+        super().__init__(path=name)
+
+
+    def run(self):
+        SleepingJob.running += 1
+        SleepingJob.maxRunning = max(SleepingJob.maxRunning, SleepingJob.running)
+        try:
+            for _ in range(10):
+                time.sleep(0.01)
+                yield
+        finally:
+            SleepingJob.running -= 1
+
+
+
+def test_scheduler_bounds_concurrency_and_cancels_jobs(qtbot):
+    scheduler = JobScheduler(maxConcurrentJobs=2)
+    finished = []
+    scheduler.jobFinished.connect(finished.append)
+    jobs = [SleepingJob("image_{}.tif".format(index)) for index in range(5)]
+    for job in jobs:
+        scheduler.submit(job)
+    scheduler.cancel(jobs[3])
+
+    qtbot.waitUntil(lambda: all(job.isDone() for job in jobs) and not scheduler.getRunningJobs(), timeout=10000)
+
+    assert SleepingJob.maxRunning <= 2
+    assert jobs[3].status == SegmentationJob.CANCELLED
+    assert sorted(finished, key=jobs.index) == [jobs[0], jobs[1], jobs[2], jobs[4]]
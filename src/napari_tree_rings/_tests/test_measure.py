@@ -0,0 +1,100 @@
+import os
+import threading
+import numpy as np
+import tifffile
+from napari.layers import Image, Shapes
+from napari_tree_rings.image.geometry import Polygons
+from napari_tree_rings.image.measure import TableTool, MeasurementCollector, MeasureShape, MeasurePolygons
+from napari_tree_rings.image.process import TrunkSegmenter
+from napari_tree_rings._tests import utils
+
+
+
+def test_add_table_with_different_columns():
+    tableB = {'area': np.array([1.0, 2.0]), 'label': np.array([1, 2])}
+    tableA = {'area': np.array([3.0]), 'perimeter': np.array([4.0])}
+
+    TableTool.addTableAToB(tableA, tableB)
+
+    assert all(len(column) == 3 for column in tableB.values())
+    assert np.isnan(tableB['perimeter'][0]) and tableB['perimeter'][2] == 4.0
+    assert np.isnan(tableB['label'][2])
+
+
+def test_parallel_segmenters_produce_consistent_table(tmp_path):
+    numberOfImages = 16
+    layers = []
+    for index in range(numberOfImages):
+        path = os.path.join(tmp_path, "disc_{:02d}.tif".format(index))
+        img = utils.make_tree_disc(160 + 8 * index)
+        tifffile.imwrite(path, img)
+        layer = Image(img, name=os.path.basename(path))
+        layer.metadata['path'] = path
+        layers.append(layer)
+    collector = MeasurementCollector()
+    errors = []
+
+    def work(layersOfThread):
+        try:
+            for layer in layersOfThread:
+                segmenter = TrunkSegmenter(layer)
+                for _ in segmenter.run():
+                    pass
+                collector.merge(segmenter.measurements)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(layers[index::8],)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    table = collector.getTable()
+    assert not errors
+    assert collector.getNumberOfRows() == numberOfImages
+    assert all(len(column) == numberOfImages for column in table.values())
+    assert sorted(table['image']) == sorted(layer.name for layer in layers)
+    for layer in layers:
+        row = list(table['image']).index(layer.name)
+        expectedArea = np.pi * (0.4 * layer.data.shape[0]) ** 2
+        assert abs(table['area'][row] - expectedArea) < 0.15 * expectedArea
+
+
+def test_measure_polygons_gives_the_measurements_of_the_shapes_layer():
+    angles = np.linspace(0, 2 * np.pi, 90, endpoint=False)
+    ring = np.stack([120 + 70 * np.sin(angles) + 9 * np.cos(3 * angles), 150 + 95 * np.cos(angles)], axis=1)
+    parent = Image(np.zeros((260, 300)), name="disc.tif", scale=(0.5, 0.5))
+    metadata = {'parent': parent, 'parent_path': "/discs/disc.tif"}
+    layer = Shapes([ring], shape_type='polygon', scale=(0.5, 0.5))
+    layer.metadata.update(metadata)
+
+    expected = MeasureShape(layer, object_type='ring')
+    expected.do()
+    measured = MeasurePolygons(Polygons([ring], scale=(0.5, 0.5), metadata=metadata), object_type='ring')
+    measured.do()
+
+    assert set(measured.table.keys()) == set(expected.table.keys())
+    for key, column in expected.table.items():
+        if column.dtype.kind in 'fi':
+            assert np.allclose(measured.table[key], column), key
+        else:
+            assert list(measured.table[key]) == list(column), key
+
+
+def test_parallel_measurements_are_in_the_order_of_the_polygons():
+    angles = np.linspace(0, 2 * np.pi, 60, endpoint=False)
+    rings = [np.round(np.stack([100 + radius * np.sin(angles), 100 + radius * np.cos(angles)], axis=1))
+             for radius in (80, 20, 60, 40)]
+    polygons = Polygons(rings, metadata={'parent': Image(np.zeros((200, 200))), 'parent_path': "/discs/disc.tif"})
+
+    tables = []
+    for workers, pool in ((1, 'thread'), (3, 'thread'), (2, 'process')):
+        operation = MeasurePolygons(polygons, object_type='ring', workers=workers, pool=pool)
+        operation.do()
+        tables.append(operation.table)
+
+    assert list(tables[0]['label']) == [1, 2, 3, 4]
+    assert np.all(np.diff(tables[0]['area'][[1, 3, 2, 0]]) > 0)
+    for table in tables[1:]:
+        assert all(np.array_equal(table[key], tables[0][key]) for key in tables[0].keys())
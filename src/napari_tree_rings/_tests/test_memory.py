@@ -0,0 +1,48 @@
+import gc
+import os
+import weakref
+import appdirs
+import pytest
+import tifffile
+from napari.layers import Image
+from napari_tree_rings.image.instrumentation import Instrumentation
+from napari_tree_rings.image.parent import ParentImage
+from napari_tree_rings.image.process import TrunkSegmenter, RingsSegmenter
+from napari_tree_rings._tests import utils
+
+
+
+@pytest.mark.soak
+def test_memory_stays_flat_over_50_segmentations(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    utils.use_fake_models(monkeypatch)
+    options = RingsSegmenter(None)
+    options.options['cachePredictions'] = False
+    options.saveOptions()
+    path = os.path.join(tmp_path, "disc.tif")
+    size = 400
+    tifffile.imwrite(path, utils.make_tree_disc(size, type='rgb'))
+    references = []
+    results = []
+    memory = []
+    for index in range(50):
+        layer = Image(utils.make_tree_disc(size, type='rgb', seed=index), rgb=True, name="disc_{}.tif".format(index))
+        layer.metadata['path'] = path
+        references.append(weakref.ref(layer))
+        trunkSegmenter = TrunkSegmenter(layer)
+        ringsSegmenter = RingsSegmenter(layer)
+        for segmenter in (trunkSegmenter, ringsSegmenter):
+            for _ in segmenter.run():
+                pass
+            segmenter.releaseImage()
+        if index < 10:
+            results.extend([trunkSegmenter.shapeLayer, ringsSegmenter.resultsLayer])
+        del layer, segmenter, trunkSegmenter, ringsSegmenter
+        gc.collect()
+        memory.append(Instrumentation.getMemory()[0])
+
+    assert all(reference() is None for reference in references)
+    assert all(isinstance(result.metadata['parent'], ParentImage) for result in results)
+    assert results[-1].metadata['parent'].shape == (size, size, 3) and results[-1].metadata['parent'].layer is None
+    if memory[-1] is not None:
+        assert memory[-1] - memory[9] < 10 * size * size * 3
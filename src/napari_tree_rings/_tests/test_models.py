@@ -0,0 +1,116 @@
+import sys
+import time
+import threading
+from types import SimpleNamespace
+from napari_tree_rings.image import models
+from napari_tree_rings.image.models import ModelRegistry, SerializedModel
+
+
+
+def test_idle_models_are_evicted_after_their_time_to_live(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(models.time, "monotonic", lambda: now[0])
+    registry = ModelRegistry()
+    registry.timeToLive = 60
+    registry.get(('keras', 'rings.keras'), lambda: "rings")
+    now[0] = 130.0
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "inbd")
+    now[0] = 170.0
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "other")
+
+    assert not registry.contains(('keras', 'rings.keras'))
+    assert registry.contains(('inbd', 'inbd.pt.zip'))
+    now[0] = 240.0
+    assert registry.evictIdle() == [('inbd', 'inbd.pt.zip')]
+
+
+def test_models_are_kept_without_time_to_live(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(models.time, "monotonic", lambda: now[0])
+    registry = ModelRegistry()
+    registry.get(('keras', 'rings.keras'), lambda: "rings")
+    now[0] = 1e6
+
+    assert registry.evictIdle() == []
+    assert registry.contains(('keras', 'rings.keras'))
+
+
+def test_release_removes_the_models_of_a_kind_and_footprint_counts_the_weights():
+    registry = ModelRegistry()
+    weights = [SimpleNamespace(shape=(3, 3, 1, 16), dtype='float32'), SimpleNamespace(shape=(16,), dtype='float16')]
+    registry.get(('keras', 'rings.keras'), lambda: SimpleNamespace(weights=weights))
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "inbd")
+
+    footprint = registry.getFootprint()
+
+    assert [entry['kind'] for entry in footprint] == ['keras', 'inbd']
+    assert footprint[0]['weightBytes'] == 144 * 4 + 16 * 2
+    assert registry.getTotalFootprint() == 144 * 4 + 16 * 2
+    assert registry.release('inbd') == [('inbd', 'inbd.pt.zip')]
+    assert registry.contains(('keras', 'rings.keras'))
+    assert registry.release() == [('keras', 'rings.keras')]
+    assert registry.getFootprint() == []
+
+
+def test_models_in_use_are_not_released():
+    registry = ModelRegistry()
+    registry.get(('keras', 'rings.keras'), lambda: "rings")
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "inbd")
+
+    with registry.use('inbd'):
+        with registry.use('inbd'):
+            pass
+        assert registry.isInUse('inbd')
+        assert registry.release('inbd') == []
+        assert registry.release() == [('keras', 'rings.keras')]
+        assert registry.contains(('inbd', 'inbd.pt.zip'))
+    assert not registry.isInUse('inbd')
+    assert registry.release() == [('inbd', 'inbd.pt.zip')]
+
+
+def test_evicting_the_last_model_of_a_framework_frees_its_memory(monkeypatch):
+    cleared = []
+    tensorflow = SimpleNamespace(keras=SimpleNamespace(backend=SimpleNamespace(
+        clear_session=lambda: cleared.append('keras'))))
+    torch = SimpleNamespace(cuda=SimpleNamespace(is_available=lambda: True,
+                                                 empty_cache=lambda: cleared.append('torch')))
+    monkeypatch.setitem(sys.modules, 'tensorflow', tensorflow)
+    monkeypatch.setitem(sys.modules, 'torch', torch)
+    now = [100.0]
+    monkeypatch.setattr(models.time, "monotonic", lambda: now[0])
+    registry = ModelRegistry()
+    registry.timeToLive = 60
+    registry.get(('keras', 'rings.keras'), lambda: "rings")
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "inbd")
+    now[0] = 150.0
+    registry.get(('inbd', 'inbd.pt.zip'), lambda: "inbd")
+    now[0] = 200.0
+
+    assert registry.evictIdle() == [('keras', 'rings.keras')]
+    assert cleared == ['keras']
+    now[0] = 300.0
+    assert registry.evictIdle() == [('inbd', 'inbd.pt.zip')]
+    assert cleared == ['keras', 'torch']
+
+
+def test_shared_model_predicts_for_one_thread_at_a_time():
+    running = []
+    overlaps = []
+
+    def predict(tiles, batch_size=8, verbose=0):
+        running.append(1)
+        overlaps.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+        return tiles
+
+    model = SerializedModel(SimpleNamespace(predict=predict, weights=[]))
+    threads = [threading.Thread(target=model.predict, args=([index],)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [1, 1, 1, 1]
+    assert model.weights == []
+    assert ModelRegistry.getWeightBytes(model) == 0
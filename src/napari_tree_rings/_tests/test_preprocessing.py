@@ -0,0 +1,95 @@
+import threading
+import numpy as np
+from skimage.color import rgb2gray
+from napari.layers import Image
+from napari_tree_rings.image.preprocessing import PreprocessingCache
+from napari_tree_rings.image.segmentation import SegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+def test_grayscale_is_computed_once_and_shared():
+    data = np.random.randint(0, 255, (300, 200, 3), dtype=np.uint8)
+    layer = Image(data, rgb=True)
+    cache = PreprocessingCache()
+    calls = []
+
+    def convert():
+        calls.append(1)
+        return cache.convertToGrayscale(layer.data)
+
+    results = [None] * 8
+    def work(index):
+        results[index] = cache.get(layer, ('grayscale',), convert)
+
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert not results[0].flags.writeable
+    expected = 0.299 * data[:, :, 0] + 0.587 * data[:, :, 1] + 0.114 * data[:, :, 2]
+    assert np.allclose(results[0], expected, atol=1e-3)
+
+
+def test_least_recently_used_derivatives_are_evicted():
+    cache = PreprocessingCache(maxBytes=2 * 100 * 100 * 4)
+    layers = [Image(np.random.random((100, 100)).astype(np.float32)) for _ in range(3)]
+    for layer in layers:
+        cache.getGrayscale(layer)
+
+    assert cache.nbytes() <= cache.maxBytes
+    assert len(cache.entries) == 2
+    keys = [key[0][0] for key in cache.entries.keys()]
+    assert id(layers[0].data) not in keys
+
+
+def test_only_small_downscaled_images_are_persisted(tmp_path, monkeypatch):
+    from napari_tree_rings.image.checkpoint import CheckpointStore
+    data = np.random.randint(0, 255, (120, 80, 3), dtype=np.uint8)
+    layer = Image(data, rgb=True)
+    store = CheckpointStore(str(tmp_path))
+    cache = PreprocessingCache()
+
+    cache.getDownscaled(layer, 2.5, store, method='gaussian')
+
+    imageHash = cache.getImageHash(layer)
+    assert not store.contains(store.getKey(imageHash, 'grayscale', 'trunk'))
+    assert store.contains(store.getKey(imageHash, 'downscaled', 2.5, 'gaussian', 'trunk'))
+    monkeypatch.setattr(PreprocessingCache, "maxPersistedBytes", 1000)
+    cache.getDownscaled(layer, 2.5, store, method='mean')
+    assert not store.contains(store.getKey(imageHash, 'downscaled', 2.5, 'mean', 'trunk'))
+
+
+def test_trunk_is_segmented_on_the_rgb2gray_image():
+    disc = utils.make_tree_disc(1200, type='rgb')
+    layer = Image(disc, rgb=True)
+    cache = PreprocessingCache()
+
+    assert np.allclose(cache.getGrayscale(layer, 'trunk') / 255, rgb2gray(disc), atol=1e-5)
+    for method in ('rescale', 'mean'):
+        expected = SegmentTrunk.downscale(SegmentTrunk.convertImage(disc), 8, method)
+        image = cache.getDownscaled(layer, 8, method=method)
+        assert np.allclose(image / 255, expected, atol=1e-5)
+        assert np.array_equal(SegmentTrunk.meanThresholdImage(image), SegmentTrunk.meanThresholdImage(expected))
+
+
+def test_derivatives_of_an_image_edited_in_place_are_computed_again():
+    data = np.random.randint(0, 255, (1000, 1000, 3), dtype=np.uint8)
+    layer = Image(data, rgb=True)
+    cache = PreprocessingCache()
+    gray = cache.getGrayscale(layer)
+    imageHash = cache.getImageHash(layer)
+
+    layer.data[100:200, 50:150] = 0
+    assert not np.array_equal(cache.getGrayscale(layer), gray)
+    assert cache.getImageHash(layer) != imageHash
+
+    gray = cache.getGrayscale(layer)
+    layer.data[101, 51] = 255
+    layer.data = layer.data
+    assert np.isclose(cache.getGrayscale(layer)[101, 51], 255)
+    assert cache.getGrayscale(layer) is not gray
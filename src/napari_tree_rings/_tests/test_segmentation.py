@@ -0,0 +1,159 @@
+import os
+import math
+import cv2
+import appdirs
+import numpy as np
+import pandas as pd
+import tifffile
+from scipy import ndimage
+from skimage import morphology
+from skimage.filters import threshold_mean
+from napari.layers import Image
+from napari_tree_rings.image.instrumentation import Instrumentation
+from napari_tree_rings.image.preprocessing import PreprocessingCache
+from napari_tree_rings.image.process import RingsSegmenter, BatchSegmentTrunk
+from napari_tree_rings.image.segmentation import SegmentTrunk
+from napari_tree_rings._tests import utils
+
+
+
+def test_opening_gives_the_mask_of_binary_opening_with_a_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentTrunk, "getOptionsPath", lambda self: str(tmp_path / "st_options.txt"))
+    rng = np.random.default_rng(0)
+    noise = ndimage.gaussian_filter(rng.random((150, 130)), 4) > 0.5
+    noise[0:30, 0:40] = True
+    disc = utils.make_tree_disc(160)
+    trunk = disc < threshold_mean(disc)
+    operation = SegmentTrunk(None)
+
+    for mask in (noise, trunk, ~trunk):
+        for radius in (0, 1, 3, 10, 20):
+            operation.options['opening'] = radius
+            expected = morphology.binary_opening(mask, morphology.disk(radius))
+            if len(np.unique(expected)) == 1:
+                expected = mask
+            assert np.array_equal(SegmentTrunk.binaryOpening(mask * 255, radius), expected)
+            assert np.array_equal(operation.morphoOpenImage((mask * 255).astype(np.uint8)) > 0, expected)
+    assert not SegmentTrunk.binaryOpening(np.zeros((20, 20)), 5).any()
+    assert SegmentTrunk.binaryOpening(np.ones((20, 20)), 5).all()
+
+
+def test_auto_scale_keeps_working_size_and_physical_opening(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentTrunk, "getOptionsPath", lambda self: str(tmp_path / "st_options.txt"))
+    for length in (4000, 40000):
+        operation = SegmentTrunk(None)
+        operation.options['autoScale'] = True
+        operation.applyAutoScale((length, length), 0.02, 'mm')
+        workingMegapixels = (length / operation.options['scale']) ** 2 / 1e6
+        openingMillimetres = operation.options['opening'] * operation.options['scale'] * 0.02
+
+        assert 1.0 < workingMegapixels < 4.0
+        assert abs(openingMillimetres - 15.0) < 0.1 * 15.0
+
+    operation = SegmentTrunk(None)
+    operation.options['autoScale'] = True
+    operation.applyAutoScale((8000, 8000), 1, 'pixel')
+    assert operation.options['scale'] == 6
+    assert operation.options['opening'] == 128
+
+
+def test_fixed_scale_is_not_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentTrunk, "getOptionsPath", lambda self: str(tmp_path / "st_options.txt"))
+    operation = SegmentTrunk(None)
+    operation.applyAutoScale((40000, 40000), 0.02, 'mm')
+
+    assert operation.options['scale'] == 8 and operation.options['opening'] == 96
+
+
+def test_block_mean_downscaling_gives_the_threshold_masks_of_rescale():
+    assert SegmentTrunk.getDefaultOptions()['downscaling'] == 'rescale'
+    for disc in (utils.make_tree_disc(1603, type='rgb'), utils.make_tree_disc(1200, rings=30)):
+        gray = PreprocessingCache.convertToGrayscale(disc)
+        masks = []
+        for method in ('rescale', 'mean'):
+            image = SegmentTrunk.downscale(gray, 8, method)
+            masks.append(SegmentTrunk.keep_largest_region(SegmentTrunk.meanThresholdImage(image)))
+
+        assert masks[0].shape == masks[1].shape
+        assert np.mean(masks[0] != masks[1]) < 0.005
+        mean = SegmentTrunk.downscale(disc, 8, 'mean')
+        assert np.allclose(PreprocessingCache.convertToGrayscale(mean), SegmentTrunk.downscale(gray, 8, 'mean'),
+                           atol=1e-3)
+
+
+def test_contour_hull_gives_the_shape_of_the_image_hull(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentTrunk, "getOptionsPath", lambda self: str(tmp_path / "st_options.txt"))
+    operation = SegmentTrunk(None)
+    assert operation.options['hull'] == 'image'
+    mask = np.zeros((600, 500), dtype=np.uint8)
+    mask[100:500, 80:420] = utils.make_tree_disc(400)[:, 30:370] < 200
+    mask[150:200, 60:100] = 1
+
+    imageHull = operation.createShapes(operation.convexHullImage(mask)).data[0]
+    contourHull = operation.createShapesFromPolygon(operation.convexHullPolygon(mask)).data[0]
+
+    imageArea = cv2.contourArea(imageHull.astype(np.float32))
+    contourArea = cv2.contourArea(contourHull.astype(np.float32))
+    assert abs(contourArea - imageArea) < 0.01 * imageArea
+    edges = np.hypot(*np.diff(contourHull, axis=0).T)
+    assert abs(np.median(edges) - operation.options['vertexSpacing']) < 1
+
+
+def test_rings_are_only_predicted_in_the_region_of_the_trunk(tmp_path, monkeypatch):
+    from tree_ring_analyzer.segmentation import TreeRingSegmentation
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    models = utils.use_fake_models(monkeypatch)
+    disc = utils.make_tree_disc(400)
+    image = np.pad(disc, ((60, 540), (420, 80)), constant_values=230)
+    layer = Image(image, name="disc.tif")
+    segmenter = RingsSegmenter(layer)
+    segmenter.instrumentation = Instrumentation('rings', layer, options={}, sinks=[])
+    segmenter.ringsModel = models['rings']
+    segmentation = TreeRingSegmentation()
+    segmentation.patchSize = 256
+    segmentation.overlap = 60
+
+    full = segmentation.predictRing(models['rings'], image[:, :, None])
+    fullTiles = models['rings'].tiles
+    roi = segmenter.getTrunkROI()
+    inROI = segmenter.predictRingInROI(segmentation, image[:, :, None], roi)
+
+    predictedTiles = models['rings'].tiles - fullTiles
+    assert predictedTiles == segmenter.instrumentation.options['roiPatches'][0]
+    assert predictedTiles < 0.5 * fullTiles
+    yy, xx = np.mgrid[0:image.shape[0], 0:image.shape[1]]
+    trunk = np.hypot(yy - 260, xx - 620) < 0.4 * 400
+    assert np.allclose(inROI[trunk], full[trunk], atol=1e-4)
+    assert not inROI[~trunk][np.hypot(yy - 260, xx - 620)[~trunk] > 0.4 * 400 + 300].any()
+
+
+def test_patches_of_several_images_are_predicted_in_full_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    models = utils.use_fake_models(monkeypatch)
+    sourceFolder = os.path.join(tmp_path, "in")
+    os.makedirs(sourceFolder)
+    for index, size in enumerate((300, 380, 460)):
+        tifffile.imwrite(os.path.join(sourceFolder, "disc_{}.tif".format(index)), utils.make_tree_disc(size))
+    results = []
+    runs = []
+    for imagesPerBatch in (1, 3):
+        segmenter = RingsSegmenter(None)
+        segmenter.options['cachePredictions'] = False
+        segmenter.options['imagesPerBatch'] = imagesPerBatch
+        segmenter.saveOptions()
+        outputFolder = os.path.join(tmp_path, "out_{}".format(imagesPerBatch))
+        os.makedirs(outputFolder)
+        calls, tiles = models['rings'].calls, models['rings'].tiles
+
+        for _ in BatchSegmentTrunk(sourceFolder, outputFolder).runBatch():
+            pass
+
+        results.append([pd.read_csv(os.path.join(outputFolder, "disc_{}_parameters.csv".format(index)))
+                        for index in range(3)])
+        runs.append((models['rings'].calls - calls, models['rings'].tiles - tiles))
+    (singleCalls, singleTiles), (batchedCalls, batchedTiles) = runs
+    assert singleCalls == 3
+    assert batchedTiles == 8 * math.ceil(singleTiles / 8)
+    assert batchedCalls == batchedTiles // 8
+    for single, batched in zip(*results):
+        assert np.allclose(single['area'], batched['area'])
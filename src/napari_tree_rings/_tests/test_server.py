@@ -0,0 +1,121 @@
+import os
+import socket
+import threading
+import appdirs
+import numpy as np
+import pytest
+import tifffile
+from napari.layers import Image
+from napari_tree_rings.image.inbd import INBDBackend
+from napari_tree_rings.image.process import RingsSegmenter
+from napari_tree_rings.image.server import InferenceServer, InferenceClient, RemoteModel
+from napari_tree_rings._tests import utils
+
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    folder = os.path.join(tmp_path, "user_data")
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: folder)
+    monkeypatch.setattr(InferenceServer, "getAddress", classmethod(lambda cls: os.path.join(tmp_path, "inference.sock")))
+    monkeypatch.setattr(InferenceClient, "clients", {})
+    server = InferenceServer.create()
+
+    def serve():
+        try:
+            server.serve_forever()
+        except SystemExit:
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield server
+    server.stop_event.set()
+    thread.join()
+
+
+@pytest.fixture
+def discLayer(tmp_path):
+    path = os.path.join(tmp_path, "disc.tif")
+    img = utils.make_tree_disc(300)
+    tifffile.imwrite(path, img)
+    layer = Image(img, name="disc.tif")
+    layer.metadata['path'] = path
+    return layer
+
+
+def test_segmenter_uses_the_models_of_the_inference_server(server, discLayer, monkeypatch):
+    models = utils.use_fake_models(monkeypatch)
+    segmenter = RingsSegmenter(discLayer)
+    segmenter.options['cachePredictions'] = False
+    segmenter.saveOptions()
+    local = RingsSegmenter(discLayer)
+    for _ in local.run():
+        pass
+    segmenter.options['inferenceServer'] = True
+    segmenter.saveOptions()
+    calls = models['rings'].calls
+
+    for _ in segmenter.run():
+        pass
+
+    assert isinstance(segmenter.ringsModel, RemoteModel)
+    assert models['rings'].calls > calls
+    assert len(segmenter.resultsLayer.data) == len(local.resultsLayer.data)
+    assert all(np.allclose(remote, ring) for remote, ring in zip(segmenter.resultsLayer.data, local.resultsLayer.data))
+    assert os.stat(InferenceServer.getAuthKeyPath()).st_mode & 0o077 == 0
+
+
+def test_inbd_runs_in_the_inference_server(server, discLayer, monkeypatch):
+    utils.use_fake_models(monkeypatch)
+    model = utils.FakeINBDModel()
+    monkeypatch.setattr(RingsSegmenter, "getINBDModel", classmethod(lambda cls, path, **kwargs: model))
+    segmenter = RingsSegmenter(discLayer)
+    segmenter.options['method'] = 'INBD'
+    segmenter.options['inferenceServer'] = True
+
+    output = segmenter.getINBDBackend().process(discLayer.data)
+
+    expected = INBDBackend.toInput(discLayer.data, model.scale)
+    assert len(model.images) == 1 and np.allclose(model.images[0], expected)
+    assert len(output.boundaries) == 3
+
+
+def test_models_are_run_locally_without_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    monkeypatch.setattr(InferenceServer, "getAddress", classmethod(lambda cls: os.path.join(tmp_path, "none.sock")))
+    monkeypatch.setattr(InferenceClient, "clients", {})
+    models = utils.use_fake_models(monkeypatch)
+    segmenter = RingsSegmenter(None)
+    segmenter.options['inferenceServer'] = True
+
+    segmenter.loadKerasModels()
+
+    assert segmenter.ringsModel is models['rings']
+
+
+def test_server_does_not_replace_a_running_server(server):
+    address = InferenceServer.getAddress()
+
+    with pytest.raises(RuntimeError):
+        InferenceServer.create()
+    with pytest.raises(RuntimeError):
+        InferenceServer.create(authkey=b"other key")
+
+    assert os.path.exists(address)
+    assert InferenceClient(address).service.ping() == os.getpid()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="the server listens on a port on windows")
+def test_server_replaces_the_socket_of_a_killed_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(appdirs, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    address = os.path.join(tmp_path, "stale.sock")
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(address)
+    stale.close()
+
+    server = InferenceServer.create(address)
+
+    assert server.address == address
+    assert not InferenceServer.isRunning(os.path.join(tmp_path, "none.sock"))
+    server.listener.close()
@@ -1,3 +1,6 @@
+import os
+import time
+from types import SimpleNamespace
 import numpy as np
 
 def make_checkboard(shape, size, type):
@@ -21,24 +24,145 @@ def make_checkboard(shape, size, type):
 
     board = (np.indices((n_y, n_x)).sum(axis=0) % 2)
 
-    for y in range(n_y):
-        for x in range(n_x):
-            y0 = y * size
-            x0 = x * size
-            y1 = min((y + 1) * size, height)
-            x1 = min((x + 1) * size, width)
-
-            if board[y, x] == 1:
-                if type == 'grayscale':
-                    value = np.random.randint(0, 256, dtype=np.uint16)
-                    img[y0:y1, x0:x1] = value
-                else:  # rgb
-                    value = np.random.randint(0, 256, size=(3, 1, 1), dtype=np.uint8)
-                    img[:, y0:y1, x0:x1] = value
+    if type == 'grayscale':
+        values = np.random.randint(0, 256, size=(n_y, n_x), dtype=np.uint16) * board
+        img[:] = np.repeat(np.repeat(values, size, axis=0), size, axis=1)[:height, :width]
+    else:  # rgb
+        values = np.random.randint(0, 256, size=(3, n_y, n_x), dtype=np.uint8) * board.astype(np.uint8)
+        img[:] = np.repeat(np.repeat(values, size, axis=1), size, axis=2)[:, :height, :width]
+
+    return img
+
+
+def make_tree_disc(size, rings=12, type='grayscale', seed=0, chunk=1024):
+    """Synthetic cross-section of a trunk: a disc of radius 0.4 * size with rings dark latewood bands on a bright
+    background. The image is computed in blocks of rows, so that discs of 20k x 20k pixels only need a few
+    temporaries of one block."""
+    if type not in ('grayscale', 'rgb'):
+        raise ValueError("type must be either 'grayscale' or 'rgb'")
 
+    rng = np.random.default_rng(seed)
+    shape = (size, size) if type == 'grayscale' else (size, size, 3)
+    img = np.empty(shape, dtype=np.uint8)
+    center = size / 2
+    radius = 0.4 * size
+    ringWidth = radius / rings
+    tint = np.array([1.0, 0.85, 0.7], dtype=np.float32)
+    xx = np.arange(size, dtype=np.float32) - center
+    for start in range(0, size, chunk):
+        yy = np.arange(start, min(start + chunk, size), dtype=np.float32)[:, None] - center
+        distance = np.sqrt(yy * yy + xx * xx)
+        angle = np.arctan2(yy, xx)
+        position = (distance * (1 + 0.02 * np.sin(3 * angle)) / ringWidth) % 1
+        block = np.where(distance < radius, 170 - 90 * position ** 6, 230)
+        block = block + 4 * rng.standard_normal(block.shape, dtype=np.float32)
+        if type == 'rgb':
+            block = block[:, :, None] * tint
+        img[start:start + chunk] = np.clip(block, 0, 255)
     return img
 
 
+class FakeKerasModel:
+    """Stands in for the keras models of the rings and of the pith. The rings model answers the darkness of the
+    latewood as distance map, the pith model a disc in the middle of each tile."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.calls = 0
+        self.tiles = 0
+
+    def get_config(self):
+        return {'layers': [{'config': {'batch_shape': [None, None, None, 1]}}]}
+
+    def predict(self, tiles, batch_size=8, verbose=0):
+        self.calls = self.calls + 1
+        tiles = np.asarray(tiles, dtype=np.float32)
+        self.tiles = self.tiles + len(tiles)
+        if self.kind == 'rings':
+            return np.clip((0.45 - tiles) * 4, 0, 1)
+        size = tiles.shape[1]
+        yy, xx = np.mgrid[0:size, 0:size]
+        pith = (np.hypot(yy - size / 2, xx - size / 2) < size / 8).astype(np.float32)
+        return np.broadcast_to(pith[None, :, :, None], tiles.shape[0:3] + (1,)).copy()
+
+
+class FakeINBDModel:
+    """Stands in for an INBD model. It answers concentric circles as boundaries, in the coordinates of the image it
+    is given, which is scaled down by its scale like by the image loader of INBD, and records the images it was
+    given. If batched is True, it can process several images in one pass."""
+
+    def __init__(self, batched=False, rings=3):
+        self.scale = 2
+        self.rings = rings
+        self.images = []
+        self.passes = []
+        if batched:
+            self.process_images = self.processImages
+
+    def process_image(self, image):
+        self.images.append(image)
+        self.passes.append(1)
+        return self.getOutput(image)
+
+    def processImages(self, images):
+        self.images.extend(images)
+        self.passes.append(len(images))
+        return [self.getOutput(image) for image in images]
+
+    def getOutput(self, image):
+        height, width = image.shape[0:2]
+        angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+        boundaries = []
+        for ring in range(1, self.rings + 1):
+            radius = 0.4 * min(height, width) * ring / self.rings
+            points = np.stack([height / 2 + radius * np.sin(angles), width / 2 + radius * np.cos(angles)], axis=1)
+            boundaries.append(SimpleNamespace(boundarypoints=points))
+        return SimpleNamespace(boundaries=boundaries)
+
+
+def use_fake_models(monkeypatch):
+    """Make the rings segmenters use fake keras models instead of downloading and loading the real ones."""
+    from napari_tree_rings.image.process import RingsSegmenter
+
+    models = {'rings': FakeKerasModel('rings'), 'pith': FakeKerasModel('pith')}
+    monkeypatch.setattr(RingsSegmenter, "loadModels", lambda self, path, key: ['fake_' + key + '.keras'])
+    monkeypatch.setattr(RingsSegmenter, "getKerasModel",
+                        classmethod(lambda cls, path: models['rings' if 'rings' in os.path.basename(path) else 'pith']))
+    monkeypatch.setattr(RingsSegmenter, "getModelFileId", classmethod(lambda cls, path: os.path.basename(path)))
+    return models
+
+
+def run_fake_batch_worker(connection, sourceFolder, outputFolder):
+    """Stands in for the worker of an isolated batch. It hangs on images whose name contains hang, allocates 512 MB
+    and hangs on images whose name contains alloc, dies on images whose name contains crash and answers an empty
+    result for the other images."""
+
+    while True:
+        imageFilename = connection.recv()
+        if imageFilename is None:
+            return
+        if 'alloc' in imageFilename:
+            memory = np.ones(512 * 2 ** 20, dtype=np.uint8)
+            time.sleep(3600)
+        if 'hang' in imageFilename:
+            time.sleep(3600)
+        if 'crash' in imageFilename:
+            os._exit(3)
+        connection.send({'status': 'done', 'seconds': 0.0, 'error': '', 'stageTimes': {},
+                         'manifest': {'image': imageFilename, 'seconds': 0.0}})
+
+
+def make_torch_network():
+    """Answer a small convolutional network in evaluation mode, standing in for the networks of the INBD model.
+    Needs torch."""
+
+    import torch
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Conv2d(3, 16, 3, padding=1), torch.nn.BatchNorm2d(16), torch.nn.ReLU(),
+                               torch.nn.Conv2d(16, 16, 3, padding=1), torch.nn.ReLU(),
+                               torch.nn.Conv2d(16, 1, 1)).eval().requires_grad_(False)
+
+
 if __name__ == "__main__":
     import tifffile
 
@@ -50,4 +174,4 @@ if __name__ == "__main__":
 
     # Save the images
     tifffile.imwrite('/tmp/checkboard_gray.tif', check)
-    tifffile.imwrite('/tmp/checkboard_rgb.tif' , check_rgb)
\ No newline at end of file
+    tifffile.imwrite('/tmp/checkboard_rgb.tif' , check_rgb)
@@ -5,19 +5,18 @@ Widgets of the napari-tree-ring plugin.
 import os
 import napari
 from napari.qt.threading import create_worker
+from napari.utils import notifications
 from typing import TYPE_CHECKING
 from pathlib import Path
 from qtpy.QtGui import QIcon
 from qtpy.QtCore import Qt
 from qtpy.QtCore import Slot
 from qtpy.QtWidgets import QGroupBox, QFileDialog
-from qtpy.QtWidgets import QHBoxLayout, QVBoxLayout, QFormLayout, QPushButton, QWidget
+from qtpy.QtWidgets import QHBoxLayout, QVBoxLayout, QFormLayout, QPushButton, QWidget, QListWidget
 from napari.layers import Image
 from napari_tree_rings.qtutil import WidgetTool, TableView
-from napari_tree_rings.image.process import TrunkSegmenter
-from napari_tree_rings.image.process import RingsSegmenter
-from napari_tree_rings.image.process import BatchSegmentTrunk
-from napari_tree_rings.image.segmentation import SegmentTrunk
+from napari_tree_rings.image.measure import MeasurementCollector
+from napari_tree_rings.jobs import SegmentationJob, JobScheduler
 if TYPE_CHECKING:
     import napari
 
@@ -34,10 +33,17 @@ class SegmentTrunkWidget(QWidget):
         self.fieldWidth = 300
         self.runButton = None
         self.runBatchButton = None
+        self.stopBatchButton = None
         self.segmenter = None
         self.batchSegmenter = None
         self.ringsSegmenter = None
-        self.measurements = {}
+        self.results = MeasurementCollector()
+        self.scheduler = JobScheduler(parent=self)
+        self.scheduler.jobChanged.connect(self.onJobChanged)
+        self.scheduler.jobFinished.connect(self.onJobFinished)
+        self.jobList = None
+        self.maxConcurrentJobsInput = None
+        self.measurements = self.results.getTable()
         self.table = TableView(self.measurements)
         self.segmentTrunkOptionsButton = None
         self.segmentRingsOptionsButton = None
@@ -49,6 +55,7 @@ class SegmentTrunkWidget(QWidget):
         self.outputFolder = str(Path.home())
         self.outputRingFolder = str(Path.home())
         self.createLayout()
+        self.setAcceptDrops(True)
         self.tableDockWidget = self.viewer.window.add_dock_widget(self.table,
                                                                   area='right', name='measurements', tabify=False)
         self.onStartUpFinished()
@@ -56,9 +63,11 @@ class SegmentTrunkWidget(QWidget):
 
     def createLayout(self):
         segmentRingsLayout = self.createSegmentRingsLayout()
+        queueLayout = self.createQueueLayout()
         batchLayout = self.createBatchProcessingLayout()
         mainLayout = QVBoxLayout()
         mainLayout.addLayout(segmentRingsLayout)
+        mainLayout.addLayout(queueLayout)
         mainLayout.addLayout(batchLayout)
         self.setLayout(mainLayout)
 
@@ -82,6 +91,36 @@ class SegmentTrunkWidget(QWidget):
         return segmentVLayout
 
 
+    def createQueueLayout(self):
+        self.jobList = QListWidget()
+        self.jobList.setSelectionMode(QListWidget.ExtendedSelection)
+        maxConcurrentJobsLabel, self.maxConcurrentJobsInput = WidgetTool.getLineInput(self, "Parallel jobs: ",
+                                                                            self.scheduler.maxConcurrentJobs,
+                                                                            50,
+                                                                            self.maxConcurrentJobsChanged)
+        addFilesButton = QPushButton("Add &Files")
+        addFilesButton.clicked.connect(self.addFilesButtonClicked)
+        cancelJobsButton = QPushButton("Cancel Jobs")
+        cancelJobsButton.clicked.connect(self.cancelJobsButtonClicked)
+        clearDoneJobsButton = QPushButton("Clear Done")
+        clearDoneJobsButton.clicked.connect(self.clearDoneJobsButtonClicked)
+        buttonsLayout = QHBoxLayout()
+        buttonsLayout.addWidget(maxConcurrentJobsLabel)
+        buttonsLayout.addWidget(self.maxConcurrentJobsInput)
+        buttonsLayout.addWidget(addFilesButton)
+        buttonsLayout.addWidget(cancelJobsButton)
+        buttonsLayout.addWidget(clearDoneJobsButton)
+        queueLayout = QVBoxLayout()
+        queueGroupBox = QGroupBox("Queue")
+        groupBoxLayout = QVBoxLayout()
+        groupBoxLayout.setContentsMargins(*self.getGroupBoxMargins())
+        queueGroupBox.setLayout(groupBoxLayout)
+        groupBoxLayout.addWidget(self.jobList)
+        groupBoxLayout.addLayout(buttonsLayout)
+        queueLayout.addWidget(queueGroupBox)
+        return queueLayout
+
+
     def createBatchProcessingLayout(self):
         sourceFileLayout = self.createSourceFileLayout()
         outputFileLayout = self.createOutputFileLayout()
@@ -89,7 +128,11 @@ class SegmentTrunkWidget(QWidget):
         self.runBatchButton = QPushButton("Run &Batch")
         self.runBatchButton.clicked.connect(self.runBatchButtonClicked)
         self.runBatchButton.setEnabled(False)
+        self.stopBatchButton = QPushButton("&Stop Batch")
+        self.stopBatchButton.clicked.connect(self.stopBatchButtonClicked)
+        self.stopBatchButton.setEnabled(False)
         runBatchLayout.addWidget(self.runBatchButton)
+        runBatchLayout.addWidget(self.stopBatchButton)
         batchLayout = QVBoxLayout()
         batchGroupBox = QGroupBox("Batch Segment Trunk")
         groupBoxLayout = QVBoxLayout()
@@ -159,6 +202,15 @@ class SegmentTrunkWidget(QWidget):
         return sourceFileLayout
 
 
+    def getSelectedImageLayers(self):
+        layers = [layer for layer in self.viewer.layers.selection if type(layer) is Image]
+        if not layers:
+            layer = self.getActiveLayer()
+            if layer and type(layer) is Image:
+                layers = [layer]
+        return layers
+
+
     def getActiveLayer(self):
         if len(self.viewer.layers) == 0:
             return None
@@ -176,26 +228,49 @@ class SegmentTrunkWidget(QWidget):
 
 
     def onRunSegmentRingsButtonPressed(self):
-        print("Starting ring segmentation....")
-        layer = self.getActiveLayer()
-        if not layer or not type(layer) is Image:
-            return
-        layer.metadata['path'] = layer.source.path
+        """Add a job for each selected image layer to the queue."""
 
-        self.ringsSegmenter = RingsSegmenter(layer)
-        self.ringsSegmenter.measurements = self.measurements
-        workerRing = create_worker(self.ringsSegmenter.run,
-                               _progress={'total': 4, 'desc': 'Segment Rings & Pith'})
-        workerRing.finished.connect(self.onRingsSegmentationFinished)
-        self.deactivateButtons()
-        workerRing.start()
+        for layer in self.getSelectedImageLayers():
+            layer.metadata['path'] = layer.source.path
+            self.scheduler.submit(SegmentationJob(layer=layer))
 
-        self.segmenter = TrunkSegmenter(layer)
-        self.segmenter.measurements = self.measurements
-        worker = create_worker(self.segmenter.run,
-                               _progress={'total': 15, 'desc': 'Segment Trunk'})
-        worker.finished.connect(self.onSegmentationFinished)
-        worker.start()
+
+    def addFilesButtonClicked(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "Images", self.sourceFolder, "Tiff-files (*.tif *.tiff)")
+        for path in paths:
+            self.scheduler.submit(SegmentationJob(path=path))
+
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+
+    def dropEvent(self, event):
+        """Add a job for each dropped file to the queue."""
+
+        for url in event.mimeData().urls():
+            path = url.toLocalFile()
+            if os.path.isfile(path):
+                self.scheduler.submit(SegmentationJob(path=path))
+        event.acceptProposedAction()
+
+
+    def cancelJobsButtonClicked(self):
+        for item in self.jobList.selectedItems():
+            self.scheduler.cancel(self.scheduler.jobs[self.jobList.row(item)])
+
+
+    def clearDoneJobsButtonClicked(self):
+        self.scheduler.clearDoneJobs()
+        self.onJobChanged(None)
+
+
+    def maxConcurrentJobsChanged(self):
+        text = self.maxConcurrentJobsInput.text().strip()
+        if text.isdigit() and int(text) > 0:
+            self.scheduler.maxConcurrentJobs = int(text)
+            self.scheduler.startNextJobs()
 
 
     def runBatchButtonClicked(self):
@@ -204,41 +279,64 @@ class SegmentTrunkWidget(QWidget):
         if not self.outputFolder or not (os.path.exists(self.outputFolder) and os.path.isdir(self.outputFolder)):
             return
         # imagePaths = os.listdir(self.sourceFolder)
+        from napari_tree_rings.image.process import BatchSegmentTrunk
         self.batchSegmenter = BatchSegmentTrunk(self.sourceFolder, self.outputFolder)
         worker = create_worker(self.batchSegmenter.runBatch,
                                _progress={'desc': 'Batch Segment Trunk'})
         # worker.yielded.connect(self.onTableChanged)
-        worker.finished.connect(self.activateButtons)
+        worker.finished.connect(self.onBatchFinished)
         self.deactivateButtons()
+        self.stopBatchButton.setEnabled(True)
         worker.start()
 
 
-    @Slot()
-    def onSegmentationFinished(self):
+    def stopBatchButtonClicked(self):
+        self.batchSegmenter.cancel()
+        self.stopBatchButton.setEnabled(False)
+
+
+    def onBatchFinished(self):
+        self.stopBatchButton.setEnabled(False)
+        self.activateButtons()
+
+
+    @Slot(object)
+    def onJobChanged(self, job):
+        selectedRows = [self.jobList.row(item) for item in self.jobList.selectedItems()]
+        self.jobList.clear()
+        self.jobList.addItems([str(aJob) for aJob in self.scheduler.jobs])
+        for row in selectedRows:
+            if row < self.jobList.count():
+                self.jobList.item(row).setSelected(True)
+
+
+    @Slot(object)
+    def onJobFinished(self, job):
+        """Display the results of the job and add its measurements to the table."""
+
+        self.segmenter = job.trunkSegmenter
+        self.ringsSegmenter = job.ringsSegmenter
+        if job.layer not in self.viewer.layers:
+            self.viewer.add_layer(job.layer)
         self.viewer.scale_bar.unit = self.segmenter.tiffFileTags.unit
         self.addTrunkSegmentationToViewer(self.segmenter.shapeLayer)
-        if self.tableDockWidget is not None:
-            self.tableDockWidget.close()
-        self.measurements = self.segmenter.measurements
-        self.table = TableView(self.measurements)
+        self.viewer.add_layer(self.ringsSegmenter.resultsLayer)
+        self.results.merge(self.segmenter.measurements)
+        self.results.merge(self.ringsSegmenter.measurements)
+        self.showMeasurements()
         self.table.saveData(self.outputRingFolder)
-        self.tableDockWidget = self.viewer.window.add_dock_widget(self.table, area='right', name='measurements',
-                                                                  tabify=False)
-        self.activateButtons()
+        job.releaseImage()
 
 
-    @Slot()
-    def onRingsSegmentationFinished(self):
-        self.viewer.scale_bar.unit = self.ringsSegmenter.tiffFileTags.unit
-        self.viewer.add_layer(self.ringsSegmenter.resultsLayer)
+    def showMeasurements(self):
+        """Replace the table in the measurements dock-widget with the measurements collected so far."""
+
         if self.tableDockWidget is not None:
             self.tableDockWidget.close()
-        self.measurements = self.ringsSegmenter.measurements
+        self.measurements = self.results.getTable()
         self.table = TableView(self.measurements)
-        # self.table.saveData(self.outputRingFolder)
         self.tableDockWidget = self.viewer.window.add_dock_widget(self.table, area='right', name='measurements',
                                                                   tabify=False)
-        # self.activateButtons()
 
 
     def activateButtons(self):
@@ -326,10 +424,18 @@ class SegmentTrunkOptionsWidget(QWidget):
     def __init__(self, viewer):
         super().__init__()
         self.viewer = viewer
+        from napari_tree_rings.image.segmentation import SegmentTrunk
         self.segmentTrunk = SegmentTrunk(None)
         self.options = self.segmentTrunk.options
         self.scaleFactorInput = None
         self.openingInput = None
+        self.checkpointsInput = None
+        self.downscalingCombo = None
+        self.autoScaleInput = None
+        self.workingMegapixelsInput = None
+        self.openingRadiusInput = None
+        self.hullCombo = None
+        self.vertexSpacingInput = None
         self.strokeWidthInput = None
         self.fieldWidth = 200
         self.createLayout()
@@ -344,6 +450,26 @@ class SegmentTrunkOptionsWidget(QWidget):
                                                               self.options['opening'],
                                                               self.fieldWidth,
                                                               self.openingChanged)
+        checkpointsLabel, self.checkpointsInput = WidgetTool.getCheckBoxInput(self, "Cache stage results: ",
+                                                                              self.options['checkpoints'])
+        downscalingLabel, self.downscalingCombo = WidgetTool.getComboInput(self, "Downscaling: ", ['rescale', 'mean'])
+        self.downscalingCombo.setCurrentText(self.options['downscaling'])
+        autoScaleLabel, self.autoScaleInput = WidgetTool.getCheckBoxInput(self, "Automatic scale: ",
+                                                                          self.options['autoScale'])
+        workingMegapixelsLabel, self.workingMegapixelsInput = WidgetTool.getLineInput(self, "Working size (MPx): ",
+                                                                    self.options['workingMegapixels'],
+                                                                    self.fieldWidth,
+                                                                    self.workingMegapixelsChanged)
+        openingMillimetresLabel, self.openingRadiusInput = WidgetTool.getLineInput(self, "Opening radius (mm): ",
+                                                                    self.options['openingRadius'],
+                                                                    self.fieldWidth,
+                                                                    self.openingChanged)
+        hullLabel, self.hullCombo = WidgetTool.getComboInput(self, "Convex hull: ", ['image', 'contour'])
+        self.hullCombo.setCurrentText(self.options['hull'])
+        vertexSpacingLabel, self.vertexSpacingInput = WidgetTool.getLineInput(self, "Vertex spacing: ",
+                                                                    self.options['vertexSpacing'],
+                                                                    self.fieldWidth,
+                                                                    self.vertexSpacingChanged)
         saveButton = QPushButton("&Save")
         saveButton.clicked.connect(self.saveOptionsButtonPressed)
         saveAndCloseButton = QPushButton("Save && Close")
@@ -359,6 +485,13 @@ class SegmentTrunkOptionsWidget(QWidget):
         formLayout.setLabelAlignment(Qt.AlignRight)
         formLayout.addRow(scaleFactorLabel, self.scaleFactorInput)
         formLayout.addRow(openingRadiusLabel, self.openingInput)
+        formLayout.addRow(checkpointsLabel, self.checkpointsInput)
+        formLayout.addRow(downscalingLabel, self.downscalingCombo)
+        formLayout.addRow(autoScaleLabel, self.autoScaleInput)
+        formLayout.addRow(workingMegapixelsLabel, self.workingMegapixelsInput)
+        formLayout.addRow(openingMillimetresLabel, self.openingRadiusInput)
+        formLayout.addRow(hullLabel, self.hullCombo)
+        formLayout.addRow(vertexSpacingLabel, self.vertexSpacingInput)
         mainLayout.addLayout(formLayout)
         mainLayout.addLayout(buttonsLayout)
         self.setLayout(mainLayout)
@@ -372,6 +505,14 @@ class SegmentTrunkOptionsWidget(QWidget):
         pass
 
 
+    def workingMegapixelsChanged(self):
+        pass
+
+
+    def vertexSpacingChanged(self):
+        pass
+
+
     def openingChanged(self):
         pass
 
@@ -399,6 +540,13 @@ class SegmentTrunkOptionsWidget(QWidget):
     def setOptionsFromDialog(self):
         self.segmentTrunk.options['scale'] = int(self.scaleFactorInput.text().strip())
         self.segmentTrunk.options['opening'] = int(self.openingInput.text().strip())
+        self.segmentTrunk.options['checkpoints'] = self.checkpointsInput.isChecked()
+        self.segmentTrunk.options['downscaling'] = self.downscalingCombo.currentText()
+        self.segmentTrunk.options['autoScale'] = self.autoScaleInput.isChecked()
+        self.segmentTrunk.options['workingMegapixels'] = float(self.workingMegapixelsInput.text().strip())
+        self.segmentTrunk.options['openingRadius'] = float(self.openingRadiusInput.text().strip())
+        self.segmentTrunk.options['hull'] = self.hullCombo.currentText()
+        self.segmentTrunk.options['vertexSpacing'] = float(self.vertexSpacingInput.text().strip())
 
 
     def saveOptionsButtonPressed(self):
@@ -425,6 +573,7 @@ class SegmentRingsOptionsWidget(QWidget):
     def __init__(self, viewer):
         super().__init__()
         self.viewer = viewer
+        from napari_tree_rings.image.process import RingsSegmenter
         self.segmentRings = RingsSegmenter(None)
         self.options = self.segmentRings.options
         self.ringsModelCombo = None
@@ -433,6 +582,26 @@ class SegmentRingsOptionsWidget(QWidget):
         self.overlapInput = None
         self.batchSizeInput = None
         self.thicknessInput = None
+        self.cachePredictionsInput = None
+        self.measureWorkersInput = None
+        self.measurePoolCombo = None
+        self.trunkROIInput = None
+        self.roiMarginInput = None
+        self.inbdBatchSizeInput = None
+        self.imagesPerBatchInput = None
+        self.inbdThreadsInput = None
+        self.inbdOptimizeInput = None
+        self.inbdCompileInput = None
+        self.inferenceSettingsCombo = None
+        self.inferenceServerInput = None
+        self.modelTimeToLiveInput = None
+        self.isolateImagesInput = None
+        self.imageTimeoutInput = None
+        self.imageMemoryLimitInput = None
+        self.filePatternsInput = None
+        self.recursiveInput = None
+        self.batchWorkersInput = None
+        self.calibrateButton = None
         self.fieldWidth = 200
         self.createLayout()
 
@@ -462,6 +631,11 @@ class SegmentRingsOptionsWidget(QWidget):
                                                                       self.options['batchSize'],
                                                                       self.fieldWidth,
                                                                       self.batchSizeChanged)
+        inferenceSettingsLabel, self.inferenceSettingsCombo = WidgetTool.getComboInput(self, "Inference settings: ",
+                                                                                       ['manual', 'auto'])
+        self.inferenceSettingsCombo.setCurrentText(self.options['inferenceSettings'])
+        self.calibrateButton = QPushButton("Calibrate")
+        self.calibrateButton.clicked.connect(self.calibrateButtonPressed)
         resizeLabel, self.resizeInput = WidgetTool.getLineInput(self, "Rescale Factor: ",
                                                                       self.options['resize'],
                                                                       self.fieldWidth,
@@ -469,6 +643,65 @@ class SegmentRingsOptionsWidget(QWidget):
         lossTypeLabel, self.lossTypeCombo = WidgetTool.getComboInput(self,
                                                                     "Heuristic function: ",
                                                                     ['H0', 'H01', 'H02'])
+        cachePredictionsLabel, self.cachePredictionsInput = WidgetTool.getCheckBoxInput(self, "Cache predictions: ",
+                                                                                    self.options['cachePredictions'])
+        trunkROILabel, self.trunkROIInput = WidgetTool.getCheckBoxInput(self, "Only inside the trunk: ",
+                                                                        self.options['trunkROI'])
+        roiMarginLabel, self.roiMarginInput = WidgetTool.getLineInput(self, "Margin around the trunk: ",
+                                                                      self.options['roiMargin'],
+                                                                      self.fieldWidth,
+                                                                      self.roiMarginChanged)
+        inbdBatchSizeLabel, self.inbdBatchSizeInput = WidgetTool.getLineInput(self, "INBD batch size: ",
+                                                                      self.options['inbdBatchSize'],
+                                                                      self.fieldWidth,
+                                                                      self.batchSizeChanged)
+        imagesPerBatchLabel, self.imagesPerBatchInput = WidgetTool.getLineInput(self, "Images per batch: ",
+                                                                      self.options['imagesPerBatch'],
+                                                                      self.fieldWidth,
+                                                                      self.batchSizeChanged)
+        inbdThreadsLabel, self.inbdThreadsInput = WidgetTool.getLineInput(self, "INBD threads: ",
+                                                                      self.options['inbdThreads'],
+                                                                      self.fieldWidth,
+                                                                      self.inbdThreadsChanged)
+        inbdOptimizeLabel, self.inbdOptimizeInput = WidgetTool.getCheckBoxInput(self, "Trace INBD model: ",
+                                                                                self.options['inbdOptimize'])
+        inbdCompileLabel, self.inbdCompileInput = WidgetTool.getCheckBoxInput(self, "Compile INBD model: ",
+                                                                              self.options['inbdCompile'])
+        inferenceServerLabel, self.inferenceServerInput = WidgetTool.getCheckBoxInput(self, "Use inference server: ",
+                                                                                      self.options['inferenceServer'])
+        modelTimeToLiveLabel, self.modelTimeToLiveInput = WidgetTool.getLineInput(self, "Unload idle models after (s): ",
+                                                                      self.options['modelTimeToLive'],
+                                                                      self.fieldWidth,
+                                                                      self.modelTimeToLiveChanged)
+        releaseModelsButton = QPushButton("Release models")
+        releaseModelsButton.clicked.connect(self.releaseModelsButtonPressed)
+        isolateImagesLabel, self.isolateImagesInput = WidgetTool.getCheckBoxInput(self, "Isolate batch images: ",
+                                                                                  self.options['isolateImages'])
+        imageTimeoutLabel, self.imageTimeoutInput = WidgetTool.getLineInput(self, "Time limit per image (s): ",
+                                                                      self.options['imageTimeout'],
+                                                                      self.fieldWidth,
+                                                                      self.imageLimitsChanged)
+        imageMemoryLimitLabel, self.imageMemoryLimitInput = WidgetTool.getLineInput(self, "Memory limit (MB): ",
+                                                                      self.options['imageMemoryLimit'],
+                                                                      self.fieldWidth,
+                                                                      self.imageLimitsChanged)
+        filePatternsLabel, self.filePatternsInput = WidgetTool.getLineInput(self, "Batch files: ",
+                                                                      self.options['filePatterns'],
+                                                                      self.fieldWidth,
+                                                                      self.filePatternsChanged)
+        recursiveLabel, self.recursiveInput = WidgetTool.getCheckBoxInput(self, "Include sub-folders: ",
+                                                                          self.options['recursive'])
+        batchWorkersLabel, self.batchWorkersInput = WidgetTool.getLineInput(self, "Batch workers: ",
+                                                                      self.options['batchWorkers'],
+                                                                      self.fieldWidth,
+                                                                      self.imageLimitsChanged)
+        measureWorkersLabel, self.measureWorkersInput = WidgetTool.getLineInput(self, "Measurement workers: ",
+                                                                      self.options['measureWorkers'],
+                                                                      self.fieldWidth,
+                                                                      self.measureWorkersChanged)
+        measurePoolLabel, self.measurePoolCombo = WidgetTool.getComboInput(self, "Measurement pool: ",
+                                                                           ['thread', 'process'])
+        self.measurePoolCombo.setCurrentText(self.options['measurePool'])
         
         saveButton = QPushButton("&Save")
         saveButton.clicked.connect(self.saveOptionsButtonPressed)
@@ -490,14 +723,42 @@ class SegmentRingsOptionsWidget(QWidget):
         self.formLayout.addRow(patchSizeLabel, self.patchSizeInput)
         self.formLayout.addRow(overlapLabel, self.overlapInput)
         self.formLayout.addRow(batchSizeLabel, self.batchSizeInput)
+        self.formLayout.addRow(imagesPerBatchLabel, self.imagesPerBatchInput)
+        self.formLayout.addRow(inferenceSettingsLabel, self.inferenceSettingsCombo)
+        self.formLayout.addRow("", self.calibrateButton)
         self.formLayout.addRow(resizeLabel, self.resizeInput)
         self.formLayout.addRow(lossTypeLabel, self.lossTypeCombo)
+        self.formLayout.addRow(cachePredictionsLabel, self.cachePredictionsInput)
+        self.formLayout.addRow(trunkROILabel, self.trunkROIInput)
+        self.formLayout.addRow(roiMarginLabel, self.roiMarginInput)
 
         methodLayout.setLabelAlignment(Qt.AlignRight)
         methodLayout.addRow(methodLabel, self.methodCombo)
+        methodLayout.addRow(inbdBatchSizeLabel, self.inbdBatchSizeInput)
+        methodLayout.addRow(inbdThreadsLabel, self.inbdThreadsInput)
+        methodLayout.addRow(inbdOptimizeLabel, self.inbdOptimizeInput)
+        methodLayout.addRow(inbdCompileLabel, self.inbdCompileInput)
+        methodLayout.addRow(inferenceServerLabel, self.inferenceServerInput)
+        methodLayout.addRow(modelTimeToLiveLabel, self.modelTimeToLiveInput)
+        methodLayout.addRow("", releaseModelsButton)
+
+        batchLayout = QFormLayout()
+        batchLayout.setLabelAlignment(Qt.AlignRight)
+        batchLayout.setContentsMargins(*SegmentTrunkWidget.getGroupBoxMargins())
+        batchLayout.addRow(filePatternsLabel, self.filePatternsInput)
+        batchLayout.addRow(recursiveLabel, self.recursiveInput)
+        batchLayout.addRow(batchWorkersLabel, self.batchWorkersInput)
+        batchLayout.addRow(isolateImagesLabel, self.isolateImagesInput)
+        batchLayout.addRow(imageTimeoutLabel, self.imageTimeoutInput)
+        batchLayout.addRow(imageMemoryLimitLabel, self.imageMemoryLimitInput)
+        batchLayout.addRow(measureWorkersLabel, self.measureWorkersInput)
+        batchLayout.addRow(measurePoolLabel, self.measurePoolCombo)
+        batchGroupBox = QGroupBox("Batch")
+        batchGroupBox.setLayout(batchLayout)
 
         self.mainLayout.addLayout(methodLayout)
         self.mainLayout.addLayout(self.formLayout)
+        self.mainLayout.addWidget(batchGroupBox)
         self.mainLayout.addLayout(buttonsLayout)
         self.setLayout(self.mainLayout)
 
@@ -533,6 +794,60 @@ class SegmentRingsOptionsWidget(QWidget):
         pass
 
 
+    def measureWorkersChanged(self):
+        pass
+
+
+    def roiMarginChanged(self):
+        pass
+
+
+    def inbdThreadsChanged(self):
+        pass
+
+
+    def modelTimeToLiveChanged(self):
+        pass
+
+
+    def imageLimitsChanged(self):
+        pass
+
+
+    def filePatternsChanged(self):
+        pass
+
+
+    def releaseModelsButtonPressed(self):
+        from napari_tree_rings.image.models import ModelRegistry
+        footprint = ModelRegistry.getInstance().getTotalFootprint()
+        released = self.segmentRings.release()
+        notifications.show_info("Released {} models, {:.1f} MB of weights".format(len(released),
+                                                                                  footprint / 1024 ** 2))
+
+
+    def calibrateButtonPressed(self):
+        from napari_tree_rings.image.calibration import InferenceCalibration
+        self.setOptionsFromDialog()
+        self.segmentRings.saveOptions()
+        image = None
+        layer = self.viewer.layers.selection.active
+        if isinstance(layer, Image):
+            image = layer.data
+        calibration = InferenceCalibration(self.segmentRings, image)
+        worker = create_worker(calibration.run, _progress={'total': len(calibration.getCandidates()),
+                                                           'desc': 'Calibrate inference'})
+        worker.returned.connect(self.onCalibrationFinished)
+        worker.finished.connect(lambda: self.calibrateButton.setEnabled(True))
+        self.calibrateButton.setEnabled(False)
+        worker.start()
+
+
+    def onCalibrationFinished(self, best):
+        notifications.show_info("Calibrated inference settings: {}".format(best))
+        self.inferenceSettingsCombo.setCurrentText('auto')
+
+
     def saveOptionsButtonPressed(self):
         print("Saving options...")
         self.setOptionsFromDialog()
@@ -561,5 +876,24 @@ class SegmentRingsOptionsWidget(QWidget):
         self.segmentRings.options["patchSize"] = int(self.patchSizeInput.text().strip())
         self.segmentRings.options["overlap"] = int(self.overlapInput.text().strip())
         self.segmentRings.options["batchSize"] = int(self.batchSizeInput.text().strip())
+        self.segmentRings.options["imagesPerBatch"] = int(self.imagesPerBatchInput.text().strip())
+        self.segmentRings.options["inferenceSettings"] = self.inferenceSettingsCombo.currentText().strip()
         self.segmentRings.options["resize"] = int(self.resizeInput.text().strip())
-        self.segmentRings.options["lossType"] = self.lossTypeCombo.currentText().strip()
\ No newline at end of file
+        self.segmentRings.options["lossType"] = self.lossTypeCombo.currentText().strip()
+        self.segmentRings.options["cachePredictions"] = self.cachePredictionsInput.isChecked()
+        self.segmentRings.options["trunkROI"] = self.trunkROIInput.isChecked()
+        self.segmentRings.options["roiMargin"] = int(self.roiMarginInput.text().strip())
+        self.segmentRings.options["inbdBatchSize"] = int(self.inbdBatchSizeInput.text().strip())
+        self.segmentRings.options["inbdThreads"] = int(self.inbdThreadsInput.text().strip())
+        self.segmentRings.options["inbdOptimize"] = self.inbdOptimizeInput.isChecked()
+        self.segmentRings.options["inbdCompile"] = self.inbdCompileInput.isChecked()
+        self.segmentRings.options["inferenceServer"] = self.inferenceServerInput.isChecked()
+        self.segmentRings.options["modelTimeToLive"] = int(self.modelTimeToLiveInput.text().strip())
+        self.segmentRings.options["isolateImages"] = self.isolateImagesInput.isChecked()
+        self.segmentRings.options["imageTimeout"] = float(self.imageTimeoutInput.text().strip())
+        self.segmentRings.options["imageMemoryLimit"] = int(self.imageMemoryLimitInput.text().strip())
+        self.segmentRings.options["batchWorkers"] = int(self.batchWorkersInput.text().strip())
+        self.segmentRings.options["filePatterns"] = self.filePatternsInput.text().strip()
+        self.segmentRings.options["recursive"] = self.recursiveInput.isChecked()
+        self.segmentRings.options["measureWorkers"] = int(self.measureWorkersInput.text().strip())
+        self.segmentRings.options["measurePool"] = self.measurePoolCombo.currentText().strip()
\ No newline at end of file
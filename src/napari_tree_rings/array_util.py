@@ -35,4 +35,52 @@ class ArrayUtil:
         columnIndices = np.where(~np.all(stripped == zero, axis=1))[0]
         stripped = stripped[~np.all(stripped == zero, axis=1)]
         stripped = np.array(list(zip(*stripped)))
-        return stripped, columnIndices, rowIndices
\ No newline at end of file
+        return stripped, columnIndices, rowIndices
+
+    @staticmethod
+    def blockMean(data, factor, chunkRows=4096):
+        """Return the array scaled down by an integer factor, each element of
+        the result being the mean of a block of factor x factor elements.
+
+        The first two axes are scaled down, further axes, like the channels
+        of an RGB image, are kept. As with skimage's rescale, the length of
+        an axis becomes round(length / factor): blocks at the lower and right
+        border, that are smaller than factor x factor, are averaged over the
+        existing elements if they are at least half a block long and dropped
+        otherwise. The input is read in chunks of rows and the means are
+        computed in float32, so that memory-mapped images can be scaled down
+        without loading them completely.
+
+        :param data: The array to be scaled down
+        :type data: numpy.ndarray
+        :param factor: The integer factor by which the array is scaled down
+        :param chunkRows: The approximate number of rows read at a time
+        :return: The scaled down array of type float32
+        :rtype: numpy.ndarray
+        """
+        height, width = data.shape[0], data.shape[1]
+        rest = tuple(data.shape[2:])
+        outHeight = max(1, int(round(height / factor)))
+        outWidth = max(1, int(round(width / factor)))
+        fullColumns = min(width // factor, outWidth)
+        result = np.empty((outHeight, outWidth) + rest, dtype=np.float32)
+        step = max(1, chunkRows // factor) * factor
+        for start in range(0, min(height, outHeight * factor), step):
+            chunk = np.asarray(data[start:min(start + step, outHeight * factor)], dtype=np.float32)
+            outStart = start // factor
+            fullRows = min(chunk.shape[0] // factor, outHeight - outStart)
+            if fullRows > 0:
+                blocks = chunk[:fullRows * factor, :fullColumns * factor]
+                blocks = blocks.reshape((fullRows, factor, fullColumns * factor) + rest).sum(axis=1)
+                blocks = blocks.reshape((fullRows, fullColumns, factor) + rest).sum(axis=2)
+                result[outStart:outStart + fullRows, :fullColumns] = blocks / (factor * factor)
+                if fullColumns < outWidth:
+                    border = chunk[:fullRows * factor, fullColumns * factor:]
+                    border = border.reshape((fullRows, factor, border.shape[1]) + rest)
+                    result[outStart:outStart + fullRows, fullColumns] = border.mean(axis=(1, 2))
+            if outStart + fullRows < outHeight and fullRows * factor < chunk.shape[0]:
+                border = chunk[fullRows * factor:]
+                for column in range(outWidth):
+                    block = border[:, column * factor:(column + 1) * factor]
+                    result[outStart + fullRows, column] = block.mean(axis=(0, 1))
+        return result
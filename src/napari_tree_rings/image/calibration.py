@@ -0,0 +1,194 @@
+import time
+import argparse
+import threading
+import tracemalloc
+import psutil
+import numpy as np
+from napari_tree_rings.image.instrumentation import Instrumentation
+
+
+
+class MemoryMonitor(object):
+    """Measure the peak of the memory used while the with-block is executed. The resident set size of the process
+    is sampled by a thread, so that the memory allocated by the native code of the models is counted. If the
+    resident set size can not be measured, the peak of the memory traced by tracemalloc is used instead."""
+
+
+    interval = 0.005
+
+
+    def __init__(self):
+        super().__init__()
+        self.peak = 0
+        self.start = None
+        self.running = False
+        self.thread = None
+        self.tracing = False
+
+
+    def __enter__(self):
+        self.start, _ = Instrumentation.getMemory()
+        if self.start is None:
+            self.tracing = not tracemalloc.is_tracing()
+            if self.tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            return self
+        self.peak = self.start
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *args):
+        if self.start is None:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak = peak
+            if self.tracing:
+                tracemalloc.stop()
+            return False
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, Instrumentation.getMemory()[0]) - self.start
+        return False
+
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, Instrumentation.getMemory()[0])
+            time.sleep(self.interval)
+
+
+
+class InferenceCalibration(object):
+    """Find the batch size with which the rings model predicts an image the fastest on this machine. Each candidate
+    batch size is run once to warm up the model and then timed on a synthetic tree disc or on a given image, while
+    the peak of the memory is measured. The fastest batch size whose peak memory stays below the memory budget is
+    stored for the model in the options of the rings segmenter and used when its option inferenceSettings is 'auto'.
+    The patch size and the overlap of the options are kept, since they change the predictions of the rings model
+    and the input of the pith model, while the batch size only changes the speed and the memory."""
+
+
+    batchSizes = (1, 2, 4, 8, 16)
+    imageSize = 2048
+    repeats = 2
+    memoryFraction = 0.5
+
+
+    def __init__(self, segmenter, image=None):
+        """Create a calibration of the rings model of the options of the segmenter on the image, or on a synthetic
+        tree disc if image is None."""
+
+        super().__init__()
+        self.segmenter = segmenter
+        self.image = image
+        self.results = []
+        self.best = None
+
+
+    @classmethod
+    def createSyntheticImage(cls, size):
+        """Answer a grayscale uint8 image of a tree disc of the given size, with dark rings on a light wood,
+        surrounded by a light background."""
+
+        yy, xx = np.mgrid[0:size, 0:size]
+        radius = np.hypot(yy - size / 2, xx - size / 2)
+        rings = 150 + 60 * np.cos(2 * np.pi * np.sqrt(radius) / 3)
+        image = np.where(radius < 0.4 * size, rings, 230)
+        return image.astype(np.uint8)
+
+
+    def getCandidates(self):
+        """Answer the candidate settings as dictionaries of patchSize, batchSize and overlap, with the patch size
+        and the overlap of the options."""
+
+        options = self.segmenter.options
+        return [{'patchSize': options['patchSize'], 'batchSize': batchSize, 'overlap': options['overlap']}
+                for batchSize in self.batchSizes]
+
+
+    @classmethod
+    def getMemoryBudget(cls):
+        """Answer the number of bytes the prediction may use, the memoryFraction of the available memory, or
+        None if the available memory can not be measured."""
+
+        try:
+            return int(psutil.virtual_memory().available * cls.memoryFraction)
+        except psutil.Error:
+            return None
+
+
+    def run(self):
+        """Time the candidate settings, store the best one for the rings model in the options of the segmenter and
+        answer it. Yield after each candidate, so that the calibration can be run as a worker."""
+
+        from tree_ring_analyzer.segmentation import TreeRingSegmentation
+        self.segmenter.loadOptions()
+        self.segmenter.loadKerasModels()
+        image = self.image
+        if image is None:
+            image = self.createSyntheticImage(self.imageSize)
+        if image.ndim == 2:
+            image = image[:, :, None]
+        if self.segmenter.channel == 1 and image.shape[-1] == 3:
+            image = (0.299 * image[:, :, 0] + 0.587 * image[:, :, 1] + 0.114 * image[:, :, 2])[:, :, None]
+        elif self.segmenter.channel == 3 and image.shape[-1] == 1:
+            image = np.repeat(image, 3, axis=-1)
+        pixels = image.shape[0] * image.shape[1]
+        self.results = []
+        for candidate in self.getCandidates():
+            segmentation = TreeRingSegmentation()
+            segmentation.patchSize = candidate['patchSize']
+            segmentation.overlap = candidate['overlap']
+            segmentation.batchSize = candidate['batchSize']
+            segmentation.predictRing(self.segmenter.ringsModel, image)
+            with MemoryMonitor() as monitor:
+                start = time.perf_counter()
+                for _ in range(self.repeats):
+                    segmentation.predictRing(self.segmenter.ringsModel, image)
+                seconds = (time.perf_counter() - start) / self.repeats
+            self.results.append(dict(candidate, pixelsPerSecond=pixels / max(seconds, 1e-9),
+                                     peakMemory=int(monitor.peak)))
+            yield candidate
+        self.best = self.getBest(self.results, self.getMemoryBudget())
+        self.segmenter.options['autoSettings'][self.segmenter.options['ringsModel']] = self.best
+        self.segmenter.saveOptions()
+        return self.best
+
+
+    @classmethod
+    def getBest(cls, results, budget=None):
+        """Answer the result with the highest throughput among those whose peak memory is within the budget. If
+        none is, the result using the least memory is answered."""
+
+        fitting = [result for result in results if budget is None or result['peakMemory'] <= budget]
+        if not fitting:
+            return min(results, key=lambda result: result['peakMemory'])
+        return max(fitting, key=lambda result: result['pixelsPerSecond'])
+
+
+
+def main(arguments=None):
+    """Calibrate the inference settings of the selected rings model from the command line."""
+
+    from napari_tree_rings.image.process import RingsSegmenter
+    parser = argparse.ArgumentParser(description="Find the fastest batch size of the rings model on this machine and "
+                                                 "store it in the options.")
+    parser.add_argument('image', nargs='?', default=None, help="image to calibrate on, a synthetic disc if omitted")
+    parsed = parser.parse_args(arguments)
+    image = None
+    if parsed.image:
+        import tifffile
+        image = tifffile.imread(parsed.image)
+    calibration = InferenceCalibration(RingsSegmenter(None), image)
+    for candidate in calibration.run():
+        result = calibration.results[-1]
+        print("patch size {patchSize}, batch size {batchSize}, overlap {overlap}: "
+              "{pixelsPerSecond:.0f} pixels/s, peak memory {peakMemory} bytes".format(**result))
+    print("best:", calibration.best)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import threading
+import appdirs
+import numpy as np
+
+
+
+class OperationCancelled(Exception):
+    """Raised by an operation that has been cancelled via its cancel token."""
+
+
+
+class CancelToken(object):
+    """A token used to ask a running operation to stop. The operation checks the token between its stages and
+    stops cooperatively by raising an OperationCancelled exception."""
+
+
+    def __init__(self):
+        """Create a token that has not been cancelled."""
+
+        super().__init__()
+        self.event = threading.Event()
+
+
+    def cancel(self):
+        """Ask the operations using the token to stop."""
+
+        self.event.set()
+
+
+    def isCancelled(self):
+        """Answer whether the token has been cancelled."""
+
+        return self.event.is_set()
+
+
+    def check(self):
+        """Raise an OperationCancelled exception if the token has been cancelled."""
+
+        if self.event.is_set():
+            raise OperationCancelled()
+
+
+    def reset(self):
+        """Make the token usable for a new run."""
+
+        self.event.clear()
+
+
+
+class CheckpointStore(object):
+    """Persist intermediate results of the segmentations, so that a rerun with changed post-processing options
+    can resume from them. The results are stored as numpy-files, named by a hash of the image and of the options
+    they depend on. When the files in the store exceed maxBytes, the least recently used ones are deleted."""
+
+
+    defaultMaxBytes = 2 * 1024 ** 3
+
+
+    def __init__(self, folder=None, maxBytes=None):
+        """Create a store in the given folder. By default the checkpoints are stored in the user data folder of
+        the plugin."""
+
+        super().__init__()
+        if folder is None:
+            folder = os.path.join(appdirs.user_data_dir("napari-tree-rings"), "checkpoints")
+        if maxBytes is None:
+            maxBytes = CheckpointStore.defaultMaxBytes
+        self.folder = folder
+        self.maxBytes = maxBytes
+        os.makedirs(self.folder, exist_ok=True)
+
+
+    @classmethod
+    def getKey(cls, *parts):
+        """Answer the key of a result that depends on the given parts, for example the hash of the image, the
+        name of the stage and the options used to compute it."""
+
+        text = json.dumps([str(part) for part in parts])
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=20).hexdigest()
+
+
+    @classmethod
+    def getArrayHash(cls, data):
+        """Answer a hash of the content, the shape and the type of the array."""
+
+        data = np.ascontiguousarray(data)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str((data.shape, data.dtype.str)).encode('utf-8'))
+        digest.update(memoryview(data).cast('B'))
+        return digest.hexdigest()
+
+
+    def getPath(self, key):
+        """Answer the path of the file in which the result with the given key is stored."""
+
+        return os.path.join(self.folder, key + ".npz")
+
+
+    def contains(self, key):
+        """Answer whether a result is stored under the key."""
+
+        return os.path.exists(self.getPath(key))
+
+
+    def load(self, key):
+        """Answer the arrays stored under the key as a dictionary or None if there is no readable result. Loading
+        a result marks it as recently used."""
+
+        path = self.getPath(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                result = {name: data[name] for name in data.files}
+            os.utime(path)
+            return result
+        except (OSError, ValueError, EOFError):
+            return None
+
+
+    def save(self, key, compress=True, **arrays):
+        """Store the arrays under the key. Large images that compress badly, like grayscale images, should be
+        stored with compress=False. The file is written under a temporary name first, so that a reader never sees
+        a partially written result."""
+
+        path = self.getPath(key)
+        tmpPath = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmpPath, 'wb') as aFile:
+            if compress:
+                np.savez_compressed(aFile, **arrays)
+            else:
+                np.savez(aFile, **arrays)
+        os.replace(tmpPath, path)
+        self.evict()
+
+
+    def evict(self):
+        """Delete the least recently used results until the store fits into maxBytes."""
+
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        totalSize = sum(entry[1] for entry in entries)
+        for _, size, name in sorted(entries):
+            if totalSize <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            totalSize = totalSize - size
+
+
+    def getSize(self):
+        """Answer the number of bytes used by the results in the store."""
+
+        return sum(os.path.getsize(os.path.join(self.folder, name))
+                   for name in os.listdir(self.folder) if name.endswith(".npz"))
@@ -0,0 +1,136 @@
+import os
+import heapq
+import fnmatch
+import tifffile
+import numpy as np
+
+
+
+class BatchDiscovery(object):
+    """Find the images of a batch in a source folder and order them for the workers. The files whose names match
+    one of the patterns, for example "*.tif;*.tiff", are taken from the folder and, if recursive is True, from its
+    sub-folders. The dimensions of each image are read from the header of its tiff file, without decoding the
+    image. The time needed for an image is estimated from its number of pixels and the images are answered largest
+    first, so that workers taking the next image when they are free do not end the batch with a large image
+    (longest processing time first scheduling)."""
+
+
+    tiffSignatures = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+    secondsPerImage = 1.0
+    secondsPerMegapixel = 2.0
+
+
+    def __init__(self, folder, patterns="*.tif;*.tiff", recursive=False):
+        """Create the discovery of the files of the folder matching the patterns, separated by semicolons."""
+
+        super().__init__()
+        self.folder = folder
+        self.patterns = [pattern.strip().lower() for pattern in patterns.split(';') if pattern.strip()]
+        self.recursive = recursive
+        self.images = []
+        self.rejected = []
+
+
+    def findFiles(self):
+        """Answer the paths, relative to the folder, of the files matching the patterns, sorted."""
+
+        paths = []
+        for folder, subfolders, filenames in os.walk(self.folder):
+            if not self.recursive:
+                subfolders.clear()
+            subfolders[:] = sorted(name for name in subfolders if not name.startswith('.'))
+            for filename in filenames:
+                if any(fnmatch.fnmatch(filename.lower(), pattern) for pattern in self.patterns):
+                    paths.append(os.path.relpath(os.path.join(folder, filename), self.folder))
+        return sorted(paths)
+
+
+    def run(self):
+        """Find the images and read their shapes. The images are stored in images, as dictionaries of path,
+        shape, pixels and seconds, largest first. The files that are not tiff images or whose header can not be
+        read are stored in rejected, as dictionaries of path, status, skipped or failed, and error."""
+
+        self.images = []
+        self.rejected = []
+        for path in self.findFiles():
+            fullPath = os.path.join(self.folder, path)
+            if not self.isImageFile(fullPath):
+                self.rejected.append({'path': path, 'status': 'skipped', 'error': 'not a tiff image'})
+                continue
+            try:
+                shape = self.getShape(fullPath)
+            except Exception as error:
+                self.rejected.append({'path': path, 'status': 'failed',
+                                      'error': "{}: {}".format(type(error).__name__, error)})
+                continue
+            pixels = self.getPixels(shape)
+            self.images.append({'path': path, 'shape': shape, 'pixels': pixels,
+                                'seconds': self.estimateSeconds(pixels)})
+        self.images.sort(key=lambda image: -image['pixels'])
+        return self.images
+
+
+    @classmethod
+    def isImageFile(cls, path):
+        """Answer whether the file under path starts with the signature of a tiff or a BigTIFF file."""
+
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as aFile:
+            return aFile.read(4) in cls.tiffSignatures
+
+
+    @classmethod
+    def getShape(cls, path):
+        """Answer the shape of the image in the tiff file under path, as read from its header."""
+
+        with tifffile.TiffFile(path) as tif:
+            return tuple(tif.series[0].shape)
+
+
+    @classmethod
+    def getPixels(cls, shape):
+        """Answer the number of pixels of a plane of an image of the given shape. A last axis of up to four
+        elements is taken as the channels."""
+
+        if len(shape) > 2 and shape[-1] <= 4:
+            shape = shape[:-1]
+        return int(np.prod(shape[-2:]))
+
+
+    def estimateSeconds(self, pixels):
+        """Answer the estimated time in seconds needed to process an image with the given number of pixels."""
+
+        return self.secondsPerImage + self.secondsPerMegapixel * pixels / 1e6
+
+
+    def fitCostModel(self, manifestPath):
+        """Fit the time per image and the time per megapixel to the images of the manifest under path, written by
+        an earlier batch. The default cost model is kept if the manifest does not exist or does not contain
+        images of at least two sizes."""
+
+        if not os.path.exists(manifestPath):
+            return
+        import pandas as pd
+        manifest = pd.read_csv(manifestPath)
+        if not {'shape', 'seconds'} <= set(manifest.columns):
+            return
+        megapixels = np.array([self.getPixels(tuple(int(length) for length in str(shape).split('x'))) / 1e6
+                               for shape in manifest['shape']])
+        if len(np.unique(megapixels)) < 2:
+            return
+        slope, intercept = np.polyfit(megapixels, manifest['seconds'].to_numpy(dtype=float), 1)
+        self.secondsPerMegapixel = max(float(slope), 0.0)
+        self.secondsPerImage = max(float(intercept), 0.0)
+        for image in self.images:
+            image['seconds'] = self.estimateSeconds(image['pixels'])
+
+
+    def estimateMakespan(self, workers=1):
+        """Answer the estimated time in seconds until the last image is processed, when each of the workers takes
+        the next image as soon as it is free."""
+
+        loads = [0.0] * max(1, workers)
+        for image in self.images:
+            heapq.heappush(loads, heapq.heappop(loads) + image['seconds'])
+        return max(loads)
@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+from skimage import draw
+
+
+
+class Geometry(object):
+    """Conversions between the contours of OpenCV and the polygons of napari. OpenCV answers a contour as an array
+    of shape (N, 1, 2) of (x, y) integer coordinates, napari expects a polygon as an array of shape (N, 2) of
+    (row, column) coordinates."""
+
+
+    maskTile = 4
+
+
+    @classmethod
+    def contourToPolygon(cls, contour):
+        """Answer the contour as an (N, 2) float array of (row, column) vertices. The contour can be an OpenCV
+        contour or an (N, 2) array of (x, y) vertices."""
+
+        return np.asarray(contour).reshape(-1, 2)[:, ::-1].astype(np.float64)
+
+
+    @classmethod
+    def contoursToPolygons(cls, contours):
+        """Answer the contours as a list of (N, 2) float arrays of (row, column) vertices."""
+
+        return [cls.contourToPolygon(contour) for contour in contours]
+
+
+    @classmethod
+    def findOuterContours(cls, mask, offset=(0, 0)):
+        """Answer the outer contours of the non-zero pixels of the mask as OpenCV contours. The offset (row, column)
+        is added to the coordinates, for example to map the contours of a crop back to the full image."""
+
+        contours, hierarchy = cv2.findContours(np.asarray(mask, dtype=np.uint8), cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE, offset=(int(offset[1]), int(offset[0])))
+        return contours
+
+
+    @classmethod
+    def resamplePolygon(cls, polygon, spacing):
+        """Answer the closed polygon resampled with vertices at equal distances of about spacing along its
+        perimeter. The polygon keeps at least 8 vertices."""
+
+        closed = np.concatenate([polygon, polygon[:1]])
+        lengths = np.hypot(*np.diff(closed, axis=0).T)
+        positions = np.concatenate([[0], np.cumsum(lengths)])
+        perimeter = positions[-1]
+        numberOfVertices = max(8, int(round(perimeter / spacing)))
+        samples = np.linspace(0, perimeter, numberOfVertices, endpoint=False)
+        columns = [np.interp(samples, positions, closed[:, axis]) for axis in range(closed.shape[1])]
+        return np.stack(columns, axis=1)
+
+
+
+    @classmethod
+    def polygonToMask(cls, polygon, shape, origin=(0, 0)):
+        """Answer a mask of the given shape in which the pixels of the polygon of (row, column) vertices are True.
+        The mask covers the pixels from the given origin (row, column) on, so that the mask of a polygon can be
+        created in its bounding box. The result is the one of skimage.draw.polygon2mask, used by the napari
+        shapes, for the polygon moved by the origin. The polygon is filled by OpenCV, that can differ from skimage
+        by a pixel along the edges, and the tiles of maskTile x maskTile pixels along the edges are rasterised
+        again with skimage.draw.polygon, whose time grows with the number of pixels times the number of
+        vertices."""
+
+        polygon = np.asarray(polygon, dtype=np.float64) - np.asarray(origin, dtype=np.float64)
+        mask = np.zeros(shape[0:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [np.round(polygon[:, ::-1] * 256).astype(np.int32)], 1, shift=8)
+        mask = mask.astype(bool)
+        tile = cls.maskTile
+        edges = np.zeros((-(-shape[0] // tile), -(-shape[1] // tile)), dtype=np.uint8)
+        cv2.polylines(edges, [np.round(polygon[:, ::-1] * 256 / tile).astype(np.int32)], True, 1, thickness=3,
+                      shift=8)
+        for row, column in np.argwhere(edges) * tile:
+            part = mask[row:row + tile, column:column + tile]
+            part[:] = False
+            part[draw.polygon(polygon[:, 0] - row, polygon[:, 1] - column, part.shape)] = True
+        return mask
+
+
+
+class Polygons(object):
+    """A lightweight container of polygons with the scale, the units, the metadata and the name of a shapes layer,
+    that can be measured without creating a napari layer. The polygons are (N, 2) arrays of (row, column)
+    vertices in pixel coordinates."""
+
+
+    ndim = 2
+
+
+    def __init__(self, data, scale=(1, 1), units=('pixel', 'pixel'), metadata=None, name=None):
+        """Create a container with the given polygons."""
+
+        super().__init__()
+        self.data = [np.asarray(polygon, dtype=np.float64) for polygon in data]
+        self.scale = tuple(scale)
+        self.units = tuple(units)
+        self.metadata = {} if metadata is None else dict(metadata)
+        self.name = name
+
+
+    @classmethod
+    def fromLayer(cls, layer):
+        """Answer a container with the polygons, the scale, the units, the metadata and the name of the shapes
+        layer."""
+
+        return cls(layer.data, scale=layer.scale, units=layer.units, metadata=layer.metadata, name=layer.name)
+
+
+    def getAreas(self):
+        """Answer the areas of the polygons in pixels, computed with the shoelace formula."""
+
+        areas = []
+        for polygon in self.data:
+            rows, columns = polygon[:, 0], polygon[:, 1]
+            areas.append(0.5 * abs(np.dot(rows, np.roll(columns, 1)) - np.dot(columns, np.roll(rows, 1))))
+        return np.array(areas)
+
+
+    def getBoundingBox(self, index, shape=None):
+        """Answer the slices of the rows and the columns of the pixels, whose centres can lie inside the polygon
+        with the given index, clipped to the given shape."""
+
+        polygon = self.data[index]
+        start = np.maximum(np.floor(polygon.min(axis=0)).astype(int), 0)
+        stop = np.ceil(polygon.max(axis=0)).astype(int) + 1
+        if shape is not None:
+            stop = np.minimum(stop, shape[0:2])
+        stop = np.maximum(stop, start)
+        return slice(start[0], stop[0]), slice(start[1], stop[1])
+
+
+    def toMask(self, index, shape=None):
+        """Answer the mask of the polygon with the given index in its bounding box and the bounding box. A pixel
+        is inside if its centre is inside, as for the masks of napari shapes."""
+
+        rows, columns = self.getBoundingBox(index, shape)
+        mask = Geometry.polygonToMask(self.data[index], (rows.stop - rows.start, columns.stop - columns.start),
+                                      origin=(rows.start, columns.start))
+        return mask, (rows, columns)
+
+
+    def to_labels(self, labels_shape=None):
+        """Answer a labels image in which the pixels of the polygon with index i have the value i + 1. Later
+        polygons are drawn over earlier ones."""
+
+        if labels_shape is None:
+            labels_shape = np.round(np.max([polygon.max(axis=0) for polygon in self.data], axis=0)) + 1
+        labels_shape = tuple(np.ceil(labels_shape).astype(int))
+        labels = np.zeros(labels_shape, dtype=np.int32)
+        for index in range(len(self.data)):
+            mask, box = self.toMask(index, labels_shape)
+            labels[box][mask] = index + 1
+        return labels
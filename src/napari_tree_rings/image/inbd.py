@@ -0,0 +1,209 @@
+import os
+import contextlib
+import numpy as np
+
+
+
+class INBDBackend(object):
+    """Run an INBD model on images that are already in memory. The INBD model reads the image itself if it is
+    given a path. Given an array, it expects an rgb image of floats between 0 and 1, scaled down by the scale of the
+    model, as answered by the image loader of INBD. The backend converts the image of a layer, or a view on it, for
+    example on shared memory, into this form, so that images that have been decoded by napari or by the batch are not
+    read again from the disk.
+
+    The model can be optimized for the cpu when it is loaded: the convolutional networks it contains are traced,
+    frozen and optimized for inference with TorchScript. The traced networks are saved next to the model file,
+    under a name containing the version of torch, and are loaded from there by the next sessions. A traced network
+    only replaces the original one if it gives the same results on test inputs of several shapes, so that a branch
+    or a padding depending on the shape of the input, that tracing freezes, is detected."""
+
+
+    tracedModules = ('segmentationmodel',)
+    exampleShapes = ((256, 256), (203, 317))
+    tolerance = 1e-4
+
+
+    def __init__(self, model):
+        """Create a backend running the given INBD model."""
+
+        super().__init__()
+        self.model = model
+
+
+    @classmethod
+    def load(cls, path, threads=0, optimize=False, compile=False):
+        """Load the INBD model from the torch package under path. If threads is larger than zero, torch uses that
+        number of threads. If optimize is True, the networks named in tracedModules are replaced by their traced
+        versions, if compile is True they are compiled with torch.compile."""
+
+        import torch
+        if threads > 0:
+            torch.set_num_threads(threads)
+        importer = torch.package.PackageImporter(path)
+        model = importer.load_pickle('model', 'model.pkl').eval().requires_grad_(False)
+        if torch.cuda.is_available():
+            return model.cuda()
+        for name in cls.tracedModules:
+            module = getattr(model, name, None)
+            if not isinstance(module, torch.nn.Module):
+                continue
+            if optimize:
+                module = cls.getTracedModule(module, path, name)
+            if compile and hasattr(torch, 'compile'):
+                module = torch.compile(module)
+            setattr(model, name, module)
+        return model
+
+
+    @classmethod
+    def getArtifactPath(cls, path, name):
+        """Answer the path of the traced network with the given name of the model under path, for the installed
+        version of torch."""
+
+        import torch
+        version = torch.__version__.replace('+', '-')
+        return os.path.join(os.path.dirname(path),
+                            "{}.{}.torch-{}.pt".format(os.path.basename(path), name, version))
+
+
+    @classmethod
+    def getTracedModule(cls, module, path, name):
+        """Answer the traced, frozen and optimized version of the network with the given name of the model under
+        path. It is read from the artifact path if it has been saved there after the model file was last modified,
+        otherwise it is traced and saved. If tracing fails or the traced network does not give the results of the
+        network on the example inputs of all exampleShapes, the network is answered in the channels last memory
+        format. The network is traced on the first example shape."""
+
+        import torch
+        examples = [torch.rand(1, 3, height, width).contiguous(memory_format=torch.channels_last)
+                    for height, width in cls.exampleShapes]
+        module = module.to(memory_format=torch.channels_last)
+        artifactPath = cls.getArtifactPath(path, name)
+        traced = None
+        if os.path.exists(artifactPath) and os.path.getmtime(artifactPath) >= os.path.getmtime(path):
+            try:
+                traced = torch.jit.load(artifactPath)
+            except (RuntimeError, OSError):
+                traced = None
+        if traced is None:
+            try:
+                with torch.inference_mode():
+                    traced = torch.jit.trace(module, examples[0], strict=False)
+                traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+                torch.jit.save(traced, artifactPath)
+            except Exception:
+                return module
+        if not all(cls.isSame(module, traced, example) for example in examples):
+            os.remove(artifactPath)
+            return module
+        return traced
+
+
+    @classmethod
+    def isSame(cls, module, traced, example):
+        """Answer whether the traced network gives the results of the network for the example input. A traced
+        network failing on the input does not."""
+
+        import torch
+        with torch.inference_mode():
+            expected = cls.getTensors(module(example))
+            try:
+                result = cls.getTensors(traced(example))
+            except Exception:
+                return False
+        return (len(expected) == len(result)
+                and all(a.shape == b.shape and torch.allclose(a, b, rtol=cls.tolerance, atol=cls.tolerance)
+                        for a, b in zip(expected, result)))
+
+
+    @classmethod
+    def getTensors(cls, output):
+        """Answer the tensors in the output of a network, which can be a tensor, a sequence or a dictionary."""
+
+        if isinstance(output, dict):
+            output = [output[key] for key in sorted(output.keys())]
+        if isinstance(output, (list, tuple)):
+            return [tensor for item in output for tensor in cls.getTensors(item)]
+        return [output]
+
+
+    @classmethod
+    def getInferenceContext(cls):
+        """Answer the context in which the model is run, the inference mode of torch if torch is available."""
+
+        try:
+            import torch
+        except ImportError:
+            return contextlib.nullcontext()
+        return torch.inference_mode()
+
+
+    @property
+    def scale(self):
+        """The factor by which the coordinates of the boundaries found by the model have to be multiplied to be in
+        the coordinates of the image."""
+
+        return self.model.scale
+
+
+    @classmethod
+    def toInput(cls, image, scale=1):
+        """Answer the image as an rgb image of float32 between 0 and 1, scaled down by the scale of the model, as
+        the image loader of INBD does. Grayscale images are repeated on the three channels and an alpha channel is
+        dropped. Integer images are divided by the maximum of their type. The image is resized with downscale."""
+
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[:, :, None]
+        if image.shape[-1] == 1:
+            image = np.repeat(image, 3, axis=-1)
+        image = image[:, :, 0:3]
+        maximum = np.iinfo(image.dtype).max if np.issubdtype(image.dtype, np.integer) else 1
+        if scale != 1:
+            image = cls.downscale(image, scale)
+        image = image.astype(np.float32)
+        if maximum != 1:
+            image = image / np.float32(maximum)
+        return image
+
+
+    @classmethod
+    def downscale(cls, image, scale):
+        """Answer the rgb image resized to its size divided by the scale, rounded down, with the bilinear filter of
+        PIL, like the image loader of INBD. When scaling down, PIL widens the filter by the scale, so that the result
+        is antialiased. 8 bit images are resized as rgb images, as by INBD, other images channel by channel as
+        float32 images."""
+
+        from PIL import Image as PILImage
+        size = int(image.shape[1] // scale), int(image.shape[0] // scale)
+        if image.dtype == np.uint8:
+            return np.asarray(PILImage.fromarray(np.ascontiguousarray(image)).resize(size, PILImage.BILINEAR))
+        channels = [PILImage.fromarray(np.ascontiguousarray(image[:, :, channel], dtype=np.float32))
+                    for channel in range(3)]
+        return np.stack([np.asarray(channel.resize(size, PILImage.BILINEAR)) for channel in channels], axis=-1)
+
+
+    def process(self, image):
+        """Answer the output of the model for the image. The image can be an array or the path to an image file."""
+
+        if isinstance(image, str):
+            with self.getInferenceContext():
+                return self.model.process_image(image)
+        return self.processInput(self.toInput(image, self.scale))
+
+
+    def processInput(self, input):
+        """Answer the output of the model for an image that has already been converted by toInput."""
+
+        with self.getInferenceContext():
+            return self.model.process_image(input)
+
+
+    def processBatch(self, images):
+        """Answer the outputs of the model for the images, in the same order. If the model can process several
+        images in one pass, the images are given to it together, otherwise one after the other."""
+
+        if hasattr(self.model, 'process_images'):
+            with self.getInferenceContext():
+                return list(self.model.process_images([self.toInput(image, self.scale) for image in images]))
+        return [self.process(image) for image in images]
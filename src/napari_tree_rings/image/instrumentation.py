@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import psutil
+
+
+
+class Instrumentation(object):
+    """Measure the time and the memory used by the stages of an operation, like the trunk- or the rings-segmentation,
+    on one image. For each stage a record is emitted to the sinks, at the end of the operation a record summing up
+    the run. The records are dictionaries, that can be written as json. The memory is reported as the resident set
+    size of the process and, if tracemalloc is tracing, as the memory allocated during the stage. Both are process
+    wide and include the allocations of other threads."""
+
+
+    sinks = []
+    sinksLock = threading.Lock()
+
+
+    def __init__(self, operation, layer=None, options=None, sinks=None):
+        """Create the instrumentation of an operation with the given name on the image of the layer. The records
+        are emitted to the given sinks or, if no sinks are given, to the sinks registered with addSink."""
+
+        super().__init__()
+        self.operation = operation
+        self.image = None
+        self.shape = None
+        if layer is not None:
+            self.image = layer.name
+            self.shape = list(layer.data.shape)
+        self.options = options
+        self.customSinks = sinks
+        self.stageTimes = {}
+        self.startTime = time.perf_counter()
+
+
+    @classmethod
+    def addSink(cls, sink):
+        """Register a sink receiving the records of all operations."""
+
+        with cls.sinksLock:
+            cls.sinks = cls.sinks + [sink]
+
+
+    @classmethod
+    def removeSink(cls, sink):
+        """Unregister the sink."""
+
+        with cls.sinksLock:
+            cls.sinks = [aSink for aSink in cls.sinks if aSink is not sink]
+
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the code executed in the with-block as the stage with the given name. A stage that raises is
+        measured as well, its record has the flag failed set, and the exception is propagated."""
+
+        rss, _ = self.getMemory()
+        tracing = tracemalloc.is_tracing()
+        traced = 0
+        if tracing:
+            traced, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            seconds = time.perf_counter() - start
+            self.stageTimes[name] = self.stageTimes.get(name, 0) + seconds
+            record = self.getRecord('stage')
+            record['stage'] = name
+            record['seconds'] = seconds
+            record['failed'] = failed
+            rssAfter, peakRss = self.getMemory()
+            record['rss'] = rssAfter
+            record['rssDelta'] = None if rss is None or rssAfter is None else rssAfter - rss
+            record['peakRss'] = peakRss
+            record['tracedDelta'] = None
+            record['tracedPeak'] = None
+            if tracing and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                record['tracedDelta'] = current - traced
+                record['tracedPeak'] = peak - traced
+            self.emit(record)
+
+
+    def finish(self):
+        """Emit the record of the whole run, containing the total time, the time of each stage and the options."""
+
+        record = self.getRecord('run')
+        record['seconds'] = time.perf_counter() - self.startTime
+        record['stages'] = dict(self.stageTimes)
+        record['options'] = self.options
+        rss, peakRss = self.getMemory()
+        record['rss'] = rss
+        record['peakRss'] = peakRss
+        self.emit(record)
+        return record
+
+
+    def getStageTimes(self):
+        """Answer the times in seconds of the stages measured so far, by stage name."""
+
+        return dict(self.stageTimes)
+
+
+    def getRecord(self, event):
+        return {'event': event,
+                'operation': self.operation,
+                'image': self.image,
+                'shape': self.shape,
+                'time': time.time()}
+
+
+    def emit(self, record):
+        sinks = self.customSinks if self.customSinks is not None else Instrumentation.sinks
+        for sink in sinks:
+            sink.emit(record)
+
+
+    @classmethod
+    def getMemory(cls):
+        """Answer the current and the peak resident set size of the process in bytes. A value is None if it can
+        not be measured on the platform."""
+
+        rss = None
+        peakRss = None
+        try:
+            rss = psutil.Process().memory_info().rss
+        except psutil.Error:
+            pass
+        try:
+            import resource
+            peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if not sys.platform == 'darwin':
+                peakRss = peakRss * 1024
+        except ImportError:
+            pass
+        return rss, peakRss
+
+
+
+class LoggingSink(object):
+    """Write the records as messages to a logger."""
+
+
+    def __init__(self, logger=None, level=logging.INFO):
+        super().__init__()
+        if logger is None:
+            logger = logging.getLogger("napari_tree_rings")
+        self.logger = logger
+        self.level = level
+
+
+    def emit(self, record):
+        if record['event'] == 'stage':
+            self.logger.log(self.level, "%s %s: %s %s %.3f s, rss %s",
+                            record['operation'], record['image'], record['stage'],
+                            "failed after" if record.get('failed') else "", record['seconds'],
+                            self.formatBytes(record['rss']))
+        else:
+            self.logger.log(self.level, "%s %s: finished in %.3f s, peak rss %s",
+                            record['operation'], record['image'], record['seconds'],
+                            self.formatBytes(record['peakRss']))
+
+
+    @classmethod
+    def formatBytes(cls, value):
+        if value is None:
+            return "unknown"
+        return "{:.1f} MB".format(value / 1024 ** 2)
+
+
+
+class JSONLinesSink(object):
+    """Append the records as lines of json to a file."""
+
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            with open(self.path, 'a') as aFile:
+                aFile.write(line + "\n")
+
+
+
+class MemorySink(object):
+    """Keep the records in a list, for example to inspect them in the tests."""
+
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.lock = threading.Lock()
+
+
+    def emit(self, record):
+        with self.lock:
+            self.records.append(record)
+
+
+    def getRecords(self, event=None, operation=None):
+        """Answer the records, optionally only those of the given event and operation."""
+
+        with self.lock:
+            return [record for record in self.records
+                    if (event is None or record['event'] == event)
+                    and (operation is None or record['operation'] == operation)]
+
+
+    def clear(self):
+        with self.lock:
+            self.records = []
+
+
+
+Instrumentation.sinks = [LoggingSink()]
@@ -0,0 +1,216 @@
+import time
+import logging
+import multiprocessing
+import multiprocessing.connection
+import psutil
+
+
+
+def runWorker(connection, sourceFolder, outputFolder):
+    """Segment the images whose file names are received on the connection, until None is received. For each image
+    a dictionary with the status, done or failed, the seconds used, the error, the times of the stages and the row
+    of the manifest is sent back. The manifest itself is written by the supervisor."""
+
+    from napari_tree_rings.image.instrumentation import Instrumentation
+    from napari_tree_rings.image.process import BatchSegmentTrunk, RingsSegmenter, TrunkSegmenter
+    batch = BatchSegmentTrunk(sourceFolder, outputFolder)
+    batch.writeManifest = False
+    batch.ringSegmenter = RingsSegmenter(None)
+    batch.segmenter = TrunkSegmenter(None)
+    while True:
+        imageFilename = connection.recv()
+        if imageFilename is None:
+            return
+        instrumentation = Instrumentation('batch')
+        try:
+            with instrumentation.stage('read'):
+                imageLayer = batch.readImage(imageFilename)
+            instrumentation.image = imageFilename
+            instrumentation.shape = list(imageLayer.data.shape)
+            batch.processImage(imageLayer, instrumentation)
+            del imageLayer
+            row = batch.manifest.pop()
+            connection.send({'status': 'done', 'seconds': row['seconds'], 'error': '',
+                             'stageTimes': instrumentation.getStageTimes(), 'manifest': row})
+        except Exception as error:
+            batch.ringSegmenter.releaseImage()
+            batch.segmenter.releaseImage()
+            connection.send({'status': 'failed', 'seconds': time.perf_counter() - instrumentation.startTime,
+                             'error': "{}: {}".format(type(error).__name__, error),
+                             'stageTimes': instrumentation.getStageTimes(), 'manifest': None})
+
+
+
+class IsolatedWorker(object):
+    """A worker process of an isolated batch, together with the image it is processing."""
+
+
+    def __init__(self, context, target, arguments):
+        """Create a worker that runs the target with a connection followed by the arguments in a process of the
+        multiprocessing context. The process is started when the first image is given to it."""
+
+        super().__init__()
+        self.context = context
+        self.target = target
+        self.arguments = arguments
+        self.process = None
+        self.connection = None
+        self.image = None
+        self.startTime = None
+
+
+    def isBusy(self):
+        return self.image is not None
+
+
+    def send(self, imageFilename):
+        """Give the image to the worker, starting its process if needed."""
+
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.image = imageFilename
+        self.startTime = time.perf_counter()
+        self.connection.send(imageFilename)
+
+
+    def getResult(self, ready, timeout=0, memoryLimit=0):
+        """Answer the result of the image if the worker has sent it, if its connection is in ready, or a result
+        with the status failed, timeout or memory if the worker died, exceeds the time limit or the memory limit.
+        In the latter cases the process is stopped. Answer None if the image is still processed."""
+
+        seconds = time.perf_counter() - self.startTime
+        result = None
+        if self.connection in ready:
+            try:
+                result = self.connection.recv()
+            except (EOFError, OSError):
+                self.process.join(0.1)
+                result = self.getFailure('failed', seconds,
+                                         "the worker died with exit code {}".format(self.process.exitcode))
+        elif not self.process.is_alive():
+            result = self.getFailure('failed', seconds,
+                                     "the worker died with exit code {}".format(self.process.exitcode))
+        elif timeout and seconds > timeout:
+            result = self.getFailure('timeout', seconds, "no result after {} seconds".format(timeout))
+        elif memoryLimit:
+            memory = self.getMemory()
+            if memory is not None and memory > memoryLimit:
+                result = self.getFailure('memory', seconds, "the worker used {} bytes".format(memory))
+        if result is None:
+            return None
+        if result['status'] in ('timeout', 'memory') or not self.process.is_alive():
+            logging.getLogger("napari_tree_rings").warning("%s stopped: %s", self.image, result['error'])
+            self.stop(kill=True)
+        result['image'] = self.image
+        self.image = None
+        return result
+
+
+    @classmethod
+    def getFailure(cls, status, seconds, error):
+        """Answer the result of an image that has been stopped by the supervisor."""
+
+        return {'status': status, 'seconds': seconds, 'error': error, 'stageTimes': None, 'manifest': None}
+
+
+    def getMemory(self):
+        """Answer the resident set size of the worker in bytes, or None if it can not be measured."""
+
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss
+        except psutil.Error:
+            return None
+
+
+    def start(self):
+        """Start a new worker process."""
+
+        self.connection, workerConnection = self.context.Pipe()
+        self.process = self.context.Process(target=self.target, args=(workerConnection,) + self.arguments,
+                                            daemon=True)
+        self.process.start()
+        workerConnection.close()
+
+
+    def stop(self, kill=False):
+        """Stop the worker process. If kill is False, the worker is asked to finish, otherwise it is killed."""
+
+        if self.process is None:
+            return
+        if not kill and self.process.is_alive():
+            try:
+                self.connection.send(None)
+                self.process.join(5)
+            except OSError:
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self.process = None
+        self.connection = None
+
+
+
+class IsolatedBatchRunner(object):
+    """Run the images of a batch in worker processes supervised by the batch. Each free worker takes the next
+    image, in the order in which the images are given, so that images given largest first are scheduled longest
+    processing time first. The workers are kept for the next images, so that each loads the models only once. If an
+    image takes longer than the option imageTimeout in seconds, if a worker uses more than the option
+    imageMemoryLimit in megabytes, or if it dies, the worker is stopped, the image is recorded as timeout, memory
+    or failed in the run report and a new worker is started for the next image. A memory limit of zero means no
+    limit. The memory of the workers is their resident set size, measured with psutil."""
+
+
+    worker = staticmethod(runWorker)
+    interval = 0.1
+
+
+    def __init__(self, batch, workers=1):
+        """Create a runner of the images of the batch in the given number of worker processes, with the options
+        of the rings segmenter of the batch."""
+
+        super().__init__()
+        self.batch = batch
+        self.timeout = batch.ringSegmenter.options['imageTimeout']
+        self.memoryLimit = batch.ringSegmenter.options['imageMemoryLimit'] * 2 ** 20
+        context = multiprocessing.get_context('spawn')
+        self.workers = [IsolatedWorker(context, self.worker, (batch.sourceFolder, batch.outputFolder))
+                        for _ in range(max(1, workers))]
+
+
+    def run(self, imageFilenames):
+        """Run the images with the given file names and yield the number of processed images after each image. If
+        the batch is cancelled, no new image is started and the images being processed are finished."""
+
+        pending = list(reversed(imageFilenames))
+        index = 0
+        try:
+            while True:
+                for worker in self.workers:
+                    if pending and not worker.isBusy() and not self.batch.cancelToken.isCancelled():
+                        worker.send(pending.pop())
+                busy = [worker for worker in self.workers if worker.isBusy()]
+                if not busy:
+                    return
+                ready = multiprocessing.connection.wait([worker.connection for worker in busy], self.interval)
+                for worker in busy:
+                    result = worker.getResult(ready, self.timeout, self.memoryLimit)
+                    if result is None:
+                        continue
+                    self.addResult(result)
+                    index = index + 1
+                    yield index
+        finally:
+            for worker in self.workers:
+                worker.stop(kill=worker.isBusy())
+
+
+    def addResult(self, result):
+        """Record the result of an image in the manifest and the run report of the batch."""
+
+        if result['manifest'] is not None:
+            self.batch.manifest.append(result['manifest'])
+            self.batch.saveManifest()
+        self.batch.addToReport(result['image'], result['status'], result['seconds'], result['error'],
+                               result['stageTimes'])
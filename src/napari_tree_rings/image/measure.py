@@ -1,7 +1,9 @@
 import os
+import threading
 import numpy as np
-from skimage.measure import regionprops_table
-from napari.qt.threading import create_worker
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from napari_tree_rings.image.parent import ParentImage
 
 
 
@@ -10,16 +12,76 @@ class TableTool:
 
     @classmethod
     def addTableAToB(cls, tableA, tableB):
+        """Append the rows of tableA to tableB. Columns missing in one of the tables are filled with nan, so that
+        all columns of tableB keep the same length."""
+
         if len(tableB.keys()) == 0:
             for key, value in tableA.items():
                     tableB[key] = value
             return
+        rowsA = cls.getNumberOfRows(tableA)
+        rowsB = cls.getNumberOfRows(tableB)
         for key, value in tableA.items():
             if key in tableB.keys():
                 tableB[key] = np.append(tableB[key], [value])
             else:
-                column = np.array([float('nan')] * len(list(tableA.keys())[0]))
-                tableB[key] = np.append(column, [value])           
+                column = np.array([float('nan')] * rowsB)
+                tableB[key] = np.append(column, [value])
+        for key in tableB.keys():
+            if key not in tableA.keys():
+                tableB[key] = np.append(tableB[key], [float('nan')] * rowsA)
+
+
+    @classmethod
+    def getNumberOfRows(cls, table):
+        """Answer the number of rows of the table."""
+
+        if len(table.keys()) == 0:
+            return 0
+        return len(list(table.values())[0])
+
+
+
+class MeasurementCollector:
+    """Collect the measurements of segmenters running in parallel threads. Each segmenter fills its own table,
+    which is merged into the collected table under a lock once the segmenter has finished."""
+
+
+    def __init__(self):
+        """Create a collector with an empty table."""
+
+        self.table = {}
+        self.lock = threading.Lock()
+
+
+    def merge(self, table):
+        """Append the rows of the given table to the collected table."""
+
+        table = {key: np.array(column, copy=True) for key, column in table.items()}
+        with self.lock:
+            TableTool.addTableAToB(table, self.table)
+
+
+    def getTable(self):
+        """Answer a copy of the collected table, that can be used while other segmenters are still merging
+        their results."""
+
+        with self.lock:
+            return {key: np.array(column, copy=True) for key, column in self.table.items()}
+
+
+    def getNumberOfRows(self):
+        """Answer the number of rows in the collected table."""
+
+        with self.lock:
+            return TableTool.getNumberOfRows(self.table)
+
+
+    def clear(self):
+        """Remove all rows from the collected table."""
+
+        with self.lock:
+            self.table = {}
 
 
 
@@ -45,15 +107,23 @@ class Measure(object):
         and the base-unit of the measurements. If for example the base-unit is µm, areas will be measured
         in µm^2"""
 
-        self.table = regionprops_table(self.image, properties=self.properties, spacing=self.layer.scale)
-        self.table["base unit"] = np.array([str(self.layer.units[0])])
+        self.table = self.measureRegions()
+        rows = TableTool.getNumberOfRows(self.table)
+        self.table["base unit"] = np.array([str(self.layer.units[0])] * rows)
         if 'parent' in self.layer.metadata.keys():
-            self.table['image'] = np.array([self.layer.metadata['parent'].name])
+            self.table['image'] = np.array([ParentImage.of(self.layer.metadata['parent']).name] * rows)
         if 'parent_path' in self.layer.metadata.keys():
-            self.table['path'] = np.array([os.path.dirname(self.layer.metadata['parent_path'])])
+            self.table['path'] = np.array([os.path.dirname(self.layer.metadata['parent_path'])] * rows)
         else:
-            self.table['image'] = np.array([self.layer.name])
-        self.table["object_type"] = np.array([self.object_type])
+            self.table['image'] = np.array([self.layer.name] * rows)
+        self.table["object_type"] = np.array([self.object_type] * rows)
+
+
+    def measureRegions(self):
+        """Answer the table of the properties of the regions in the labels image."""
+
+        from skimage.measure import regionprops_table
+        return regionprops_table(self.image, properties=self.properties, spacing=self.layer.scale)
 
 
     def addToTable(self, table):
@@ -66,6 +136,7 @@ class Measure(object):
     def getRunThread(self):
         """Answer a worker that can be used to execute the measurements in a parallel thread."""
 
+        from napari.qt.threading import create_worker
         worker = create_worker(self.do)
         return worker
 
@@ -80,12 +151,107 @@ class MeasureShape(Measure):
         the features are measured."""
         super(MeasureShape, self).__init__(layer, object_type)
         if 'parent' in self.layer.metadata.keys():
-            self.image = self.layer.to_labels(self.layer.metadata['parent'].data.shape[0:2])
+            self.image = self.layer.to_labels(ParentImage.of(self.layer.metadata['parent']).shape[0:2])
         else:
             self.image = self.layer.to_labels()
 
 
 
+class MeasurePolygons(Measure):
+    """Measure the polygons of a Polygons container, without creating a napari layer. Each polygon is rasterised
+    and measured in its bounding box. The bounding boxes in the results are in the coordinates of the image. The
+    polygons can be measured in parallel, by a pool of threads or of processes. The processes read the vertices
+    from shared memory. The rows of the results are in the order of the polygons in any case."""
+
+
+    def __init__(self, polygons, object_type='trunk', workers=1, pool='thread'):
+        """If the polygons have a parent image, they are clipped to the image. With more than one worker, the
+        polygons are measured by a pool of workers threads or, if pool is 'process', of worker processes."""
+
+        super(MeasurePolygons, self).__init__(polygons, object_type)
+        self.shape = None
+        if 'parent' in self.layer.metadata.keys():
+            self.shape = ParentImage.of(self.layer.metadata['parent']).shape[0:2]
+        self.workers = workers
+        self.pool = pool
+
+
+    def measureRegions(self):
+        """Answer the table of the properties of the polygons, the polygon with index i having the label i + 1."""
+
+        indices = range(len(self.layer.data))
+        if self.workers <= 1 or len(indices) < 2:
+            rows = [self.measurePolygon(index) for index in indices]
+        elif self.pool == 'process':
+            rows = self.measureInProcesses()
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                rows = list(executor.map(self.measurePolygon, indices))
+        table = {}
+        for row in rows:
+            TableTool.addTableAToB(row, table)
+        return table
+
+
+    def measurePolygon(self, index):
+        """Answer the table of the properties of the polygon with the given index."""
+
+        return measurePolygon(self.layer.data[index], index + 1, self.shape, self.properties, self.layer.scale)
+
+
+    def measureInProcesses(self):
+        """Measure the polygons in a pool of worker processes. The vertices of all polygons are copied once into
+        a block of shared memory, the workers receive the name of the block and the range of the vertices of
+        their polygon."""
+
+        lengths = [len(polygon) for polygon in self.layer.data]
+        stops = np.cumsum(lengths)
+        starts = stops - lengths
+        vertices = np.concatenate(self.layer.data)
+        memory = shared_memory.SharedMemory(create=True, size=max(vertices.nbytes, 1))
+        try:
+            buffer = np.ndarray(vertices.shape, dtype=np.float64, buffer=memory.buf)
+            buffer[:] = vertices
+            tasks = [(memory.name, vertices.shape, start, stop, index + 1, self.shape, self.properties,
+                      self.layer.scale) for index, (start, stop) in enumerate(zip(starts, stops))]
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn')) as executor:
+                rows = list(executor.map(measureSharedPolygon, tasks))
+            del buffer
+        finally:
+            memory.close()
+            memory.unlink()
+        return rows
+
+
+
+def measurePolygon(polygon, label, shape, properties, scale):
+    """Answer the table of the properties of the polygon, measured in its bounding box, clipped to the shape of the
+    image if it is not None. The bounding box in the table is in the coordinates of the image."""
+
+    from skimage.measure import regionprops_table
+    from napari_tree_rings.image.geometry import Polygons
+    mask, (rows, columns) = Polygons([polygon]).toMask(0, shape)
+    table = regionprops_table(mask.astype(np.int32) * label, properties=properties, spacing=scale)
+    for key, offset in (('bbox-0', rows.start), ('bbox-1', columns.start),
+                        ('bbox-2', rows.start), ('bbox-3', columns.start)):
+        if key in table:
+            table[key] = table[key] + offset
+    return table
+
+
+def measureSharedPolygon(task):
+    """Measure a polygon whose vertices are in shared memory. Run by the worker processes of MeasurePolygons."""
+
+    name, shape, start, stop, label, imageShape, properties, scale = task
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        polygon = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)[start:stop].copy()
+    finally:
+        memory.close()
+    return measurePolygon(polygon, label, imageShape, properties, scale)
+
+
+
 class MeasureLabels(Measure):
     """Measure objects in a labels layer."""
 
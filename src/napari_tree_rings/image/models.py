@@ -0,0 +1,261 @@
+import gc
+import sys
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+from napari_tree_rings.image.instrumentation import Instrumentation
+
+
+
+class ModelRegistry(object):
+    """Keep the models that have been loaded, so that all segmenters and jobs can reuse them instead of loading
+    their own copies. A model is loaded only once, even if several threads ask for it at the same time.
+
+    Models that have not been asked for during the time to live are evicted, so that a long running session does
+    not keep the models of all methods it has once used. The keys of the models start with the name of their kind,
+    'keras' or 'inbd', so that the models of one framework can be released together. The segmenters declare the
+    kind of models they are running with use, the models of a kind in use are not released."""
+
+
+    instance = None
+    instanceLock = threading.Lock()
+    reapInterval = 30
+
+
+    def __init__(self):
+        """Create an empty registry, that keeps the models until they are removed."""
+
+        super().__init__()
+        self.models = {}
+        self.loadLocks = {}
+        self.lastUsed = {}
+        self.loadedBytes = {}
+        self.users = {}
+        self.timeToLive = 0
+        self.reaper = None
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def getInstance(cls):
+        """Answer the registry shared by all segmenters. The registry is created on the first call."""
+
+        with cls.instanceLock:
+            if not cls.instance:
+                cls.instance = ModelRegistry()
+        return cls.instance
+
+
+    def get(self, key, loader):
+        """Answer the model registered under key. If it has not been loaded yet, it is loaded by calling loader."""
+
+        self.evictIdle()
+        with self.lock:
+            if key in self.models:
+                self.lastUsed[key] = time.monotonic()
+                return self.models[key]
+            loadLock = self.loadLocks.setdefault(key, threading.Lock())
+        with loadLock:
+            with self.lock:
+                if key in self.models:
+                    self.lastUsed[key] = time.monotonic()
+                    return self.models[key]
+            rss, _ = Instrumentation.getMemory()
+            model = loader()
+            rssAfter, _ = Instrumentation.getMemory()
+            with self.lock:
+                self.models[key] = model
+                self.lastUsed[key] = time.monotonic()
+                self.loadedBytes[key] = None if rss is None or rssAfter is None else max(rssAfter - rss, 0)
+                self.loadLocks.pop(key, None)
+        return model
+
+
+    def contains(self, key):
+        """Answer whether a model is registered under key."""
+
+        with self.lock:
+            return key in self.models
+
+
+    def remove(self, key):
+        """Remove the model registered under key from the registry."""
+
+        with self.lock:
+            self.models.pop(key, None)
+            self.lastUsed.pop(key, None)
+            self.loadedBytes.pop(key, None)
+
+
+    def clear(self):
+        """Remove all models from the registry."""
+
+        with self.lock:
+            self.models.clear()
+            self.lastUsed.clear()
+            self.loadedBytes.clear()
+
+
+    def setTimeToLive(self, seconds):
+        """Evict the models that have not been asked for during the given number of seconds. With zero seconds, the
+        models are kept until they are removed. The idle models are evicted when a model is asked for and by a
+        thread checking them every reapInterval seconds."""
+
+        with self.lock:
+            self.timeToLive = seconds
+            if seconds > 0 and self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap, name="model-reaper", daemon=True)
+                self.reaper.start()
+
+
+    def reap(self):
+        while True:
+            time.sleep(self.reapInterval)
+            self.evictIdle()
+
+
+    def evictIdle(self):
+        """Remove the models that have not been asked for during the time to live, free the memory of the
+        frameworks that have no model left, as release does, and answer their keys. A segmenter still using an
+        evicted model keeps it until it has finished."""
+
+        with self.lock:
+            if self.timeToLive <= 0:
+                return []
+            now = time.monotonic()
+            keys = [key for key, used in self.lastUsed.items() if now - used > self.timeToLive]
+        for key in keys:
+            self.remove(key)
+        if keys:
+            gc.collect()
+            self.releaseFrameworks(set(key[0] for key in keys))
+        return keys
+
+
+    @contextmanager
+    def use(self, kind):
+        """Mark the models of the kind as in use while the with-block is executed, so that they are not released.
+        The with-blocks of several segmenters can overlap."""
+
+        with self.lock:
+            self.users[kind] = self.users.get(kind, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.users[kind] = self.users[kind] - 1
+                if not self.users[kind]:
+                    del self.users[kind]
+
+
+    def isInUse(self, kind):
+        """Answer whether a segmenter is running models of the kind."""
+
+        with self.lock:
+            return kind in self.users
+
+
+    def release(self, kind=None):
+        """Remove the models of the given kind, or all models if kind is None, and free the memory held by their
+        frameworks: the keras session is cleared and the cache of torch is emptied, if a model has been removed
+        and no model of the framework is left. The models of kinds that are in use are kept. Answer the keys of
+        the removed models."""
+
+        with self.lock:
+            keys = [key for key in self.models.keys()
+                    if (kind is None or key[0] == kind) and key[0] not in self.users]
+        if not keys:
+            return keys
+        for key in keys:
+            self.remove(key)
+        gc.collect()
+        self.releaseFrameworks(set(key[0] for key in keys))
+        return keys
+
+
+    def releaseFrameworks(self, kinds):
+        """Free the memory held by the frameworks of the given kinds of models, if no model of the kind is left and
+        the kind is not in use: the keras session is cleared and the cache of torch is emptied."""
+
+        with self.lock:
+            kinds = set(kinds) - set(key[0] for key in self.models.keys()) - set(self.users.keys())
+        if 'keras' in kinds and 'tensorflow' in sys.modules:
+            import tensorflow as tf
+            tf.keras.backend.clear_session()
+        if 'inbd' in kinds and 'torch' in sys.modules:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+
+    def getFootprint(self):
+        """Answer for each model the kind, the memory of its weights in bytes, the growth of the resident set size
+        of the process while it was loaded, None if it could not be measured, and the seconds since it was asked
+        for."""
+
+        now = time.monotonic()
+        with self.lock:
+            items = list(self.models.items())
+            lastUsed = dict(self.lastUsed)
+            loadedBytes = dict(self.loadedBytes)
+        return [{'model': str(key[1]) if len(key) > 1 else str(key),
+                 'kind': key[0],
+                 'weightBytes': self.getWeightBytes(model),
+                 'loadedBytes': loadedBytes.get(key),
+                 'idleSeconds': round(now - lastUsed.get(key, now), 3)}
+                for key, model in items]
+
+
+    def getTotalFootprint(self):
+        """Answer the memory of the weights of all registered models in bytes."""
+
+        return sum(entry['weightBytes'] for entry in self.getFootprint())
+
+
+    @classmethod
+    def getWeightBytes(cls, model):
+        """Answer the number of bytes of the weights of a torch or a keras model, 0 for other objects."""
+
+        if hasattr(model, 'parameters') and hasattr(model, 'buffers'):
+            tensors = list(model.parameters()) + list(model.buffers())
+            return int(sum(tensor.numel() * tensor.element_size() for tensor in tensors))
+        if hasattr(model, 'weights'):
+            return int(sum(int(np.prod(weight.shape)) * cls.getItemSize(weight.dtype) for weight in model.weights))
+        return 0
+
+
+    @classmethod
+    def getItemSize(cls, dtype):
+        """Answer the number of bytes of an element of the tensorflow, keras or numpy dtype."""
+
+        if hasattr(dtype, 'size'):
+            return dtype.size
+        return np.dtype(str(dtype)).itemsize
+
+
+
+class SerializedModel(object):
+    """Wrap a keras model shared by the segmenters of jobs running in parallel threads, so that only one thread at
+    a time predicts with it, like the inference server does. The other attributes are those of the model."""
+
+
+    def __init__(self, model):
+        """Create a wrapper running the predictions of the model one after the other."""
+
+        super().__init__()
+        self.model = model
+        self.lock = threading.Lock()
+
+
+    def predict(self, *args, **kwargs):
+        """Answer the predictions of the model, once the predictions of the other threads have finished."""
+
+        with self.lock:
+            return self.model.predict(*args, **kwargs)
+
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
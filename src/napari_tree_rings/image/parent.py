@@ -0,0 +1,51 @@
+import weakref
+
+
+
+class ParentImage(object):
+    """A lightweight description of the image from which a result layer has been computed: its name, the path of
+    its file, its shape, its scale and its units. The layer of the image itself is only referenced weakly, so that a
+    result layer does not keep the image in memory after it has been deleted from the viewer or, in a batch, after
+    its image has been processed."""
+
+
+    def __init__(self, name, path=None, shape=(), scale=(1, 1), units=('pixel', 'pixel'), layer=None):
+        """Create the description of an image. If the layer is given, it is referenced weakly."""
+
+        super().__init__()
+        self.name = name
+        self.path = path
+        self.shape = tuple(shape)
+        self.scale = tuple(scale)
+        self.units = tuple(units)
+        self.layerReference = None if layer is None else weakref.ref(layer)
+
+
+    @classmethod
+    def fromLayer(cls, layer):
+        """Answer the description of the image of the layer."""
+
+        return cls(layer.name, path=layer.metadata.get('path'), shape=layer.data.shape, scale=layer.scale,
+                   units=layer.units, layer=layer)
+
+
+    @classmethod
+    def of(cls, parent):
+        """Answer the description of the parent, which can be a description or an image layer."""
+
+        if isinstance(parent, ParentImage):
+            return parent
+        return cls.fromLayer(parent)
+
+
+    @property
+    def layer(self):
+        """The layer of the image, or None if it does not exist anymore."""
+
+        if self.layerReference is None:
+            return None
+        return self.layerReference()
+
+
+    def __repr__(self):
+        return "ParentImage({!r}, shape={})".format(self.name, self.shape)
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+
+class PatchScheduler(object):
+    """Predict the patches of several images with a keras model in full batches. The patches of all images are put
+    together and cut into batches of batchSize patches, that are predicted one after the other. The last batch is
+    filled up with empty patches, so that the model always sees batches of the same shape. The predictions are
+    given back to the images they come from, in the order of their patches."""
+
+
+    def __init__(self, model, batchSize=8):
+        """Create a scheduler predicting patches with the model in batches of batchSize patches."""
+
+        super().__init__()
+        self.model = model
+        self.batchSize = max(1, batchSize)
+        self.tiles = []
+        self.numberOfBatches = 0
+
+
+    def add(self, tiles):
+        """Add the patches of an image and answer the index under which its predictions are answered by run."""
+
+        self.tiles.append(list(tiles))
+        return len(self.tiles) - 1
+
+
+    def getNumberOfPatches(self):
+        """Answer the number of patches of all images."""
+
+        return sum(len(tiles) for tiles in self.tiles)
+
+
+    def run(self):
+        """Predict the patches of all images batch by batch and answer the predictions of each image, as an array
+        of shape (number of patches, height, width), in the order in which the images have been added. Only one
+        batch of patches is copied at a time, the patches of the group are not stacked into one array."""
+
+        counts = [len(tiles) for tiles in self.tiles]
+        total = sum(counts)
+        self.numberOfBatches = 0
+        if total == 0:
+            return [np.zeros((0, 0, 0), dtype=np.float32) for _ in counts]
+        tiles = [tile for imageTiles in self.tiles for tile in imageTiles]
+        batch = np.zeros((self.batchSize,) + np.shape(tiles[0]), dtype=np.float32)
+        predictions = None
+        for start in range(0, total, self.batchSize):
+            size = min(self.batchSize, total - start)
+            batch[:size] = tiles[start:start + size]
+            batch[size:] = 0
+            predicted = np.asarray(self.model.predict(batch, batch_size=self.batchSize, verbose=0))[:size]
+            if predictions is None:
+                predictions = np.empty((total,) + predicted.shape[1:3], dtype=np.float32)
+            predictions[start:start + size] = np.reshape(predicted, (size,) + predicted.shape[1:3])
+            self.numberOfBatches = self.numberOfBatches + 1
+        stops = np.cumsum(counts)
+        return [predictions[stop - count:stop] for stop, count in zip(stops, counts)]
@@ -0,0 +1,233 @@
+import hashlib
+import math
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+from napari_tree_rings.image.checkpoint import CheckpointStore
+
+
+
+class PreprocessingCache(object):
+    """A memory-bounded cache of the derivatives of the image of a layer (grayscale, downscaled, ...), that are
+    needed by more than one operation. A derivative is computed only once, even if several workers ask for it at
+    the same time, and is shared read-only between them. When the cache exceeds its maximum size, the least
+    recently used derivatives are evicted."""
+
+
+    instance = None
+    instanceLock = threading.Lock()
+    grayscaleWeights = {'luma': np.array([0.299, 0.587, 0.114], dtype=np.float32),
+                        'trunk': np.array([0.2125, 0.7154, 0.0721], dtype=np.float32)}
+    chunkRows = 1024
+    stampSamples = 256 * 256
+    maxPersistedBytes = 256 * 1024 ** 2
+
+
+    def __init__(self, maxBytes=2 * 1024 ** 3):
+        """Create a cache that holds at most maxBytes bytes of derived images."""
+
+        super().__init__()
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.computeLocks = {}
+        self.finalizers = {}
+        self.hashes = {}
+        self.watchedLayers = weakref.WeakSet()
+        self.lock = threading.RLock()
+
+
+    @classmethod
+    def getInstance(cls):
+        """Answer the cache shared by all operations of the plugin. The cache is created on the first call."""
+
+        with cls.instanceLock:
+            if not cls.instance:
+                cls.instance = PreprocessingCache()
+        return cls.instance
+
+
+    def getGrayscale(self, layer, weights='luma'):
+        """Answer the grayscale version of the image of the layer, converted with the given weights (see
+        grayscaleWeights), as a read-only float32 array. The grayscale image has the full resolution of the image
+        and is only kept in memory, it is not persisted in a checkpoint-store, where it would evict the smaller
+        derivatives and predictions."""
+
+        return self.get(layer, ('grayscale', weights), lambda: self.convertToGrayscale(layer.data, weights))
+
+
+    def getDownscaled(self, layer, factor, store=None, method='rescale'):
+        """Answer the grayscale image of the layer, converted with the rgb2gray weights of the segment-trunk command
+        and scaled down by the given factor with the given method (see SegmentTrunk.downscale), as a read-only
+        array. If a checkpoint-store is given, the downscaled image is read from it or persisted in it. Since the
+        grayscale conversion is linear, the block-means are computed on the image of the layer and converted to
+        grayscale afterwards, without creating the full-size grayscale image. The other methods need the grayscale
+        image, if the downscaled image is neither in memory nor in the store."""
+
+        from napari_tree_rings.image.segmentation import SegmentTrunk
+        if method == 'mean' and float(factor).is_integer():
+            function = lambda: self.convertToGrayscale(SegmentTrunk.downscale(layer.data, factor, method), 'trunk')
+        else:
+            function = lambda: SegmentTrunk.downscale(self.getGrayscale(layer, 'trunk'), factor, method)
+        derivative = ('downscaled', factor, method, 'trunk')
+        return self.get(layer, derivative, lambda: self.getPersisted(layer, store, derivative, function))
+
+
+    def getPersisted(self, layer, store, derivative, function):
+        """Answer the derivative of the image of the layer from the checkpoint-store. If it is not in the store,
+        compute it by calling function and persist it, unless it is larger than maxPersistedBytes. Without a store,
+        just call function."""
+
+        if store is None:
+            return function()
+        key = store.getKey(self.getImageHash(layer), *derivative)
+        stored = store.load(key)
+        if stored:
+            return stored['array']
+        result = function()
+        if np.asarray(result).nbytes <= self.maxPersistedBytes:
+            store.save(key, compress=False, array=result)
+        return result
+
+
+    def getImageHash(self, layer):
+        """Answer a hash of the content of the image of the layer. The hash is computed only once per image."""
+
+        with self.lock:
+            self.watch(layer)
+            dataKey = self.getDataKey(layer.data)
+            if dataKey in self.hashes:
+                return self.hashes[dataKey]
+        imageHash = CheckpointStore.getArrayHash(layer.data)
+        with self.lock:
+            self.hashes[dataKey] = imageHash
+        return imageHash
+
+
+    def get(self, layer, derivative, function):
+        """Answer the derivative of the image of the layer. If it is not in the cache, it is computed by calling
+        function. Concurrent calls for the same derivative wait for the first one instead of computing it again."""
+
+        with self.lock:
+            self.watch(layer)
+            key = (self.getDataKey(layer.data),) + tuple(derivative)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            computeLock = self.computeLocks.setdefault(key, threading.Lock())
+        with computeLock:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+            result = np.asarray(function())
+            result.flags.writeable = False
+            with self.lock:
+                self.put(key, result)
+                self.computeLocks.pop(key, None)
+        return result
+
+
+    def put(self, key, array):
+        """Store the array under the key and evict the least recently used entries until the cache fits into its
+        maximum size. Arrays larger than the cache itself are not stored."""
+
+        if array.nbytes > self.maxBytes:
+            return
+        self.entries[key] = array
+        while self.nbytes() > self.maxBytes:
+            self.entries.popitem(last=False)
+
+
+    def nbytes(self):
+        """Answer the number of bytes of all derivatives in the cache."""
+
+        return sum(array.nbytes for array in self.entries.values())
+
+
+    def getDataKey(self, data):
+        """Answer the key of the image data, made of its id, its shape, its type and a stamp of its content, so
+        that an image edited in place does not answer the derivatives of its former content. The entries of an
+        image are dropped when its data is garbage collected, so that the id can not be mistaken for the one of
+        a later image. The lock must be held by the caller."""
+
+        dataId = id(data)
+        if dataId not in self.finalizers:
+            try:
+                self.finalizers[dataId] = weakref.finalize(data, self.discardData, dataId)
+            except TypeError:
+                pass
+        return dataId, tuple(data.shape), str(data.dtype), self.getStamp(data)
+
+
+    @classmethod
+    def getStamp(cls, data):
+        """Answer a cheap stamp of the content of the image data, the hash of a regular grid of at most
+        stampSamples pixels of the image."""
+
+        step = max(1, int(math.ceil(math.sqrt(data.shape[0] * data.shape[1] / cls.stampSamples))))
+        sample = np.ascontiguousarray(data[::step, ::step])
+        return hashlib.blake2b(sample.tobytes(), digest_size=8).hexdigest()
+
+
+    def watch(self, layer):
+        """Discard the derivatives of the image of the layer whenever the layer reports a change of its data, for
+        example when the data is set again after an edit in place that the stamp of the content does not see.
+        The lock must be held by the caller."""
+
+        events = getattr(getattr(layer, 'events', None), 'data', None)
+        if events is None or layer in self.watchedLayers:
+            return
+        layerRef = weakref.ref(layer)
+        events.connect(lambda event: self.discardLayerRef(layerRef))
+        self.watchedLayers.add(layer)
+
+
+    def discardLayerRef(self, layerRef):
+        """Remove all derivatives of the image of the referenced layer, if the layer still exists."""
+
+        layer = layerRef()
+        if layer is not None:
+            self.discard(layer)
+
+
+    def discardData(self, dataId):
+        """Remove all derivatives of the image data with the given id from the cache."""
+
+        with self.lock:
+            for key in [key for key in self.entries.keys() if key[0][0] == dataId]:
+                del self.entries[key]
+            for key in [key for key in self.hashes.keys() if key[0] == dataId]:
+                del self.hashes[key]
+            self.finalizers.pop(dataId, None)
+
+
+    def discard(self, layer):
+        """Remove all derivatives of the image of the layer from the cache."""
+
+        self.discardData(id(layer.data))
+
+
+    def clear(self):
+        """Remove all derivatives from the cache."""
+
+        with self.lock:
+            self.entries.clear()
+
+
+    @classmethod
+    def convertToGrayscale(cls, image, weights='luma'):
+        """Answer the luminance of the image as a float32 array in the intensity range of the input image. RGB(A)
+        images are converted in blocks of rows, to avoid float64 temporaries of the full image, using the weights
+        of grayscaleWeights with the given name: 'luma' are the ITU-R 601 weights the ring models have been
+        trained with and 'trunk' the weights of rgb2gray, used by the segment-trunk command."""
+
+        if len(image.shape) == 3 and image.shape[-1] in (3, 4):
+            result = np.empty(image.shape[0:2], dtype=np.float32)
+            for start in range(0, image.shape[0], cls.chunkRows):
+                block = np.asarray(image[start:start + cls.chunkRows, :, 0:3], dtype=np.float32)
+                result[start:start + cls.chunkRows] = block @ cls.grayscaleWeights[weights]
+            return result
+        if len(image.shape) == 3 and image.shape[-1] == 1:
+            return np.array(image[:, :, 0], dtype=np.float32)
+        return np.array(image, dtype=np.float32)
@@ -15,8 +15,16 @@ from scipy import ndimage
 from napari.layers import Image, Shapes
 from napari_tree_rings.image.segmentation import SegmentTrunk
 from napari_tree_rings.image.file_util import TiffFileTags
-from napari_tree_rings.image.measure import MeasureShape
-from tree_ring_analyzer.segmentation import TreeRingSegmentation
+from napari_tree_rings.image.measure import MeasureShape, MeasurePolygons
+from napari_tree_rings.image.geometry import Geometry, Polygons
+from napari_tree_rings.image.preprocessing import PreprocessingCache
+from napari_tree_rings.image.models import ModelRegistry, SerializedModel
+from napari_tree_rings.image.checkpoint import CancelToken, CheckpointStore
+from napari_tree_rings.image.instrumentation import Instrumentation
+from napari_tree_rings.image.inbd import INBDBackend
+from napari_tree_rings.image.patches import PatchScheduler
+from napari_tree_rings.image.parent import ParentImage
+from napari_tree_rings.image.discovery import BatchDiscovery
 import napari_tree_rings.config
 
 
@@ -25,6 +33,9 @@ class Segmenter(object):
     """Abstract superclass of operations segmenting given objects in an image."""
 
 
+    operationName = 'segment'
+
+
     def __init__(self, layer):
         super().__init__()
         self.layer = layer
@@ -32,17 +43,27 @@ class Segmenter(object):
         self.segmentTrunkOp = None
         self.measureOp = None
         self.measurements = {}
+        self.cancelToken = CancelToken()
+        self.checkpointFolder = None
+        self.instrumentation = None
 
 
     def run(self):
-        """Run the trunk segmenter on the image. Yield between operations to allow to display the progress.
+        """Run the segmenter on the image. Yield between operations to allow to display the progress. The
+        operations check the cancel token, so that the run can be stopped between two of them. The time and memory
+        used by the stages are reported by the instrumentation of the run.
         """
         yield
-        self.setPixelSizeAndUnit()
-        yield
-        self.segment()
+        self.cancelToken.check()
+        self.instrumentation = Instrumentation(self.operationName, self.layer)
+        with self.instrumentation.stage('pixel size and unit'):
+            self.setPixelSizeAndUnit()
         yield
-        self.measure()
+        yield from self.doSegment()
+        self.cancelToken.check()
+        with self.instrumentation.stage('measure'):
+            self.measure()
+        self.instrumentation.finish()
         yield
 
 
@@ -57,13 +78,34 @@ class Segmenter(object):
 
 
     def segment(self):
+        """Run all stages of the segmentation without interruption."""
+
+        self.instrumentation = Instrumentation(self.operationName, self.layer)
+        for _ in self.doSegment():
+            pass
+        self.instrumentation.finish()
+
+
+    def doSegment(self):
+        """Segment the image, yielding between the stages of the segmentation."""
+
         self.subClassResponsibility()
+        yield
 
 
     def measure(self):
         self.subClassResponsibility()
 
 
+    def releaseImage(self):
+        """Drop the references to the image layer and to the operations that have worked on it, so that the image
+        can be freed once it is not used elsewhere. The results and the measurements are kept."""
+
+        self.layer = None
+        self.segmentTrunkOp = None
+        self.measureOp = None
+
+
     def subClassResponsibility(self):
         raise Exception("SubclassResponsibility Exception: A method of an abstract class has been called!")
 
@@ -74,6 +116,9 @@ class TrunkSegmenter(Segmenter):
     trunk on the resulting shape-layer."""
 
 
+    operationName = 'trunk'
+
+
     def __init__(self, layer):
         """Create a new trunk segmenter on the given image-layer. The image-layer must have the path information
         in its metadata."""
@@ -81,116 +126,99 @@ class TrunkSegmenter(Segmenter):
         self.shapeLayer = None
 
 
-    def run(self):
-        """Run the trunk segmenter on the image. Yield between operations to allow to display the progress.
-        """
-        start_time = time.time()
-        print("started")
-        yield
-        print("1. set pixel size and unit")
-        self.setPixelSizeAndUnit()
-        yield
-        print("2. instantiate segment trunk operation")
-        self.segmentTrunkOp = SegmentTrunk(self.layer)
-        yield
-        print("3. convert image")
-        self.segmentTrunkOp.options = self.segmentTrunkOp.readOptions()
-        image = self.layer.data
-        image = self.segmentTrunkOp.convertImage(image)
-        shape = (image.shape[0], image.shape[1])
-        print("shape: " + str(shape))
-        yield
-        print("4. scale down")
-        image = self.segmentTrunkOp.scaleDownImage(image)
-        yield
-        print("5. threshold")
-        image = self.segmentTrunkOp.meanThresholdImage(image)
-        yield
-        print("6. keep largest region")
-        image = self.segmentTrunkOp.keep_largest_region(image)
-        yield
-        print("7. fill holes")
-        image = self.segmentTrunkOp.fillHolesImage(image)
-        yield
-        print("8. opening")
-        image = self.segmentTrunkOp.morphoOpenImage(image)
-        yield
-        print("9. scale up")
-        image = self.segmentTrunkOp.scaleUpMask(image, shape)
-        yield
-        print("10. erode")
-        image = self.segmentTrunkOp.morphoErodeImage(image)
+    def doSegment(self):
+        """Segment the trunk and retrieve the result as a shape-layer. Sets the parent of the shape layer
+        to a description of the image layer and copies the parent's path into its own metadata. So that they will be available for
+        the measure trunk method. Yield between the stages, which check the cancel token. If checkpoints are enabled
+        in the options, the results of the stages up to the opening are cached on disk, keyed by the hash of the image
+        and the options each stage depends on. A rerun with changed options only recomputes the stages downstream of
+        the first changed option. With the automatic scale, the keys contain the computed scale and opening radius.
+        If the option hull is 'contour', the convex hull is computed on the vertices of the contour of the eroded
+        mask and resampled with the vertex spacing of the options, otherwise it is computed on the image."""
+
+        self.cancelToken.check()
+        stage = self.instrumentation.stage
+        with stage('read options'):
+            self.segmentTrunkOp = SegmentTrunk(self.layer)
+            self.segmentTrunkOp.applyAutoScale(self.layer.data.shape, self.layer.scale[0], self.layer.units[0])
+        options = self.segmentTrunkOp.options
+        self.instrumentation.options = dict(options)
+        cache = PreprocessingCache.getInstance()
+        shape = (self.layer.data.shape[0], self.layer.data.shape[1])
+        store = None
+        mask = None
+        opened = None
+        if options['checkpoints']:
+            with stage('read checkpoints'):
+                store = CheckpointStore(self.checkpointFolder)
+                imageHash = cache.getImageHash(self.layer)
+                maskKey = store.getKey(imageHash, 'trunk mask', options['scale'], options['downscaling'])
+                openedKey = store.getKey(imageHash, 'trunk opened mask', options['scale'], options['downscaling'],
+                                         options['opening'])
+                checkpoint = store.load(openedKey)
+                if checkpoint:
+                    opened = checkpoint['mask']
+                else:
+                    checkpoint = store.load(maskKey)
+                    if checkpoint:
+                        mask = checkpoint['mask']
         yield
-        print("11. convex hull")
-        image = self.segmentTrunkOp.convexHullImage(image)
+        if opened is None and mask is None:
+            self.cancelToken.check()
+            with stage('downscale'):
+                image = cache.getDownscaled(self.layer, options['scale'], store, options['downscaling'])
+            yield
+            self.cancelToken.check()
+            with stage('threshold'):
+                image = self.segmentTrunkOp.meanThresholdImage(image)
+            yield
+            self.cancelToken.check()
+            with stage('keep largest region'):
+                image = self.segmentTrunkOp.keep_largest_region(image)
+            yield
+            self.cancelToken.check()
+            with stage('fill holes'):
+                mask = self.segmentTrunkOp.fillHolesImage(image).astype(np.uint8)
+                if store:
+                    store.save(maskKey, mask=mask)
+            yield
+        if opened is None:
+            self.cancelToken.check()
+            with stage('opening'):
+                opened = self.segmentTrunkOp.morphoOpenImage(mask)
+                if store:
+                    store.save(openedKey, mask=opened)
+            yield
+        image = opened
+        self.cancelToken.check()
+        with stage('scale up'):
+            image = self.segmentTrunkOp.scaleUpMask(image, shape)
         yield
-        print("12. create shapes")
-        self.segmentTrunkOp.result = self.segmentTrunkOp.createShapes(image)
+        self.cancelToken.check()
+        with stage('erode'):
+            image = self.segmentTrunkOp.morphoErodeImage(image)
         yield
-        print("13. set metadata")
-        shapeLayer = self.segmentTrunkOp.result
-        shapeLayer.scale = tuple([self.layer.scale[0]] * shapeLayer.ndim)
-        shapeLayer.units = tuple([self.layer.units[0]] * shapeLayer.ndim)
-        shapeLayer.metadata['parent'] = self.layer
-        shapeLayer.metadata['parent_path'] = self.layer.metadata['path']
-        shapeLayer.name = 'trunk of ' + self.layer.name
-        self.shapeLayer = shapeLayer
+        self.cancelToken.check()
+        with stage('convex hull'):
+            if options['hull'] == 'image':
+                hull = self.segmentTrunkOp.convexHullImage(image)
+            else:
+                hull = self.segmentTrunkOp.convexHullPolygon(image)
         yield
-        print("14. measure", flush=True)
-        self.measureOp = MeasureShape(self.shapeLayer, object_type="trunk")
-        print("measure do", flush=True)
-        self.measureOp.do()
-        print("measure add to table", flush=True)
-        self.measureOp.addToTable(self.measurements)
-        print("finished", flush=True)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        minutes = elapsed_time // 60
-        seconds = elapsed_time % 60
-        print("Elapsed time: ", str(minutes)+":"+str(seconds))
+        self.cancelToken.check()
+        with stage('create shapes'):
+            if options['hull'] == 'image':
+                self.segmentTrunkOp.result = self.segmentTrunkOp.createShapes(hull)
+            else:
+                self.segmentTrunkOp.result = self.segmentTrunkOp.createShapesFromPolygon(hull)
         yield
-
-
-
-    def segment(self):
-        """Segment the trunk in FIJI and retrieve the result as a shape-layer. Sets the parent of the shape layer
-        to the image layer and copies the parent's path into its own metadata. So that they will be available for
-        the measure trunk method."""
-
-
-        self.doSegment()
         shapeLayer = self.segmentTrunkOp.result
         shapeLayer.scale = tuple([self.layer.scale[0]] * shapeLayer.ndim)
         shapeLayer.units = tuple([self.layer.units[0]] * shapeLayer.ndim)
-        shapeLayer.metadata['parent'] = self.layer
+        shapeLayer.metadata['parent'] = ParentImage.fromLayer(self.layer)
         shapeLayer.metadata['parent_path'] = self.layer.metadata['path']
         shapeLayer.name = 'trunk of ' + self.layer.name
         self.shapeLayer = shapeLayer
-
-
-    def doSegment(self):
-        self.segmentTrunkOp.options = self.segmentTrunkOp.readOptions()
-        image = self.layer.data
-        shape = image.shape
-        image = self.segmentTrunkOp.convertImage(image)
-        yield
-        image = self.segmentTrunkOp.scaleDownImage(image)
-        yield
-        image = self.segmentTrunkOp.meanThresholdImage(image)
-        yield
-        image = self.segmentTrunkOp.keep_largest_region(image)
-        yield
-        image = self.segmentTrunkOp.fillHolesImage(image)
-        yield
-        image = self.segmentTrunkOp.morphoOpenImage(image)
-        yield
-        image = self.segmentTrunkOp.scaleUpMask(image, shape)
-        yield
-        image = self.segmentTrunkOp.morphoErodeImage(image)
-        yield
-        image = self.segmentTrunkOp.convexHullImage(image)
-        yield
-        self.segmentTrunkOp.result = self.segmentTrunkOp.createShapes(image)
         yield
 
 
@@ -209,6 +237,9 @@ class RingsSegmenter(Segmenter):
     labels-layer."""
 
 
+    operationName = 'rings'
+
+
     def __init__(self, layer):
         super().__init__(layer)
         self.dataFolder = appdirs.user_data_dir("napari-tree-rings")
@@ -226,79 +257,351 @@ class RingsSegmenter(Segmenter):
 
         self.options = {'method': 'Attention UNet', 'pithModel': self.pithModels[0], 'ringsModel': self.ringsModels[0], 'patchSize': 256,
                         'overlap': 60, 'batchSize': 8, 'resize': 5, 'lossType': 'H0',
-                          'inbdModel': self.inbdModels[0]}
+                          'inbdModel': self.inbdModels[0], 'cachePredictions': True,
+                        'measureWorkers': 1, 'measurePool': 'thread', 'trunkROI': False, 'roiMargin': 64,
+                        'inbdBatchSize': 1, 'imagesPerBatch': 1, 'inbdThreads': 0, 'inbdOptimize': False, 'inbdCompile': False,
+                        'inferenceSettings': 'manual', 'autoSettings': {}, 'inferenceServer': False,
+                        'modelTimeToLive': 600, 'isolateImages': False, 'imageTimeout': 1800, 'imageMemoryLimit': 0,
+                        'filePatterns': "*.tif;*.tiff", 'recursive': False, 'batchWorkers': 1}
         self.loadOptions()
         self.resultsLayer = None
+        self.inbdOutput = None
+        self.ringPrediction = None
         self.minRadiusDeltaPithInnerRing = 3
 
         self.ringsModel = None
         self.pithModel = None
         self.inbdModel = None
+        self.predictionsFolder = os.path.join(self.dataFolder, "predictions")
 
 
-    def segment(self):
+    def doSegment(self):
+        """Segment the pith and the rings and create the results layer. Yield between the stages, which check the
+        cancel token."""
+
         self.loadOptions()
-        if self.options['method'] == 'Attention UNet':
-            import tensorflow as tf
-            if self.ringsModel is None:
-                self.inbdModel = None
-                self.ringsModel = tf.keras.models.load_model(os.path.join(self.ringsModelsPath, self.options['ringsModel']), compile=False)
-                self.pithModel = tf.keras.models.load_model(os.path.join(self.pithModelsPath, self.options['pithModel']), compile=False)
-                self.channel = self.pithModel.get_config()['layers'][0]['config']['batch_shape'][-1]
-            
-            image = self.layer.data
-            
-            if len(image.shape) == 2:
-                image = image[:, :, None]
-            if self.channel == 1 and image.shape[-1] == 3:
-                image = (0.299 * image[:, :, 0] + 0.587 * image[:, :, 1] + 0.114 * image[:, :, 2])[:, :, None]
-            segmentation = TreeRingSegmentation()
-            segmentation.patchSize = self.options['patchSize']
-            segmentation.overlap = self.options['overlap']
-            segmentation.batchSize = self.options['batchSize']
-            segmentation.lossType = self.options['lossType']
-            segmentation.resize = self.options['resize']
-            segmentation.segmentImage(self.ringsModel, self.pithModel, image)
-            # rings = self.maskToPolygons(segmentation.maskRings)
-            # pith = self.maskToPolygons(segmentation.pith)
-            # self.removeInnerRing(rings, pith)
-            rings = self.ringToPolygons(segmentation.predictedRings)
-            
-        else:
-            import torch
-            if self.inbdModel is None:
-                self.ringsModel = None
-                self.pithModel = None
-                importer = torch.package.PackageImporter(os.path.join(self.inbdModelsPath, self.options['inbdModel']))
-                self.inbdModel = importer.load_pickle('model', 'model.pkl').eval().requires_grad_(False)
-                if torch.cuda.is_available():
-                    self.inbdModel.cuda()
-
-            output = self.inbdModel.process_image(self.layer.metadata['path'])
-            rings = []
-            for boundary in reversed(output.boundaries):
-                rings.append(list(boundary.boundarypoints * self.inbdModel.scale))
-        
-        self.resultsLayer = Shapes(rings,
-                                    edge_width=8,
-                                    face_color='white',
-                                    edge_color='red',
-                                    scale=self.layer.scale,
-                                    units=self.layer.units,
-                                    blending='minimum',
-                                    shape_type='polygon')
-        self.resultsLayer.metadata['parent'] = self.layer
+        self.instrumentation.options = dict(self.options)
+        self.cancelToken.check()
+        registry = ModelRegistry.getInstance()
+        registry.setTimeToLive(self.options['modelTimeToLive'])
+        kind = 'keras' if self.options['method'] == 'Attention UNet' else 'inbd'
+        with registry.use(kind):
+            registry.release('inbd' if kind == 'keras' else 'keras')
+            if kind == 'keras':
+                rings = yield from self.segmentWithAttentionUNet()
+            else:
+                rings = yield from self.segmentWithINBD()
+        self.cancelToken.check()
+        with self.instrumentation.stage('create shapes'):
+            self.resultsLayer = Shapes(rings,
+                                        edge_width=8,
+                                        face_color='white',
+                                        edge_color='red',
+                                        scale=self.layer.scale,
+                                        units=self.layer.units,
+                                        blending='minimum',
+                                        shape_type='polygon')
+        self.resultsLayer.metadata['parent'] = ParentImage.fromLayer(self.layer)
         self.resultsLayer.metadata['parent_path'] = self.layer.metadata['path']
         self.resultsLayer.name = 'pith and rings of ' + self.layer.name
+        yield
+
+
+    def segmentWithAttentionUNet(self):
+        """Predict a distance map of the rings and the pith with the Attention UNet models and trace the rings on
+        the distance map with the A* algorithm. Answer the pith and the rings as polygons."""
+
+        stage = self.instrumentation.stage
+        self.inbdModel = None
+        with stage('load models'):
+            self.loadKerasModels()
+        self.instrumentation.options['modelFootprint'] = ModelRegistry.getInstance().getTotalFootprint()
+        yield
+        self.cancelToken.check()
+        with stage('grayscale'):
+            image = self.getInputImage()
+        segmentation = self.createSegmentation()
+        yield from self.predict(segmentation, image)
+        self.cancelToken.check()
+        with stage('trace rings'):
+            results = segmentation.findEndPoints()
+        yield
+        self.cancelToken.check()
+        with stage('mask of rings'):
+            if segmentation.angle > 0:
+                rotation_matrix = cv2.getRotationMatrix2D((segmentation.centerRotate[1] * segmentation.resize,
+                                                           segmentation.centerRotate[0] * segmentation.resize),
+                                                          -segmentation.angle, scale=1)
+                results = segmentation.rotateContour(rotation_matrix, results)
+            segmentation.maskRings = segmentation.createMaskOfRings(results)
+        # rings = self.maskToPolygons(segmentation.maskRings)
+        # pith = self.maskToPolygons(segmentation.pith)
+        # self.removeInnerRing(rings, pith)
+        with stage('polygons'):
+            rings = self.ringToPolygons(segmentation.predictedRings)
+        return rings
+
+
+    def loadKerasModels(self):
+        """Load the rings and the pith models of the options and read the number of channels of their input. If
+        the inference server is used, the models are run by the server."""
+
+        ringsPath = os.path.join(self.ringsModelsPath, self.options['ringsModel'])
+        pithPath = os.path.join(self.pithModelsPath, self.options['pithModel'])
+        client = self.getInferenceClient()
+        if client:
+            self.ringsModel = client.getKerasModel(ringsPath)
+            self.pithModel = client.getKerasModel(pithPath)
+        else:
+            self.ringsModel = self.getKerasModel(ringsPath)
+            self.pithModel = self.getKerasModel(pithPath)
+        self.channel = self.pithModel.get_config()['layers'][0]['config']['batch_shape'][-1]
+
+
+    def getInputImage(self):
+        """Answer the image of the layer with a channel axis, converted to grayscale if the models expect one
+        channel."""
+
+        image = self.layer.data
+        if len(image.shape) == 2:
+            image = image[:, :, None]
+        if self.channel == 1 and image.shape[-1] == 3:
+            image = PreprocessingCache.getInstance().getGrayscale(self.layer)[:, :, None]
+        return image
+
+
+    def createSegmentation(self):
+        """Answer a TreeRingSegmentation with the inference and tracing options."""
+
+        from tree_ring_analyzer.segmentation import TreeRingSegmentation
+        settings = self.getInferenceSettings()
+        segmentation = TreeRingSegmentation()
+        segmentation.patchSize = settings['patchSize']
+        segmentation.overlap = settings['overlap']
+        segmentation.batchSize = settings['batchSize']
+        segmentation.lossType = self.options['lossType']
+        segmentation.resize = self.options['resize']
+        return segmentation
+
+
+    def getInferenceSettings(self):
+        """Answer the patch size, the overlap and the batch size used to predict the rings. If the option
+        inferenceSettings is 'auto' and the rings model has been calibrated on this machine with the patch size of
+        the options, the batch size found by the calibration is answered, otherwise the one of the options. The
+        patch size and the overlap are always those of the options, since they change the predictions."""
+
+        settings = {key: self.options[key] for key in ('patchSize', 'overlap', 'batchSize')}
+        if self.options['inferenceSettings'] == 'auto':
+            calibrated = self.options['autoSettings'].get(self.options['ringsModel'], {})
+            if 'batchSize' in calibrated and calibrated.get('patchSize') == settings['patchSize']:
+                settings['batchSize'] = calibrated['batchSize']
+        return settings
+
+
+    def predict(self, segmentation, image):
+        """Predict the distance map of the rings and the pith and create the outer mask of the disc. If the
+        prediction cache is enabled, the predictions are read from the cache or, when missing, stored in it as
+        float16 arrays. They are keyed by the hash of the image, the model files and the inference options, so that
+        the models don't have to be run again when only the tracing options change. Fresh predictions are rounded
+        to float16 as well, so that the rings do not depend on whether the cache was hit. If the option trunkROI is
+        set, the rings are only predicted in the region of interest of the trunk. If the distance map of the rings
+        has been set as ringPrediction, for example by a batch predicting the patches of several images together,
+        it is used instead of running the rings model. The contour and the center of the pith are computed from
+        the predictions in both cases."""
+
+        stage = self.instrumentation.stage
+        store = None
+        key = None
+        predictions = None
+        roi = None
+        if self.options['trunkROI']:
+            with stage('trunk roi'):
+                roi = self.getTrunkROI()
+        if self.options['cachePredictions']:
+            with stage('read predictions'):
+                store = CheckpointStore(self.predictionsFolder)
+                key = self.getPredictionsKey(store, roi)
+                predictions = store.load(key)
+        ringPrediction = self.ringPrediction
+        self.ringPrediction = None
+        if predictions:
+            with stage('outer mask'):
+                segmentation.shape = image.shape[0], image.shape[1]
+                segmentation.predictionRing = predictions['predictionRing'].astype(np.float32)
+                segmentation.createMask(image)
+                segmentation.pith = predictions['pith'].astype(np.float32)
+                segmentation.center = tuple(int(coordinate) for coordinate in predictions['center'])
+            with stage('postprocess pith'):
+                segmentation.postprocessPith()
+            yield
+            return
+        with stage('predict rings'):
+            if ringPrediction is not None:
+                segmentation.shape = image.shape[0], image.shape[1]
+                segmentation.predictionRing = ringPrediction
+            elif roi is None:
+                segmentation.predictionRing = segmentation.predictRing(self.ringsModel, image)
+            else:
+                segmentation.predictionRing = self.predictRingInROI(segmentation, image, roi)
+        yield
+        self.cancelToken.check()
+        with stage('outer mask'):
+            segmentation.createMask(image)
+        with stage('predict pith'):
+            segmentation.predictPith(self.pithModel, image)
+        if store:
+            with stage('write predictions'):
+                predictionRing = segmentation.predictionRing.astype(np.float16)
+                pith = segmentation.pith.astype(np.float16)
+                store.save(key, predictionRing=predictionRing, pith=pith, center=np.array(segmentation.center))
+                segmentation.predictionRing = predictionRing.astype(np.float32)
+                segmentation.pith = pith.astype(np.float32)
+        with stage('postprocess pith'):
+            segmentation.postprocessPith()
+        yield
+
+
+    def getTrunkROI(self):
+        """Answer the region of interest of the trunk as a mask in the downscaled image of the segment-trunk command
+        and the factor by which the mask is scaled down. The mask of the trunk is computed at the low resolution of
+        the segment-trunk command and dilated by the margin of the options."""
+
+        operation = SegmentTrunk(self.layer)
+        operation.applyAutoScale(self.layer.data.shape, self.layer.scale[0], self.layer.units[0])
+        scale = operation.options['scale']
+        image = PreprocessingCache.getInstance().getDownscaled(self.layer, scale,
+                                                               method=operation.options['downscaling'])
+        mask = operation.createLowResolutionMask(image)
+        if not mask.any():
+            mask = np.ones_like(mask)
+        mask = ndimage.distance_transform_edt(~mask) <= math.ceil(self.options['roiMargin'] / scale)
+        return mask, scale
+
+
+    def predictRingInROI(self, segmentation, image, roi):
+        """Predict the distance map of the rings only in the region of interest of the trunk. The image is cut into
+        the same patches as by predictRing, but only the patches intersecting the region of interest are cut out,
+        normalized with the minimum and the maximum of the whole image and given to the model. The other patches
+        are predicted as zero. Since the patches and their blending are the same, the prediction inside of the
+        region of interest is the one of predictRing."""
+
+        tiler, selected, tiles = self.getRingTiles(segmentation, image, roi)
+        self.instrumentation.options['roiPatches'] = [len(selected), len(tiler.layout)]
+        predicted = []
+        if selected:
+            predicted = self.ringsModel.predict(np.array(tiles), batch_size=segmentation.batchSize, verbose=0)
+            predicted = np.reshape(predicted, (len(selected), segmentation.patchSize, segmentation.patchSize))
+        return self.assembleRingPrediction(segmentation, tiler, selected, predicted)
+
+
+    def getRingTiles(self, segmentation, image, roi=None):
+        """Answer the tiler of the image, the indices of the patches to predict and the patches, normalized with the
+        minimum and the maximum of the whole image as by predictRing. With a region of interest, only the patches
+        intersecting it are answered, otherwise all patches."""
+
+        from tree_ring_analyzer.tiles.tiler import ImageTiler2D
+        segmentation.shape = image.shape[0], image.shape[1]
+        tiler = ImageTiler2D(segmentation.patchSize, segmentation.overlap, segmentation.shape)
+        selected = list(range(len(tiler.layout)))
+        if roi is not None:
+            mask, scale = roi
+            selected = []
+            for index, patch in enumerate(tiler.layout):
+                (top, left), (bottom, right) = patch.ul_corner, patch.lr_corner
+                if mask[top // scale:-(-bottom // scale), left // scale:-(-right // scale)].any():
+                    selected.append(index)
+        low, high = np.min(image), np.max(image)
+        tiles = []
+        for index in selected:
+            (top, left), (bottom, right) = tiler.layout[index].ul_corner, tiler.layout[index].lr_corner
+            tiles.append(self.normalize(image[top:bottom, left:right], low, high))
+        return tiler, selected, tiles
+
+
+    @classmethod
+    def assembleRingPrediction(cls, segmentation, tiler, selected, predicted):
+        """Answer the distance map of the rings blended from the predictions of the selected patches. The patches
+        that have not been selected are predicted as zero."""
+
+        predictions = [np.zeros((segmentation.patchSize, segmentation.patchSize), dtype=np.float32)] * len(tiler.layout)
+        for index, prediction in zip(selected, predicted):
+            predictions[index] = prediction
+        return tiler.tiles_to_image(predictions)
+
+
+    @classmethod
+    def normalize(cls, image, low, high):
+        """Answer the image as float32, normalized from the range low to high to 0 to 1 in the same way as the
+        tiles of predictRing."""
+
+        image = image.astype(np.float32)
+        if abs(high) < 1e-5 and abs(low) < 1e-5:
+            return image
+        if high - low > 1e-6:
+            image -= low
+            image /= high - low
+        else:
+            image /= high
+        return image
+
+
+    def getPredictionsKey(self, store, roi=None):
+        """Answer the key of the predictions for the current image, models and inference options. With a region of
+        interest, the key contains its mask and the margin around the trunk."""
+
+        settings = self.getInferenceSettings()
+        parts = [PreprocessingCache.getInstance().getImageHash(self.layer),
+                 'predictions',
+                 self.getModelFileId(os.path.join(self.ringsModelsPath, self.options['ringsModel'])),
+                 self.getModelFileId(os.path.join(self.pithModelsPath, self.options['pithModel'])),
+                 settings['patchSize'],
+                 settings['overlap'],
+                 self.options['resize']]
+        if roi is not None:
+            mask, scale = roi
+            parts.append((scale, self.options['roiMargin'], store.getArrayHash(mask)))
+        return store.getKey(*parts)
+
+
+    @classmethod
+    def getModelFileId(cls, path):
+        """Answer the name, the size and the modification time of the model file, so that a replaced model does
+        not use the predictions of the model it replaces."""
+
+        stat = os.stat(path)
+        return os.path.basename(path), stat.st_size, int(stat.st_mtime)
+
+
+    def segmentWithINBD(self):
+        """Segment the rings with the INBD model and answer them as polygons. The model is run on the image of the
+        layer, that is already in memory, unless the output of the model for the image has been set as inbdOutput,
+        for example by a batch running the model on several images at once."""
+
+        self.ringsModel = None
+        self.pithModel = None
+        with self.instrumentation.stage('load models'):
+            self.inbdModel = self.getINBDBackend()
+        self.instrumentation.options['modelFootprint'] = ModelRegistry.getInstance().getTotalFootprint()
+        yield
+        self.cancelToken.check()
+        with self.instrumentation.stage('inbd'):
+            if self.inbdOutput is not None:
+                output = self.inbdOutput
+                self.inbdOutput = None
+            else:
+                output = self.inbdModel.process(self.layer.data)
+        rings = []
+        for boundary in reversed(output.boundaries):
+            rings.append(list(boundary.boundarypoints * self.inbdModel.scale))
+        return rings
+
 
-            
     def removeInnerRing(self, ringPolygons, pithPolygons):
-        innerRingShapeList = Shapes([ringPolygons[-1]], shape_type='polygon')
-        pithShapeList = Shapes(pithPolygons, shape_type='polygon')
-        innerRingLabels = innerRingShapeList.to_masks(mask_shape=self.layer.data.shape[0:2])[0] * 1
-        pithLabels = pithShapeList.to_masks(mask_shape=self.layer.data.shape[0:2])[0] * 1
-        areaRing = len(innerRingLabels[innerRingLabels>0])
-        areaPith = len(pithLabels[pithLabels>0])
+        """Remove the innermost ring if its radius is too close to the radius of the pith. The radii are computed
+        from the areas of the polygons."""
+
+        areaRing = Polygons([ringPolygons[-1]]).getAreas()[0]
+        areaPith = Polygons(pithPolygons[0:1]).getAreas()[0]
         radiusRing = math.sqrt(areaRing) / math.pi
         radiusPith = math.sqrt(areaPith) / math.pi
         if radiusRing - radiusPith < self.minRadiusDeltaPithInnerRing:
@@ -307,52 +610,104 @@ class RingsSegmenter(Segmenter):
 
     @classmethod
     def ringToPolygons(cls, datas):
+        """Answer the contours as polygons of (row, column) vertices, the rings sorted by decreasing number of
+        vertices followed by the first contour."""
+
         len_data = [len(data) for data in datas]
         sort_leng_data = np.argsort(np.array(len_data)[1:])[::-1] + 1
-        rings = []
-        for po in sort_leng_data:
-            rings.append(list(datas[po][:, 0, ::-1]))
-        rings.append(list(datas[0][:, 0, ::-1]))
+        rings = Geometry.contoursToPolygons([datas[po] for po in sort_leng_data])
+        rings.append(Geometry.contourToPolygon(datas[0]))
         return rings
 
 
     @classmethod
     def maskToPolygons(cls, data):
+        """Answer the outer contours of the connected components of the mask, with their holes filled, as polygons
+        of (row, column) vertices. Each component is processed in its bounding box."""
+
         labels = measure.label(data)
         rings = []
-        maxLabel = np.max(labels)
-        for ring in range(1, maxLabel + 1):
-            mask = np.ndarray.copy(labels)
-            mask[mask < ring] = 0
-            mask[mask > ring] = 0
-            mask = (mask // ring) * 255
-            mask = mask.astype(np.uint8)
-            mask = ndimage.binary_fill_holes(mask)
-            mask = mask.astype(np.uint8)
-            contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            polys = [np.squeeze(e) for e in contours[0]]
-            changed = [np.array([y, x]) for x, y in polys]
-            rings.append(changed)
+        for ring, box in enumerate(ndimage.find_objects(labels), start=1):
+            rows = slice(max(box[0].start - 1, 0), box[0].stop + 1)
+            columns = slice(max(box[1].start - 1, 0), box[1].stop + 1)
+            mask = ndimage.binary_fill_holes(labels[rows, columns] == ring)
+            contours = Geometry.findOuterContours(mask, offset=(rows.start, columns.start))
+            rings.append(Geometry.contourToPolygon(contours[0]))
         return rings
 
 
     def measure(self):
-        """Measure the features on the shape layer and add them to the operations measurements."""
-        for label, shape in enumerate(reversed(self.resultsLayer.data)):
-            shapeLayer = Shapes([shape],
-                                   scale=self.layer.scale,
-                                   units=self.layer.units,
-                                   shape_type='polygon' )
-            shapeLayer.metadata['parent'] = self.layer
-            shapeLayer.metadata['parent_path'] = self.layer.metadata['path']
-            shapeLayer.name = 'pith and rings of ' + self.layer.name
-            objectType = "ring"
-            if label == 0:
-                objectType = "pith"
-            self.measureOp = MeasureShape(shapeLayer, object_type=objectType)
-            self.measureOp.do()
-            self.measureOp.addToTable(self.measurements)
-            self.measurements['label'][-1] = label
+        """Measure the features of the pith and of each ring and add them to the operations measurements. The
+        polygons are measured without creating a napari layer for each of them, by the number of workers and the
+        kind of pool given in the options."""
+
+        metadata = {'parent': self.resultsLayer.metadata['parent'], 'parent_path': self.layer.metadata['path']}
+        polygons = Polygons(list(reversed(self.resultsLayer.data)), scale=self.layer.scale, units=self.layer.units,
+                            metadata=metadata, name='pith and rings of ' + self.layer.name)
+        self.measureOp = MeasurePolygons(polygons, object_type="ring",
+                                         workers=self.options['measureWorkers'], pool=self.options['measurePool'])
+        self.measureOp.do()
+        self.measureOp.table['label'] = np.arange(len(polygons.data))
+        if len(polygons.data) > 0:
+            self.measureOp.table['object_type'][0] = "pith"
+        self.measureOp.addToTable(self.measurements)
+
+
+    @classmethod
+    def getKerasModel(cls, path):
+        """Answer the keras model stored under path. The model is loaded only once and then shared by all
+        segmenters, its predictions are run one at a time."""
+
+        def load():
+            import tensorflow as tf
+            return SerializedModel(tf.keras.models.load_model(path, compile=False))
+        return ModelRegistry.getInstance().get(('keras', path), load)
+
+
+    @classmethod
+    def getINBDModel(cls, path, threads=0, optimize=False, compile=False):
+        """Answer the INBD model stored in the torch package under path, optimized for the cpu as requested. The
+        model is loaded only once for each optimization and then shared by all segmenters."""
+
+        def load():
+            return INBDBackend.load(path, threads=threads, optimize=optimize, compile=compile)
+        return ModelRegistry.getInstance().get(('inbd', path, threads, optimize, compile), load)
+
+
+    def getINBDBackend(self):
+        """Answer a backend running the selected INBD model with the optimizations of the options, in this
+        process or, if the inference server is used, in the server."""
+
+        path = os.path.join(self.inbdModelsPath, self.options['inbdModel'])
+        client = self.getInferenceClient()
+        getModel = client.getINBDModel if client else self.getINBDModel
+        return INBDBackend(getModel(path, threads=self.options['inbdThreads'], optimize=self.options['inbdOptimize'],
+                                    compile=self.options['inbdCompile']))
+
+
+    def release(self):
+        """Drop the models of the segmenter and remove all models from the registry, clearing the keras session
+        and the cache of torch. The models of running segmenters are kept. The models are loaded again by the next
+        run."""
+
+        self.ringsModel = None
+        self.pithModel = None
+        self.inbdModel = None
+        return ModelRegistry.getInstance().release()
+
+
+    def getInferenceClient(self):
+        """Answer the client of the inference server if the option inferenceServer is set and the server is
+        running, otherwise None. Without a server, the models are loaded in this process."""
+
+        if not self.options['inferenceServer']:
+            return None
+        from napari_tree_rings.image.server import InferenceClient
+        try:
+            return InferenceClient.getInstance()
+        except ConnectionError as error:
+            logging.getLogger("napari_tree_rings").warning("%s, the models are run in this process", error)
+            return None
 
 
     def loadModels(self, pathModel, typeKey):
@@ -388,7 +743,7 @@ class RingsSegmenter(Segmenter):
         if not os.path.exists(self.optionsPath):
             self.saveOptions()
         with open(self.optionsPath) as f:
-            self.options = json.load(f)
+            self.options.update(json.load(f))
 
 
     def saveOptions(self):
@@ -398,7 +753,13 @@ class RingsSegmenter(Segmenter):
 
 class BatchSegmentTrunk:
     """Run the trunk segmentation on all tiff-images in a given folder and save the control shapes and the
-    measurements into an output folder."""
+    measurements into an output folder. A manifest, listing the processed images with the time used by each stage,
+    is written to the output folder after each image."""
+
+
+    manifestFilename = "_manifest.csv"
+    reportFilename = "_run_report.csv"
+
 
     def __init__(self, sourceFolder, outputFolder):
         self.sourceFolder = sourceFolder
@@ -406,46 +767,217 @@ class BatchSegmentTrunk:
         self.measurements =  {}
         self.segmenter = None
         self.ringSegmenter = None
+        self.cancelToken = CancelToken()
+        self.manifest = []
+        self.report = []
+        self.writeManifest = True
 
 
-    def runBatch(self):
-        """Run the batch trunk segmentation."""
+    def cancel(self):
+        """Stop the batch after the image that is currently processed."""
+
+        self.cancelToken.cancel()
 
-        imageFileNames = os.listdir(self.sourceFolder)
+
+    def runBatch(self):
+        """Run the batch trunk segmentation. Yield the number of processed images after each image. If the batch is
+        cancelled, it stops after the current image. If the rings are segmented with INBD and the option
+        inbdBatchSize is larger than one, the images are read in groups of that size and the INBD model is run on
+        the images of a group together. If they are segmented with the Attention UNet and the option imagesPerBatch
+        is larger than one, the patches of the images of a group are predicted together in full batches.
+
+        The images are the files matching the option filePatterns in the source folder and, if the option
+        recursive is set, in its sub-folders, see BatchDiscovery. The results of an image in a sub-folder are
+        saved in the same sub-folder of the output folder. The images are processed largest first. Files that are
+        not tiff images are skipped. An image that can not be read or segmented is recorded as failed in the run
+        report and the batch continues with the next image. If the option isolateImages is set, the images are
+        processed by batchWorkers supervised worker processes, a worker is stopped if it exceeds the time limit
+        imageTimeout or the memory limit imageMemoryLimit, see IsolatedBatchRunner."""
+
+        self.cancelToken.reset()
         self.segmenter = None
+        self.manifest = []
+        self.report = []
+        self.ringSegmenter = RingsSegmenter(None)
+        options = self.ringSegmenter.options
+        discovery = BatchDiscovery(self.sourceFolder, options['filePatterns'], options['recursive'])
+        discovery.fitCostModel(os.path.join(self.outputFolder, self.manifestFilename))
+        discovery.run()
+        for rejected in discovery.rejected:
+            self.addToReport(rejected['path'], rejected['status'], 0, rejected['error'])
+        imageFileNames = [image['path'] for image in discovery.images]
         if not imageFileNames:
             return
-        
-        self.ringSegmenter = RingsSegmenter(None)
+        workers = max(1, options['batchWorkers']) if options['isolateImages'] else 1
+        logging.getLogger("napari_tree_rings").info("%d images, estimated time %.0f s",
+                                                    len(imageFileNames), discovery.estimateMakespan(workers))
+
         self.segmenter = TrunkSegmenter(None)
-        for imageFilename in imageFileNames:
-            path = os.path.join(self.sourceFolder, imageFilename)
-            img = tiff.imread(path)
-            imageLayer = Image(np.array(img))
-            imageLayer.metadata['path'] = path
-            imageLayer.name = imageFilename
-            imageLayer.metadata['name'] = imageFilename
+        if options['isolateImages']:
+            from napari_tree_rings.image.isolation import IsolatedBatchRunner
+            yield from IsolatedBatchRunner(self, workers).run(imageFileNames)
+            return
+        isINBD = self.ringSegmenter.options['method'] == 'INBD'
+        groupSize = max(1, self.ringSegmenter.options['inbdBatchSize' if isINBD else 'imagesPerBatch'])
+        index = 0
+        for start in range(0, len(imageFileNames), groupSize):
+            images = []
+            for imageFilename in imageFileNames[start:start + groupSize]:
+                if self.cancelToken.isCancelled():
+                    return
+                instrumentation = Instrumentation('batch')
+                try:
+                    with instrumentation.stage('read'):
+                        imageLayer = self.readImage(imageFilename)
+                except Exception as error:
+                    self.addFailureToReport(imageFilename, instrumentation, error)
+                    index = index + 1
+                    yield index
+                    continue
+                instrumentation.image = imageFilename
+                instrumentation.shape = list(imageLayer.data.shape)
+                images.append((imageLayer, instrumentation))
+            outputs = [None] * len(images)
+            ringPredictions = [None] * len(images)
+            try:
+                if len(images) > 1 and isINBD:
+                    outputs = self.runINBDOnGroup([imageLayer for imageLayer, _ in images])
+                elif len(images) > 1:
+                    ringPredictions = self.predictRingsOnGroup([imageLayer for imageLayer, _ in images])
+            except Exception as error:
+                logging.getLogger("napari_tree_rings").warning("the group failed, its images are processed one "
+                                                               "by one: %s", error)
+            for (imageLayer, instrumentation), output, ringPrediction in zip(images, outputs, ringPredictions):
+                if self.cancelToken.isCancelled():
+                    return
+                try:
+                    self.processImage(imageLayer, instrumentation, output, ringPrediction)
+                    self.addToReport(imageLayer.name, 'done', self.manifest[-1]['seconds'], '',
+                                     instrumentation.getStageTimes())
+                except Exception as error:
+                    self.addFailureToReport(imageLayer.name, instrumentation, error)
+                    self.ringSegmenter.releaseImage()
+                    self.segmenter.releaseImage()
+                index = index + 1
+                yield index
 
+        # time = str(datetime.datetime.now())
+        # tablePath = os.path.join(self.outputFolder, time + "_trunk-measurements.csv")
+
+
+    def addFailureToReport(self, imageFilename, instrumentation, error):
+        """Record in the run report that the image has failed with the error."""
+
+        logging.getLogger("napari_tree_rings").warning("%s failed: %s", imageFilename, error)
+        seconds = time.perf_counter() - instrumentation.startTime
+        self.addToReport(imageFilename, 'failed', seconds, "{}: {}".format(type(error).__name__, error),
+                         instrumentation.getStageTimes())
+
+
+    def addToReport(self, imageFilename, status, seconds, error='', stageTimes=None):
+        """Add a row with the status of the image, done, failed, timeout, memory or skipped, to the run report and
+        write the run report. The stage_times column contains the times in seconds of the stages of the batch
+        that have been run on the image as json, including the stage that failed."""
+
+        stageTimes = {stage: round(stageSeconds, 6) for stage, stageSeconds in (stageTimes or {}).items()}
+        self.report.append({'image': imageFilename, 'status': status, 'seconds': round(seconds, 6), 'error': error,
+                            'stage_times': json.dumps(stageTimes)})
+        pd.DataFrame(self.report, columns=['image', 'status', 'seconds', 'error', 'stage_times']).to_csv(
+            os.path.join(self.outputFolder, self.reportFilename), index=False)
+
+
+    def readImage(self, imageFilename):
+        """Read the image file from the source folder into an image layer."""
+
+        path = os.path.join(self.sourceFolder, imageFilename)
+        img = tiff.imread(path)
+        imageLayer = Image(np.array(img))
+        imageLayer.metadata['path'] = path
+        imageLayer.name = imageFilename
+        imageLayer.metadata['name'] = imageFilename
+        return imageLayer
+
+
+    def runINBDOnGroup(self, imageLayers):
+        """Run the INBD model on the images of the layers together and answer its outputs in the same order. The
+        time is reported by an instrumentation of its own."""
+
+        instrumentation = Instrumentation('inbd batch')
+        instrumentation.image = ", ".join(imageLayer.name for imageLayer in imageLayers)
+        with instrumentation.stage('load models'):
+            model = self.ringSegmenter.getINBDBackend()
+        with instrumentation.stage('inbd'):
+            outputs = model.processBatch([imageLayer.data for imageLayer in imageLayers])
+        instrumentation.finish()
+        return outputs
+
+
+    def predictRingsOnGroup(self, imageLayers):
+        """Predict the distance maps of the rings of the images of the layers with the Attention UNet, putting the
+        patches of all images together into full batches, and answer them in the same order. Images whose
+        predictions are in the prediction cache are not predicted again, None is answered for them. The time is
+        reported by an instrumentation of its own."""
+
+        segmenter = self.ringSegmenter
+        segmenter.loadOptions()
+        instrumentation = Instrumentation('rings batch')
+        instrumentation.image = ", ".join(imageLayer.name for imageLayer in imageLayers)
+        with instrumentation.stage('load models'):
+            segmenter.loadKerasModels()
+        scheduler = PatchScheduler(segmenter.ringsModel, segmenter.getInferenceSettings()['batchSize'])
+        jobs = []
+        with instrumentation.stage('tiles'):
+            store = CheckpointStore(segmenter.predictionsFolder) if segmenter.options['cachePredictions'] else None
+            for imageLayer in imageLayers:
+                segmenter.layer = imageLayer
+                roi = segmenter.getTrunkROI() if segmenter.options['trunkROI'] else None
+                if store and store.contains(segmenter.getPredictionsKey(store, roi)):
+                    jobs.append(None)
+                    continue
+                segmentation = segmenter.createSegmentation()
+                tiler, selected, tiles = segmenter.getRingTiles(segmentation, segmenter.getInputImage(), roi)
+                jobs.append((segmentation, tiler, selected, scheduler.add(tiles)))
+        with instrumentation.stage('predict rings'):
+            predicted = scheduler.run()
+        instrumentation.options = {'patches': scheduler.getNumberOfPatches(), 'batches': scheduler.numberOfBatches}
+        with instrumentation.stage('blend'):
+            predictions = [None if job is None
+                           else segmenter.assembleRingPrediction(job[0], job[1], job[2], predicted[job[3]])
+                           for job in jobs]
+        instrumentation.finish()
+        return predictions
+
+
+    def processImage(self, imageLayer, instrumentation, inbdOutput=None, ringPrediction=None):
+        """Segment and measure the rings and the trunk in the image and save the shapes and the measurements. The
+        output of the INBD model or the distance map of the rings can be given if they have been computed for a
+        group of images."""
+
+        imageFilename = imageLayer.name
+        with instrumentation.stage('rings'):
             self.ringSegmenter.layer = imageLayer
             self.ringSegmenter.measurements = dict()
-            self.ringSegmenter.setPixelSizeAndUnit()
-            self.ringSegmenter.segment()
-            self.ringSegmenter.measure()
+            self.ringSegmenter.inbdOutput = inbdOutput
+            self.ringSegmenter.ringPrediction = ringPrediction
+            for _ in self.ringSegmenter.run():
+                pass
             df = pd.DataFrame(self.ringSegmenter.measurements)
 
+        with instrumentation.stage('trunk'):
             self.segmenter.layer = imageLayer
             self.segmenter.measurements = dict()
-            self.segmenter.setPixelSizeAndUnit()
-            self.segmenter.segment()
-            self.segmenter.measure()
+            for _ in self.segmenter.run():
+                pass
             df = pd.concat([df, pd.DataFrame(self.segmenter.measurements)], ignore_index=True)
 
+        with instrumentation.stage('save'):
             # self.measurements = self.segmenter.measurements
             # TableTool.addTableAToB(self.ringSegmenter.measurements, self.measurements)
             csvFilename = os.path.splitext(imageFilename)[0] + ".csv"
             csvRingsFilename = os.path.splitext(imageFilename)[0] + "_rings.csv"
             path = os.path.join(self.outputFolder, csvFilename)
             ringsPath = os.path.join(self.outputFolder, csvRingsFilename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
             self.segmenter.shapeLayer.save(path)
             self.ringSegmenter.resultsLayer.save(ringsPath)
             # yield self.measurements
@@ -458,6 +990,31 @@ class BatchSegmentTrunk:
             ## 
 
             df.to_csv(os.path.join(self.outputFolder, os.path.splitext(imageFilename)[0] + '_parameters.csv'))
-
-        # time = str(datetime.datetime.now())
-        # tablePath = os.path.join(self.outputFolder, time + "_trunk-measurements.csv")
\ No newline at end of file
+        record = instrumentation.finish()
+        self.addToManifest(imageLayer, record,
+                           [instrumentation, self.ringSegmenter.instrumentation, self.segmenter.instrumentation])
+        self.ringSegmenter.releaseImage()
+        self.segmenter.releaseImage()
+
+
+    def addToManifest(self, imageLayer, record, instrumentations):
+        """Add a row for the image to the manifest and write the manifest. The stage_times column contains the
+        times in seconds of the stages of the given instrumentations as json, keyed by operation and stage name."""
+
+        stageTimes = {}
+        for instrumentation in instrumentations:
+            for stage, seconds in instrumentation.getStageTimes().items():
+                stageTimes[instrumentation.operation + "." + stage] = round(seconds, 6)
+        self.manifest.append({'image': imageLayer.name,
+                              'path': imageLayer.metadata['path'],
+                              'shape': "x".join(str(length) for length in imageLayer.data.shape),
+                              'seconds': round(record['seconds'], 6),
+                              'stage_times': json.dumps(stageTimes)})
+        if self.writeManifest:
+            self.saveManifest()
+
+
+    def saveManifest(self):
+        """Write the manifest to the output folder."""
+
+        pd.DataFrame(self.manifest).to_csv(os.path.join(self.outputFolder, self.manifestFilename), index=False)
@@ -1,4 +1,5 @@
 import os
+import math
 import appdirs
 import abc
 
@@ -9,10 +10,12 @@ from skimage.transform import rescale, resize
 from scipy.ndimage import gaussian_filter
 from skimage.filters import threshold_mean
 from skimage.color import rgb2gray
-from scipy.ndimage import binary_fill_holes
+from scipy.ndimage import binary_fill_holes, distance_transform_edt
 from skimage import morphology
 import cv2
 import numpy as np
+from napari_tree_rings.array_util import ArrayUtil
+from napari_tree_rings.image.geometry import Geometry
 from shapelysmooth import taubin_smooth
 from skimage.morphology import convex_hull_image
 
@@ -86,6 +89,9 @@ class Operation(object):
             content = file.readlines()
         lines = content[0].split(' ')
         for line in lines:
+            line = line.strip()
+            if not line:
+                continue
             if '=' in line:
                 parts = line.split("=")
                 options[parts[0].strip()] = type(default[parts[0].strip()])(parts[1].strip())
@@ -141,10 +147,53 @@ class SegmentTrunk(Operation):
     def getDefaultOptions(cls):
         """Answer the default options of the segment-trunk command."""
 
-        options = {'scale': 8, 'opening': 96}
+        options = {'scale': 8, 'opening': 96, 'checkpoints': False, 'downscaling': 'rescale',
+                   'autoScale': False, 'workingMegapixels': 2.0, 'openingRadius': 15.0,
+                   'hull': 'image', 'vertexSpacing': 8.0}
         return options
 
 
+    def applyAutoScale(self, shape, pixelSize=1, unit='pixel'):
+        """If the automatic scale is enabled, replace the scale and the opening radius in the options by the values
+        computed for an image of the given shape and pixel size, so that the image is processed at about
+        workingMegapixels and the opening has a radius of openingRadius millimetres. If the image is not calibrated,
+        the opening keeps the size it has with the fixed scale, in pixels of the full image. The options are not
+        saved."""
+
+        if not self.options['autoScale']:
+            return
+        scale = self.getAutoScale(shape, self.options['workingMegapixels'])
+        millimetresPerPixel = self.getPixelSizeInMillimetres(pixelSize, unit)
+        if millimetresPerPixel is None:
+            radius = self.options['opening'] * self.options['scale']
+        else:
+            radius = self.options['openingRadius'] / millimetresPerPixel
+        self.options['scale'] = scale
+        self.options['opening'] = max(1, int(round(radius / scale)))
+
+
+    @classmethod
+    def getAutoScale(cls, shape, workingMegapixels):
+        """Answer the integer factor by which an image of the given shape has to be scaled down to have about
+        workingMegapixels megapixels."""
+
+        pixels = shape[0] * shape[1]
+        return max(1, int(round(math.sqrt(pixels / (workingMegapixels * 1e6)))))
+
+
+    @classmethod
+    def getPixelSizeInMillimetres(cls, pixelSize, unit):
+        """Answer the pixel size in millimetres or None if the unit is not a length, for example for images
+        without calibration."""
+
+        import pint
+        registry = pint.get_application_registry()
+        try:
+            return registry.Quantity(pixelSize, str(unit)).to('millimeter').magnitude
+        except (pint.errors.PintError, ValueError, AttributeError):
+            return None
+
+
     @classmethod
     def convertImage(cls, image):
         result = None
@@ -156,7 +205,19 @@ class SegmentTrunk(Operation):
 
 
     def scaleDownImage(self, image):
-        result = rescale(image, 1.0 / self.options['scale'], anti_aliasing=True)
+        return self.downscale(image, self.options['scale'], self.options['downscaling'])
+
+
+    @classmethod
+    def downscale(cls, image, factor, method='rescale'):
+        """Answer the image scaled down by the given factor. With the method 'mean' and an integer factor, each
+        pixel of the result is the mean of a block of factor x factor pixels, computed in float32 and in chunks of
+        rows. Otherwise the image is smoothed with a gaussian and interpolated by rescale."""
+
+        if method == 'mean' and float(factor).is_integer():
+            result = ArrayUtil.blockMean(image, int(factor))
+        else:
+            result = rescale(image, 1.0 / factor, anti_aliasing=True)
         result = np.squeeze(result)
         return result
 
@@ -175,13 +236,39 @@ class SegmentTrunk(Operation):
 
 
     def morphoOpenImage(self, image):
-        se = morphology.disk(self.options['opening'])
-        opened = morphology.binary.binary_opening(image, se)
+        opened = self.binaryOpening(image, self.options['opening'])
         if len(np.unique(opened)) == 1:
             opened = image / 255
         return opened
 
 
+    @classmethod
+    def binaryOpening(cls, image, radius):
+        """Answer the opening of the mask with a disk of the given radius. The result is the same as the one of
+        binary_opening with morphology.disk(radius), but is computed from distance transforms, since the memory and
+        time needed by binary_opening grow with the square of the size of the disk."""
+
+        border = radius + 1
+        mask = np.pad(np.asarray(image) > 0, border, constant_values=True)
+        if mask.all():
+            return np.ones(np.shape(image), dtype=bool)
+        eroded = distance_transform_edt(mask)[border:-border, border:-border] > radius
+        if not eroded.any():
+            return eroded
+        opened = distance_transform_edt(~eroded) <= radius
+        return opened
+
+
+    def createLowResolutionMask(self, image):
+        """Answer the mask of the trunk in the downscaled grayscale image, thresholded, reduced to the largest
+        region, filled and opened as in the segment-trunk command."""
+
+        mask = self.meanThresholdImage(image)
+        mask = self.keep_largest_region(mask)
+        mask = self.fillHolesImage(mask)
+        return self.morphoOpenImage(mask) > 0
+
+
     @classmethod
     def scaleUpMask(cls, image, shape):
         out = resize(image, shape) * 1
@@ -204,12 +291,29 @@ class SegmentTrunk(Operation):
         return chull
 
 
+    @classmethod
+    def convexHullPolygon(cls, image):
+        """Answer the convex hull of the mask as an (N, 2) array of (row, column) vertices. The hull is computed on
+        the vertices of the outer contours of the mask, so that no image of the size of the mask is created for it."""
+
+        contours = Geometry.findOuterContours(image)
+        hull = cv2.convexHull(np.concatenate(contours))
+        return Geometry.contourToPolygon(hull)
+
+
+    def createShapesFromPolygon(self, polygon):
+        """Answer a shapes layer with the polygon, resampled with the vertex spacing of the options and smoothed."""
+
+        resampled = Geometry.resamplePolygon(polygon, self.options['vertexSpacing'])
+        smoothed = [np.array(taubin_smooth(resampled))]
+        result = Shapes(smoothed, shape_type='polygon')
+        return result
+
+
     @classmethod
     def createShapes(cls, image):
-        contours, hierarchy = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        polys = [np.squeeze(e) for e in contours[0]]
-        changed = [np.array([y, x]) for x, y in polys]
-        smoothed = [np.array(taubin_smooth(changed))]
+        contours = Geometry.findOuterContours(image)
+        smoothed = [np.array(taubin_smooth(Geometry.contourToPolygon(contours[0])))]
         result = Shapes(smoothed, shape_type='polygon')
         return result
 
@@ -221,6 +325,7 @@ class SegmentTrunk(Operation):
         self.options = self.readOptions()
         image = self.layer.data
         shape = image.shape
+        self.applyAutoScale(shape, self.layer.scale[0], self.layer.units[0])
         image = self.convertImage(image)
         image = self.scaleDownImage(image)
         image = self.meanThresholdImage(image)
@@ -229,8 +334,12 @@ class SegmentTrunk(Operation):
         image = self.morphoOpenImage(image)
         image = self.scaleUpMask(image, shape)
         image = self.morphoErodeImage(image)
-        image = self.convexHullImage(image)
-        self.result = self.createShapes(image)
+        if self.options['hull'] == 'image':
+            image = self.convexHullImage(image)
+            self.result = self.createShapes(image)
+        else:
+            polygon = self.convexHullPolygon(image)
+            self.result = self.createShapesFromPolygon(polygon)
 
 
     @classmethod
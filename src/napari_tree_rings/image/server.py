@@ -0,0 +1,320 @@
+import os
+import sys
+import secrets
+import argparse
+import threading
+from types import SimpleNamespace
+from multiprocessing import shared_memory, resource_tracker, AuthenticationError
+from multiprocessing.managers import BaseManager
+import numpy as np
+
+
+
+class InferenceService(object):
+    """Run the models of the rings segmentation for the clients of an inference server. The models are loaded once
+    by the server process and shared by all clients. The images are given to the service in shared memory blocks
+    created by the clients, the results are answered as arrays or, for INBD, as plain namespaces of arrays, so
+    that the clients do not need the classes of the models."""
+
+
+    instance = None
+    instanceLock = threading.Lock()
+
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def getInstance(cls):
+        """Answer the service of the server process. The service is created on the first call."""
+
+        with cls.instanceLock:
+            if not cls.instance:
+                cls.instance = InferenceService()
+        return cls.instance
+
+
+    def ping(self):
+        """Answer the process id of the server."""
+
+        return os.getpid()
+
+
+    def getConfig(self, path):
+        """Answer the configuration of the keras model under path."""
+
+        return self.getKerasModel(path).get_config()
+
+
+    def predict(self, path, batchSize, name, shape, dtype):
+        """Answer the predictions of the keras model under path, in batches of batchSize, for the patches in the
+        shared memory block with the given name, shape and dtype."""
+
+        tiles = self.readSharedArray(name, shape, dtype)
+        model = self.getKerasModel(path)
+        with self.lock:
+            return np.asarray(model.predict(tiles, batch_size=batchSize, verbose=0))
+
+
+    def getINBDScale(self, path, threads, optimize, compile):
+        """Answer the scale of the INBD model under path."""
+
+        return self.getINBDModel(path, threads, optimize, compile).scale
+
+
+    def processImage(self, path, threads, optimize, compile, name, shape, dtype):
+        """Answer the boundaries found by the INBD model under path in the image in the shared memory block with
+        the given name, shape and dtype, or in the image file name if shape is None. The image in shared memory has
+        already been converted by the client with INBDBackend.toInput."""
+
+        from napari_tree_rings.image.inbd import INBDBackend
+        backend = INBDBackend(self.getINBDModel(path, threads, optimize, compile))
+        with self.lock:
+            if shape is None:
+                output = backend.process(name)
+            else:
+                output = backend.processInput(self.readSharedArray(name, shape, dtype))
+        return SimpleNamespace(boundaries=[SimpleNamespace(boundarypoints=np.asarray(boundary.boundarypoints))
+                                           for boundary in output.boundaries])
+
+
+    @classmethod
+    def getKerasModel(cls, path):
+        from napari_tree_rings.image.process import RingsSegmenter
+        return RingsSegmenter.getKerasModel(path)
+
+
+    @classmethod
+    def getINBDModel(cls, path, threads, optimize, compile):
+        from napari_tree_rings.image.process import RingsSegmenter
+        return RingsSegmenter.getINBDModel(path, threads=threads, optimize=optimize, compile=compile)
+
+
+    @classmethod
+    def readSharedArray(cls, name, shape, dtype):
+        """Answer a copy of the array in the shared memory block. The block is not tracked by the server, since it
+        is owned and removed by the client."""
+
+        memory = shared_memory.SharedMemory(name=name)
+        try:
+            if sys.version_info < (3, 13):
+                resource_tracker.unregister(memory._name, 'shared_memory')
+            return np.ndarray(shape, dtype=dtype, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+
+
+
+class InferenceServerManager(BaseManager):
+    """The multiprocessing manager of the inference server."""
+
+
+
+class InferenceClientManager(BaseManager):
+    """The multiprocessing manager connecting a client to the inference server."""
+
+
+
+InferenceServerManager.register('getService', callable=InferenceService.getInstance)
+InferenceClientManager.register('getService')
+
+
+
+class InferenceServer(object):
+    """A long-lived local process holding the models of the rings segmentation, that napari sessions and batch jobs
+    on the same workstation can share instead of each loading their own copies. The server listens on a unix
+    socket in the user data folder, or on a port of localhost on windows. The clients authenticate with a key
+    stored in the user data folder, that only the user can read."""
+
+
+    port = 50777
+
+
+    @classmethod
+    def getDataFolder(cls):
+        import appdirs
+        return appdirs.user_data_dir("napari-tree-rings")
+
+
+    @classmethod
+    def getAddress(cls):
+        """Answer the default address of the server."""
+
+        if os.name == 'nt':
+            return ('127.0.0.1', cls.port)
+        return os.path.join(cls.getDataFolder(), "inference.sock")
+
+
+    @classmethod
+    def getAuthKeyPath(cls):
+        return os.path.join(cls.getDataFolder(), "inference.key")
+
+
+    @classmethod
+    def getAuthKey(cls):
+        """Answer the key with which the clients authenticate. The key is created on the first call."""
+
+        path = cls.getAuthKeyPath()
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, 'w') as aFile:
+                aFile.write(secrets.token_hex(32))
+        with open(path) as aFile:
+            return aFile.read().strip().encode()
+
+
+    @classmethod
+    def create(cls, address=None, authkey=None):
+        """Answer the server of a new inference service, that is run by calling its serve_forever method. Raise a
+        RuntimeError if a server is already running at the address. The socket file left by a server that has
+        been killed is removed."""
+
+        address = cls.getAddress() if address is None else address
+        authkey = cls.getAuthKey() if authkey is None else authkey
+        if cls.isRunning(address, authkey):
+            raise RuntimeError("an inference server is already running at {}".format(address))
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        return InferenceServerManager(address=address, authkey=authkey).get_server()
+
+
+    @classmethod
+    def isRunning(cls, address=None, authkey=None):
+        """Answer whether a server answers at the address, even if it does not accept the key."""
+
+        try:
+            InferenceClient(address, authkey)
+        except ConnectionError:
+            return False
+        except AuthenticationError:
+            return True
+        return True
+
+
+    @classmethod
+    def serve(cls, address=None):
+        """Run an inference server until the process is stopped."""
+
+        server = cls.create(address)
+        print("inference server listening on", server.address)
+        server.serve_forever()
+
+
+
+class InferenceClient(object):
+    """A connection to an inference server. The clients are shared per address."""
+
+
+    clients = {}
+    clientsLock = threading.Lock()
+
+
+    def __init__(self, address=None, authkey=None):
+        """Connect to the inference server at the address. Raise a ConnectionError if it is not running."""
+
+        super().__init__()
+        self.address = InferenceServer.getAddress() if address is None else address
+        authkey = InferenceServer.getAuthKey() if authkey is None else authkey
+        manager = InferenceClientManager(address=self.address, authkey=authkey)
+        try:
+            manager.connect()
+        except (OSError, EOFError) as error:
+            raise ConnectionError("no inference server at {}".format(self.address)) from error
+        self.service = manager.getService()
+
+
+    @classmethod
+    def getInstance(cls, address=None, authkey=None):
+        """Answer the client connected to the server at the address, connecting on the first call."""
+
+        address = InferenceServer.getAddress() if address is None else address
+        key = tuple(address) if isinstance(address, list) else address
+        with cls.clientsLock:
+            if key not in cls.clients:
+                cls.clients[key] = InferenceClient(address, authkey)
+            return cls.clients[key]
+
+
+    def getKerasModel(self, path):
+        """Answer a stand-in for the keras model under path, that is run by the server."""
+
+        return RemoteModel(self, path)
+
+
+    def getINBDModel(self, path, threads=0, optimize=False, compile=False):
+        """Answer a stand-in for the INBD model under path, that is run by the server."""
+
+        return RemoteINBDModel(self, path, threads, optimize, compile)
+
+
+    def call(self, method, array, *arguments):
+        """Copy the array into a shared memory block, call the method of the service with the arguments followed by
+        the name, the shape and the dtype of the block and answer its result. The block is removed afterwards."""
+
+        array = np.ascontiguousarray(array)
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        try:
+            buffer = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+            buffer[:] = array
+            del buffer
+            return getattr(self.service, method)(*arguments, memory.name, array.shape, array.dtype.str)
+        finally:
+            memory.close()
+            memory.unlink()
+
+
+
+class RemoteModel(object):
+    """Stands in for a keras model run by an inference server."""
+
+
+    def __init__(self, client, path):
+        super().__init__()
+        self.client = client
+        self.path = path
+
+
+    def get_config(self):
+        return self.client.service.getConfig(self.path)
+
+
+    def predict(self, tiles, batch_size=8, verbose=0):
+        return self.client.call('predict', np.asarray(tiles), self.path, batch_size)
+
+
+
+class RemoteINBDModel(object):
+    """Stands in for an INBD model run by an inference server."""
+
+
+    def __init__(self, client, path, threads=0, optimize=False, compile=False):
+        super().__init__()
+        self.client = client
+        self.arguments = (path, threads, optimize, compile)
+        self.scale = client.service.getINBDScale(*self.arguments)
+
+
+    def process_image(self, image):
+        if isinstance(image, str):
+            return self.client.service.processImage(*self.arguments, image, None, None)
+        return self.client.call('processImage', image, *self.arguments)
+
+
+
+def main(arguments=None):
+    """Run an inference server from the command line."""
+
+    parser = argparse.ArgumentParser(description="Run a local inference server, that holds the models of the "
+                                                 "rings segmentation for all napari sessions and batch jobs.")
+    parser.add_argument('--address', default=None, help="unix socket of the server, by default in the user data "
+                                                        "folder")
+    parsed = parser.parse_args(arguments)
+    InferenceServer.serve(parsed.address)
+
+
+
+if __name__ == "__main__":
+    main()
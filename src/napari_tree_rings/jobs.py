@@ -0,0 +1,174 @@
+import os
+from qtpy.QtCore import QObject, Signal
+from napari.qt.threading import create_worker
+from napari_tree_rings.image.checkpoint import CancelToken
+
+
+
+class SegmentationJob(object):
+    """A job segmenting the trunk and the rings of one image. The image is either given as an image-layer or as
+    the path of a tiff-file, that is read when the job runs."""
+
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    numberOfSteps = 24
+
+
+    def __init__(self, layer=None, path=None):
+        """Create a job for the given image-layer or, if no layer is given, for the tiff-file under path."""
+
+        super().__init__()
+        self.layer = layer
+        self.path = path
+        if layer is not None:
+            self.path = layer.metadata['path']
+        self.name = os.path.basename(self.path) if layer is None else layer.name
+        self.status = SegmentationJob.QUEUED
+        self.worker = None
+        self.trunkSegmenter = None
+        self.ringsSegmenter = None
+        self.cancelToken = CancelToken()
+
+
+    def run(self):
+        """Read the image if necessary, then segment the trunk and the rings. Yield between the steps to allow to
+        display the progress and to cancel the job."""
+
+        from napari_tree_rings.image.process import TrunkSegmenter, RingsSegmenter
+        yield
+        self.cancelToken.check()
+        if self.layer is None:
+            self.layer = self.readLayer()
+        yield
+        self.trunkSegmenter = TrunkSegmenter(self.layer)
+        self.trunkSegmenter.cancelToken = self.cancelToken
+        yield from self.trunkSegmenter.run()
+        self.ringsSegmenter = RingsSegmenter(self.layer)
+        self.ringsSegmenter.cancelToken = self.cancelToken
+        yield from self.ringsSegmenter.run()
+
+
+    def readLayer(self):
+        """Read the image from the tiff-file of the job and answer an image-layer containing it."""
+
+        import tifffile as tiff
+        from napari.layers import Image
+        layer = Image(tiff.imread(self.path), name=self.name)
+        layer.metadata['path'] = self.path
+        layer.metadata['name'] = self.name
+        return layer
+
+
+    def releaseImage(self):
+        """Drop the references of the job and of its segmenters to the image, once the results have been taken
+        over. The image stays in memory as long as it is displayed."""
+
+        self.layer = None
+        for segmenter in (self.trunkSegmenter, self.ringsSegmenter):
+            if segmenter is not None:
+                segmenter.releaseImage()
+
+
+    def isDone(self):
+        """Answer whether the job has terminated, successfully or not."""
+
+        return self.status in (SegmentationJob.FINISHED, SegmentationJob.FAILED, SegmentationJob.CANCELLED)
+
+
+    def __str__(self):
+        return self.name + " (" + self.status + ")"
+
+
+
+class JobScheduler(QObject):
+    """Run the queued segmentation jobs in napari thread-workers. At most maxConcurrentJobs jobs run at the same
+    time, the next queued job is started when a running job terminates."""
+
+
+    jobChanged = Signal(object)
+    jobFinished = Signal(object)
+
+
+    def __init__(self, maxConcurrentJobs=2, parent=None):
+        """Create a scheduler running at most maxConcurrentJobs jobs in parallel."""
+
+        super().__init__(parent)
+        self.maxConcurrentJobs = maxConcurrentJobs
+        self.jobs = []
+
+
+    def submit(self, job):
+        """Add the job to the queue and start it, if less than maxConcurrentJobs jobs are running."""
+
+        self.jobs.append(job)
+        self.jobChanged.emit(job)
+        self.startNextJobs()
+
+
+    def cancel(self, job):
+        """Cancel the job. A queued job will not be started, a running job is stopped at its next step."""
+
+        if job.isDone():
+            return
+        job.cancelToken.cancel()
+        if job.status == SegmentationJob.RUNNING:
+            job.worker.quit()
+        job.status = SegmentationJob.CANCELLED
+        self.jobChanged.emit(job)
+
+
+    def getRunningJobs(self):
+        """Answer the jobs whose worker is still active. A cancelled job keeps its worker until it has reached its
+        next step."""
+
+        return [job for job in self.jobs if job.worker is not None]
+
+
+    def getQueuedJobs(self):
+        """Answer the jobs that are waiting to be started."""
+
+        return [job for job in self.jobs if job.status == SegmentationJob.QUEUED]
+
+
+    def startNextJobs(self):
+        """Start queued jobs until maxConcurrentJobs jobs are running."""
+
+        queuedJobs = self.getQueuedJobs()
+        while queuedJobs and len(self.getRunningJobs()) < self.maxConcurrentJobs:
+            self.start(queuedJobs.pop(0))
+
+
+    def start(self, job):
+        """Start the job in a thread-worker."""
+
+        job.status = SegmentationJob.RUNNING
+        job.worker = create_worker(job.run,
+                                   _progress={'total': SegmentationJob.numberOfSteps, 'desc': 'Segment ' + job.name})
+        job.worker.errored.connect(lambda exception: self.onJobErrored(job))
+        job.worker.finished.connect(lambda: self.onJobFinished(job))
+        self.jobChanged.emit(job)
+        job.worker.start()
+
+
+    def onJobErrored(self, job):
+        if job.status == SegmentationJob.RUNNING:
+            job.status = SegmentationJob.FAILED
+
+
+    def onJobFinished(self, job):
+        if job.status == SegmentationJob.RUNNING:
+            job.status = SegmentationJob.FINISHED
+            self.jobFinished.emit(job)
+        job.worker = None
+        self.jobChanged.emit(job)
+        self.startNextJobs()
+
+
+    def clearDoneJobs(self):
+        """Remove the terminated jobs from the list of jobs."""
+
+        self.jobs = [job for job in self.jobs if not job.isDone()]
@@ -1,12 +1,11 @@
 import pyperclip
 import numpy as np
-from qtpy.QtWidgets import QLabel, QLineEdit, QComboBox, QTableWidget, QTableWidgetItem, QAction
+from qtpy.QtWidgets import QLabel, QLineEdit, QComboBox, QCheckBox, QTableWidget, QTableWidgetItem, QAction
 from qtpy.QtCore import Qt, QVariant
 from napari.utils import notifications
 from napari_tree_rings.array_util import ArrayUtil
 import appdirs
 import os
-import pandas as pd
 
 
 class WidgetTool:
@@ -56,6 +55,24 @@ class WidgetTool:
         return label, input
 
 
+    @staticmethod
+    def getCheckBoxInput(parent, labelText, checked):
+        """Returns a label displaying the given text and a check-box
+        in the given state.
+
+        :param parent: The parent widget of the label and the check-box
+        :param labelText: The text of the label
+        :param checked: Whether the check-box is initially checked
+        :return: A tupel of the label and the check-box
+        :rtype: (QLabel, QCheckBox)
+        """
+        label = QLabel(parent)
+        label.setText(labelText)
+        input = QCheckBox(parent)
+        input.setChecked(checked)
+        return label, input
+
+
     @staticmethod
     def replaceItemsInComboBox(comboBox, newItems):
         """Replace the items in the combo-box with newItems
@@ -166,6 +183,7 @@ class TableView(QTableWidget):
         return result
     
     def saveData(self, path=None):
+        import pandas as pd
         table = pd.DataFrame(self.data)
         table = table[table['image'] == np.array(table['image'])[-1]]
         if path is None: